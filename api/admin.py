@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import TelegramMessage
+
+
+@admin.register(TelegramMessage)
+class TelegramMessageAdmin(admin.ModelAdmin):
+    list_display = ["id", "created", "status", "attempts", "next_attempt", "sent"]
+    list_filter = ["status"]
+    readonly_fields = ["text", "attempts", "last_error", "created", "sent"]
+    fields = ["text", "status", "attempts", "next_attempt", "last_error", "created", "sent"]
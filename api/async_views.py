@@ -0,0 +1,178 @@
+"""
+Асинхронные версии представлений чтения каталога и корзины для запуска под ASGI (carTire.asgi).
+Ответы совпадают с синхронными представлениями api.views. Асинхронный ORM не используется: в Django 4.2
+он сам выполняет каждый запрос через sync_to_async. Вся работа с базой - сборка списка и карточки товара
+(api.listing, те же функции, что в синхронных представлениях, записи кэша ответов общие), счетчики фильтров
+и сборка корзины при промахе кэша - выполняется одним переходом в поток на запрос (sync_to_async).
+Асинхронно, без перехода в поток, выполняются только проверка ETag по версиям из кэша, чтение кэша ответов
+и корзин и поиск городов. Под WSGI эти представления тоже работают, но каждый запрос запускает свой цикл событий.
+Асинхронного клиента Telegram здесь нет: уведомления о заказах отправляются через очередь
+(api.notifications, команда send_notifications), а не из обработчика запроса.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from shop.catalog import aget_catalog_version
+from .cache import RESPONSE_CACHE_ALIAS, response_cache_key, count_response_cache
+from .cart import aget_cart, aget_cart_version, valid_cart_id
+from .cities import CITIES, CITIES_ETAG, CITIES_LIMIT, CITIES_MAX_LIMIT, CITIES_MAX_AGE, search_cities
+from .facets import get_facets
+from .filters import parse_filters
+from .listing import product_list_data, product_detail_data
+
+
+def json_response(data, status: int = 200, headers: dict | None = None) -> HttpResponse:
+    """
+    JSON в том же виде, что Response из DRF (JSONRenderer). Данные сохраняются в response.data для кэша ответов.
+    """
+    response = HttpResponse(JSONRenderer().render(data), status=status, content_type="application/json",
+                            headers=headers)
+    response.data = data
+    return response
+
+
+def async_get(view):
+    """
+    Пропускает только GET и HEAD, как @api_view(["GET"]).
+    """
+
+    @wraps(view)
+    async def wrapper(request: HttpRequest, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET"])
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def acache_catalog_response(view_name: str):
+    """
+    api.cache.cache_catalog_response для асинхронных представлений.
+    Записи общие с синхронным представлением view_name.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request: HttpRequest, *args, **kwargs):
+            cache = caches[RESPONSE_CACHE_ALIAS]
+            key = response_cache_key(view_name, request, kwargs, version=await aget_catalog_version())
+            data = await cache.aget(key)
+            if data is not None:
+                count_response_cache(view_name, "hits")
+                return json_response(data, headers={"X-Cache": "HIT"})
+
+            count_response_cache(view_name, "misses")
+            response = await view(request, *args, **kwargs)
+            if response.status_code == 200:
+                await cache.aset(key, response.data)
+            response["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+async def conditional(request: HttpRequest, response_func, etag: str, last_modified: int | None = None):
+    """
+    django.views.decorators.http.condition для асинхронных представлений: 304, если клиент прислал
+    актуальный ETag или Last-Modified, иначе ответ await response_func() с этими заголовками.
+    """
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = await response_func()
+        response.headers.setdefault("ETag", etag)
+        if last_modified is not None:
+            response.headers.setdefault("Last-Modified", http_date(last_modified))
+    return response
+
+
+def acatalog_condition(view):
+    """
+    ETag и Last-Modified по версии каталога, как api.cache.catalog_etag и catalog_modified.
+    """
+
+    @wraps(view)
+    async def wrapper(request: HttpRequest, *args, **kwargs):
+        version = await aget_catalog_version()
+        return await conditional(request, lambda: view(request, *args, **kwargs), f"catalog-{version}",
+                                 version // 1000)
+
+    return wrapper
+
+
+@async_get
+@acatalog_condition
+async def combined_filters(request: HttpRequest):
+    """
+    Асинхронная версия api.views.combined_filters.
+    """
+    return json_response(await sync_to_async(get_facets)(parse_filters(request.GET)))
+
+
+@async_get
+@acatalog_condition
+@acache_catalog_response("product_list")
+async def product_list(request: HttpRequest):
+    """
+    Асинхронная версия api.views.product_list.
+    """
+    data, code = await sync_to_async(product_list_data)(request.GET)
+    return json_response(data, status=code)
+
+
+@async_get
+@acatalog_condition
+@acache_catalog_response("product_detail")
+async def product_detail(request: HttpRequest, product_id: int):
+    """
+    Асинхронная версия api.views.product_detail.
+    """
+    data, code = await sync_to_async(product_detail_data)(product_id)
+    return json_response(data, status=code)
+
+
+@async_get
+async def get_cart_items(request: HttpRequest):
+    """
+    Асинхронная версия api.views.get_cart_items.
+    """
+    session_id = request.GET.get("session_id")
+    if not session_id:
+        return json_response({"error": "Не указан ID сессии"}, status=status.HTTP_400_BAD_REQUEST)
+    if not valid_cart_id(session_id):
+        return json_response({"error": "Некорректный ID сессии"}, status=status.HTTP_400_BAD_REQUEST)
+
+    version = f"cart-{await aget_catalog_version()}-{await aget_cart_version(session_id)}"
+    return await conditional(request, lambda: aget_cart_response(session_id), version)
+
+
+async def aget_cart_response(cart_id: str) -> HttpResponse:
+    return json_response(await aget_cart(cart_id))
+
+
+@async_get
+async def get_cities(request: HttpRequest):
+    """
+    Асинхронная версия api.views.get_cities. Поиск выполняется в памяти, без обращения к базе.
+    """
+
+    async def cities():
+        query = request.GET.get("q")
+        if query is None:
+            return json_response({"cities": CITIES})
+        limit = request.GET.get("limit", "")
+        limit = min(int(limit), CITIES_MAX_LIMIT) if limit.isdigit() else CITIES_LIMIT
+        return json_response({"cities": search_cities(query, limit)})
+
+    response = await conditional(request, cities, CITIES_ETAG)
+    patch_cache_control(response, public=True, max_age=CITIES_MAX_AGE)
+    return response
@@ -0,0 +1,280 @@
+import asyncio
+import io
+import json
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from shop.catalog import bump_catalog_version
+from shop.models import Product, ProductImage, Cart, CartItem, Order, OrderItem
+
+SEASONS = [season for season, _ in Product.seasons]
+MANUFACTURERS = ["Michelin", "Nokian", "Continental", "Pirelli", "Bridgestone", "Yokohama", "Cordiant", "Kumho"]
+WIDTHS = [175, 185, 195, 205, 215, 225, 235, 245, 255, 265]
+PROFILES = [35, 40, 45, 50, 55, 60, 65, 70]
+DIAMETERS = [14, 15, 16, 17, 18, 19, 20]
+ORDER_DATA = {
+    "contact_info": {"individual": {"surname": "Иванов", "name": "Иван", "patronymic": "", "phone": "+70000000000"}},
+    "address": {"city": "Москва", "street": "Тверская", "house_number": "1", "apartment_or_office": "1",
+                "entrance": "1", "floor": "1", "intercom": "1"},
+}
+
+
+# Описание синтетических товаров: по нему находятся товары, созданные нагрузочными тестами
+SEED_DESCRIPTION = "Синтетический товар для нагрузочного теста"
+# Параметров в одном запросе удаления по списку id
+DELETE_CHUNK = 1000
+
+
+def seed_catalog(count: int, images: int = 2, seed: int = 0, batch_size: int = 1000) -> list[int]:
+    """
+    Создает count синтетических товаров с изображениями. Возвращает id созданных товаров.
+    bulk_create не вызывает сигналы, поэтому версия каталога меняется явно (после коммита, если идет транзакция).
+    """
+    rnd = random.Random(seed)
+    start = Product.objects.count()
+    ids = []
+    for offset in range(0, count, batch_size):
+        last_id = Product.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        products = Product.objects.bulk_create([
+            Product(
+                name=f"Шина {start + i}", season=rnd.choice(SEASONS), width=rnd.choice(WIDTHS),
+                load_index=rnd.randint(70, 110), profile=rnd.choice(PROFILES), speed_index=rnd.choice("HTVWY"),
+                diameter=rnd.choice(DIAMETERS), tire_model=f"Model {rnd.randint(1, 200)}",
+                product_code=1_000_000 + start + i, manufacturer=rnd.choice(MANUFACTURERS),
+                description=SEED_DESCRIPTION, price=rnd.randint(30, 400) * 100,
+                popularity=int(rnd.paretovariate(1.5)), visible=rnd.random() < 0.95,
+            )
+            for i in range(offset, min(offset + batch_size, count))
+        ])
+        if not products or products[0].id is None:
+            # Бэкенд не вернул id после bulk_create (MySQL): товары пачки ищутся по коду и описанию среди новых строк,
+            # чтобы не захватить товары, которые одновременно создал кто-то другой
+            codes = [product.product_code for product in products]
+            products = list(Product.objects.filter(id__gt=last_id, product_code__in=codes,
+                                                   description=SEED_DESCRIPTION).order_by("id"))
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f"product_images/bench_{product.id}_{n}.jpg")
+            for product in products for n in range(images)
+        ])
+        ids.extend(product.id for product in products)
+    transaction.on_commit(bump_catalog_version)
+    return ids
+
+
+def seed_orders(count: int, product_ids: list[int], seed: int = 0, batch_size: int = 1000) -> list[int]:
+    """
+    Создает count заказов по 1-3 позиции из product_ids. Возвращает id созданных заказов.
+    """
+    rnd = random.Random(seed)
+    order_ids = []
+    for offset in range(0, count, batch_size):
+        size = min(batch_size, count - offset)
+        if connection.features.can_return_rows_from_bulk_insert:
+            orders = Order.objects.bulk_create([Order(total_price=0) for _ in range(size)])
+            order_ids.extend(order.id for order in orders)
+        else:
+            # MySQL не возвращает id после bulk_create: заказы создаются по одному, чтобы знать точные id
+            with transaction.atomic():
+                order_ids.extend(Order.objects.create(total_price=0).id for _ in range(size))
+    OrderItem.objects.bulk_create([
+        OrderItem(order_id=order_id, product_id=product_id, quantity=rnd.randint(1, 4))
+        for order_id in order_ids for product_id in rnd.sample(product_ids, min(len(product_ids), rnd.randint(1, 3)))
+    ], batch_size=batch_size)
+    return order_ids
+
+
+@contextmanager
+def track_created(*models):
+    """
+    Собирает id объектов models, созданных через save() в этом процессе, пока открыт блок:
+    {модель: множество id}. Нужен, чтобы после теста удалить только свои данные, а не все строки после
+    последнего id (их могли создать другие процессы, работающие с той же базой).
+    """
+    ids = {model: set() for model in models}
+
+    def receiver(sender, instance, created, **kwargs):
+        if created:
+            ids[sender].add(instance.pk)
+
+    for model in models:
+        post_save.connect(receiver, sender=model, weak=False)
+    try:
+        yield ids
+    finally:
+        for model in models:
+            post_save.disconnect(receiver, sender=model)
+
+
+def delete_ids(model, ids) -> int:
+    """
+    Удаляет строки model по списку id пачками по DELETE_CHUNK.
+    """
+    ids = list(ids)
+    deleted = 0
+    for offset in range(0, len(ids), DELETE_CHUNK):
+        deleted += model.objects.filter(id__in=ids[offset:offset + DELETE_CHUNK]).delete()[0]
+    return deleted
+
+
+def delete_products(ids) -> int:
+    """
+    Удаляет товары, созданные seed_catalog, и меняет версию каталога, чтобы кэши и индексы
+    не отдавали удаленные товары.
+    """
+    deleted = delete_ids(Product, ids)
+    bump_catalog_version()
+    return deleted
+
+
+def random_filters(rnd: random.Random) -> dict[str, str]:
+    """
+    Случайное сочетание параметров списка товаров: 0-3 фильтра по одному-двум значениям.
+    """
+    choices = {
+        "width": WIDTHS, "profile": PROFILES, "diameter": DIAMETERS, "season": SEASONS, "manufacturer": MANUFACTURERS,
+    }
+    params = {}
+    for name in rnd.sample(list(choices), rnd.randint(0, 3)):
+        params[name] = ",".join(str(value) for value in rnd.sample(choices[name], rnd.randint(1, 2)))
+    return params
+
+
+def wsgi_request(handler, host: str, method: str, path: str, query: str = "", data: dict | None = None) -> int:
+    """
+    Запрос к WSGI-приложению так же, как его передает WSGI-сервер. data - тело запроса в JSON.
+    Возвращает код ответа.
+    """
+    body = json.dumps(data).encode() if data is not None else b""
+    statuses = []
+    environ = {
+        "REQUEST_METHOD": method, "SCRIPT_NAME": "", "PATH_INFO": path, "QUERY_STRING": query,
+        "SERVER_NAME": host, "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1", "HTTP_HOST": host,
+        "CONTENT_TYPE": "application/json", "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body), "wsgi.errors": sys.stderr, "wsgi.url_scheme": "http",
+        "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False,
+    }
+    response = handler(environ, lambda status, headers, exc_info=None: statuses.append(int(status.split()[0])))
+    try:
+        b"".join(response)
+    finally:
+        response.close()
+    return statuses[0]
+
+
+def measure(func: Callable, repeat: int) -> list[float]:
+    """
+    Время выполнения func в миллисекундах для каждого из repeat запусков.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def create_carts(count: int, product_ids: list[int], quantity: int = 1, updated=None) -> list[str]:
+    """
+    Создает count корзин, в каждой - все товары product_ids. Возвращает ключи корзин.
+    updated - время последнего изменения корзин, по умолчанию текущее.
+    """
+    updated = updated or timezone.now()
+    keys = [get_random_string(32) for _ in range(count)]
+    Cart.objects.bulk_create([Cart(key=key, updated=updated) for key in keys])
+    CartItem.objects.bulk_create([
+        CartItem(cart_id=key, product_id=product_id, quantity=quantity) for key in keys for product_id in product_ids
+    ], batch_size=1000)
+    return keys
+
+
+def create_sessions(cart_keys: list[str], expire_date) -> list[str]:
+    """
+    Создает по сессии на каждую корзину cart_keys, как session_manage (в сессии хранится ключ корзины).
+    expire_date - время истечения сессий. Возвращает ключи сессий.
+    """
+    store = SessionStore()
+    sessions = [
+        Session(session_key=get_random_string(32), session_data=store.encode({"cart_id": key}), expire_date=expire_date)
+        for key in cart_keys
+    ]
+    Session.objects.bulk_create(sessions, batch_size=1000)
+    return [session.session_key for session in sessions]
+
+
+def run_concurrently(func: Callable, items: list, concurrency: int) -> tuple[list[float], int, float]:
+    """
+    Вызывает func(item) для всех items в concurrency потоках.
+    Возвращает время каждого успешного вызова в миллисекундах, количество ошибок и общее время в секундах.
+    """
+    queue = list(items)
+    lock = threading.Lock()
+    timings = []
+    errors = 0
+
+    def worker():
+        nonlocal errors
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    item = queue.pop()
+                started = time.perf_counter()
+                try:
+                    ok = func(item)
+                except Exception:
+                    ok = False
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    if ok is False:
+                        errors += 1
+                    else:
+                        timings.append(elapsed)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, errors, time.perf_counter() - started
+
+
+async def run_concurrently_async(func: Callable, items: list, concurrency: int) -> tuple[list[float], int, float]:
+    """
+    run_concurrently для корутин: await func(item) для всех items, одновременно не больше concurrency.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+    errors = 0
+
+    async def call(item):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await func(item)
+            except Exception:
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+        if ok is False:
+            errors += 1
+        else:
+            timings.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(item) for item in items))
+    return timings, errors, time.perf_counter() - started
@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+
+from django.core.cache import caches
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from shop.catalog import get_catalog_version, catalog_last_modified
+from .filters import parse_filters, parse_sort
+
+RESPONSE_CACHE_ALIAS = "responses"
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def catalog_etag(request: Request, *args, **kwargs) -> str:
+    """
+    ETag ответов, которые зависят только от параметров запроса и состояния каталога.
+    Для django.views.decorators.http.condition: при совпадении If-None-Match
+    ответ 304 отдается до обращения к базе.
+    """
+    return f"catalog-{get_catalog_version()}"
+
+
+def catalog_modified(request: Request, *args, **kwargs) -> datetime:
+    return catalog_last_modified()
+
+
+def response_cache_key(view_name: str, request: Request, kwargs: dict, version: int | None = None) -> str:
+    """
+    Ключ ответа: версия каталога и нормализованные параметры запроса,
+    чтобы width=215,205 и width=205,215 попадали в одну запись.
+    """
+    params = [
+        ("filters", sorted(parse_filters(request.GET).items())),
+        ("sort", parse_sort(request.GET)),
+        ("page", request.GET.get("page", "1")),
+        ("cursor", request.GET.get("cursor")),
+        ("q", request.GET.get("q")),
+        ("kwargs", sorted(kwargs.items())),
+    ]
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    if version is None:
+        version = get_catalog_version()
+    return f"{view_name}:{version}:{digest}"
+
+
+def count_response_cache(view_name: str, result: str):
+    with _stats_lock:
+        _stats[(view_name, result)] += 1
+
+
+def response_cache_stats() -> dict[str, dict]:
+    """
+    Попадания и промахи кэша ответов по представлениям с момента запуска процесса.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    result = {}
+    for (view_name, kind), count in sorted(stats.items()):
+        result.setdefault(view_name, {"hits": 0, "misses": 0})[kind] = count
+    for view_stats in result.values():
+        total = view_stats["hits"] + view_stats["misses"]
+        view_stats["hit_rate"] = round(view_stats["hits"] / total, 4) if total else 0
+    return result
+
+
+def cache_catalog_response(view_name: str):
+    """
+    Кэширует успешные ответы представления, которые зависят только от параметров запроса и каталога.
+    Записи хранятся в кэше RESPONSE_CACHE_ALIAS (время жизни и размер задаются в settings.CACHES)
+    и перестают использоваться после изменения версии каталога.
+    Декоратор ставится под @api_view. Заголовок X-Cache: HIT или MISS.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request: Request, *args, **kwargs):
+            cache = caches[RESPONSE_CACHE_ALIAS]
+            key = response_cache_key(view_name, request, kwargs)
+            data = cache.get(key)
+            if data is not None:
+                count_response_cache(view_name, "hits")
+                return Response(data, headers={"X-Cache": "HIT"})
+
+            count_response_cache(view_name, "misses")
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data)
+            response["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+
+    return decorator
+
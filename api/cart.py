@@ -0,0 +1,302 @@
+import re
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+
+from shop.catalog import get_catalog_version, aget_catalog_version
+from shop.models import Cart, CartItem
+
+# Ключ содержит версию каталога (после изменения цен или товаров корзины пересчитываются) и версию корзины:
+# снимок, собранный до изменения корзины, записывается под прежним ключом и уже не читается
+CART_CACHE_KEY = "cart:{cart_id}:{version}:{cart_version}"
+CART_CACHE_TIMEOUT = 24 * 60 * 60
+# Версия корзины - время последнего изменения через api.views, для ETag ответа /api/cart/
+CART_VERSION_KEY = "cart_version:{cart_id}"
+# Ключ корзины (session_id): строка из session_manage (get_random_string) или заданная клиентом,
+# не длиннее Cart.key и без символов, недопустимых в ключах кэша
+CART_ID_RE = re.compile(r"[0-9A-Za-z_-]+")
+CART_ID_MAX_LENGTH = Cart._meta.get_field("key").max_length
+
+
+def valid_cart_id(cart_id) -> bool:
+    return isinstance(cart_id, str) and len(cart_id) <= CART_ID_MAX_LENGTH and bool(CART_ID_RE.fullmatch(cart_id))
+
+
+def touch_cart(cart_id: str, create: bool = True) -> bool:
+    """
+    Отмечает изменение корзины. Строка корзины создается при первом изменении (create).
+    Возвращает False, если корзины нет и она не создавалась.
+    """
+    if Cart.objects.filter(key=cart_id).update(updated=timezone.now()):
+        return True
+    if create:
+        Cart.objects.get_or_create(key=cart_id)
+    return create
+
+
+def add_cart_item(cart_id: str, product_id: int, quantity: int = 1):
+    """
+    Увеличивает количество товара в корзине атомарно, одним UPDATE с F-выражением.
+    Если позиции еще нет, она создается. Если ее параллельно создал другой запрос,
+    INSERT упадет на уникальности (cart, product) и количество добавится повторным UPDATE.
+    """
+    touch_cart(cart_id)
+    items = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
+    if items.update(quantity=F("quantity") + quantity):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        if not items.update(quantity=F("quantity") + quantity):
+            raise
+
+
+def remove_cart_item(cart_id: str, product_id: int, remove_all: bool = False, quantity: int = 1) -> bool:
+    """
+    Уменьшает количество товара в корзине на quantity или удаляет позицию целиком (remove_all).
+    Позиция, в которой остается меньше одного товара, удаляется.
+    Каждая попытка - один атомарный UPDATE или DELETE.
+    Возвращает False, если товара в корзине нет.
+    """
+    if not touch_cart(cart_id, create=False):
+        return False
+    items = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
+    if remove_all:
+        return items.delete()[0] > 0
+    while True:
+        if items.filter(quantity__gt=quantity).update(quantity=F("quantity") - quantity):
+            return True
+        if items.filter(quantity__lte=quantity).delete()[0]:
+            return True
+        # Между запросами количество могло измениться параллельным добавлением, тогда пробуем снова
+        if not items.exists():
+            return False
+
+
+def parse_cart_operations(operations) -> list[tuple[int, str, int]]:
+    """
+    Проверяет операции пакетного изменения корзины вида
+    {"product_id": 1, "delta": 2} или {"product_id": 1, "set_quantity": 0}.
+    Возвращает список (product_id, "delta" | "set_quantity", значение), бросает ValueError при ошибке.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations должен быть непустым списком")
+    result = []
+    for number, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise ValueError(f"Операция {number}: ожидается объект")
+        kinds = [kind for kind in ("delta", "set_quantity") if kind in operation]
+        if len(kinds) != 1:
+            raise ValueError(f"Операция {number}: нужно указать ровно одно из delta и set_quantity")
+        try:
+            product_id = int(operation.get("product_id"))
+            value = int(operation[kinds[0]])
+        except (TypeError, ValueError):
+            raise ValueError(f"Операция {number}: product_id и {kinds[0]} должны быть целыми числами")
+        if kinds[0] == "set_quantity" and value < 0:
+            raise ValueError(f"Операция {number}: set_quantity не может быть отрицательным")
+        result.append((product_id, kinds[0], value))
+    return result
+
+
+def apply_cart_operations(cart_id: str, operations: list[tuple[int, str, int]], attempts: int = 3):
+    """
+    Применяет проверенные операции к корзине в одной транзакции за постоянное число запросов:
+    позиции корзины блокируются одним SELECT ... FOR UPDATE, итоговые количества считаются в памяти,
+    затем выполняются не больше одного DELETE, UPDATE и INSERT.
+    Если позицию параллельно создал другой запрос, INSERT упадет на уникальности и пакет применится заново.
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                _apply_cart_operations(cart_id, operations)
+            return
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+def _apply_cart_operations(cart_id: str, operations: list[tuple[int, str, int]]):
+    touch_cart(cart_id)
+    items = {item.product_id: item for item in CartItem.objects.select_for_update().filter(cart_id=cart_id)}
+    quantities = {product_id: item.quantity for product_id, item in items.items()}
+    for product_id, kind, value in operations:
+        if kind == "set_quantity":
+            quantities[product_id] = value
+        else:
+            quantities[product_id] = max(quantities.get(product_id, 0) + value, 0)
+
+    removed = [product_id for product_id in items if quantities[product_id] <= 0]
+    changed = [
+        item for product_id, item in items.items()
+        if 0 < quantities[product_id] != item.quantity
+    ]
+    created = [
+        CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+        for product_id, quantity in quantities.items() if product_id not in items and quantity > 0
+    ]
+    if removed:
+        CartItem.objects.filter(cart_id=cart_id, product_id__in=removed).delete()
+    if changed:
+        for item in changed:
+            item.quantity = quantities[item.product_id]
+        CartItem.objects.bulk_update(changed, ["quantity"])
+    if created:
+        CartItem.objects.bulk_create(created)
+
+
+def build_cart(cart_id: str) -> dict:
+    """
+    Товары корзины и общая стоимость в формате /api/cart/.
+    """
+    from .serializers import CartItemSerializer
+
+    items = CartItem.objects.filter(cart_id=cart_id).select_related("product").prefetch_related("product__images")
+    total_price = sum(item.product.price * item.quantity for item in items)
+
+    serializer = CartItemSerializer(items, many=True)
+    return {
+        "items": serializer.data,
+        "total_price": total_price
+    }
+
+
+def cart_cache_key(cart_id: str) -> str:
+    return CART_CACHE_KEY.format(cart_id=cart_id, version=get_catalog_version(), cart_version=get_cart_version(cart_id))
+
+
+def get_cart(cart_id: str) -> dict:
+    """
+    Корзина из кэша. При промахе собирается из базы и сохраняется.
+    """
+    key = cart_cache_key(cart_id)
+    cart = cache.get(key)
+    if cart is None:
+        cart = build_cart(cart_id)
+        cache.set(key, cart, timeout=CART_CACHE_TIMEOUT)
+    return cart
+
+
+async def aget_cart(cart_id: str) -> dict:
+    """
+    get_cart для асинхронных представлений. Кэш читается асинхронно, сборка корзины при промахе
+    (запросы к базе и CartItemSerializer) - синхронный build_cart в потоке через sync_to_async.
+    """
+    key = CART_CACHE_KEY.format(cart_id=cart_id, version=await aget_catalog_version(),
+                                cart_version=await aget_cart_version(cart_id))
+    cart = await cache.aget(key)
+    if cart is None:
+        cart = await sync_to_async(build_cart)(cart_id)
+        await cache.aset(key, cart, timeout=CART_CACHE_TIMEOUT)
+    return cart
+
+
+def refresh_cart(cart_id: str) -> dict:
+    """
+    Пересобирает корзину и записывает ее в кэш. Вызывается после каждого изменения корзины,
+    поэтому чтение корзины и счетчика товаров не обращается к базе.
+    Версия корзины меняется до сборки: параллельный запрос, собравший корзину раньше этого изменения,
+    запишет ее под ключом прежней версии, и она не заменит более новую.
+    """
+    cache.delete(cart_cache_key(cart_id))
+    bump_cart_version(cart_id)
+    cart = build_cart(cart_id)
+    cache.set(cart_cache_key(cart_id), cart, timeout=CART_CACHE_TIMEOUT)
+    return cart
+
+
+def invalidate_cart(cart_id: str):
+    """
+    Удаляет корзину из кэша, например после изменения CartItem в обход api.views.
+    Новая версия корзины сама по себе делает прежний снимок недоступным, удаление только освобождает память.
+    """
+    cache.delete(cart_cache_key(cart_id))
+    bump_cart_version(cart_id)
+
+
+def get_cart_version(cart_id: str) -> int:
+    """
+    Версия корзины. Если ее нет в кэше (корзина давно не менялась, очистка кэша), начинается новая версия.
+    """
+    key = CART_VERSION_KEY.format(cart_id=cart_id)
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        cache.add(key, version, timeout=CART_CACHE_TIMEOUT)
+        version = cache.get(key, version)
+    return version
+
+
+async def aget_cart_version(cart_id: str) -> int:
+    key = CART_VERSION_KEY.format(cart_id=cart_id)
+    version = await cache.aget(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        await cache.aadd(key, version, timeout=CART_CACHE_TIMEOUT)
+        version = await cache.aget(key, version)
+    return version
+
+
+def bump_cart_version(cart_id: str):
+    key = CART_VERSION_KEY.format(cart_id=cart_id)
+    version = max(int(time.time() * 1000), (cache.get(key) or 0) + 1)
+    cache.set(key, version, timeout=CART_CACHE_TIMEOUT)
+
+
+def cart_etag(request, *args, **kwargs) -> str | None:
+    """
+    ETag ответа /api/cart/ по версиям каталога (цены товаров) и корзины, без сборки корзины.
+    Для django.views.decorators.http.condition.
+    """
+    cart_id = request.GET.get("session_id")
+    if not valid_cart_id(cart_id):
+        return None
+    return f"cart-{get_catalog_version()}-{get_cart_version(cart_id)}"
+
+
+def _delete_in_batches(queryset: QuerySet, order_field: str, batch_size: int, pause: float, on_batch,
+                       result: dict[str, int]):
+    while True:
+        keys = list(queryset.order_by(order_field).values_list("pk", flat=True)[:batch_size])
+        if not keys:
+            break
+        started = time.perf_counter()
+        with transaction.atomic():
+            # Строку могли обновить после выборки, поэтому условие queryset повторяется
+            _, deleted = queryset.filter(pk__in=keys).delete()
+        result["sessions"] += deleted.get(Session._meta.label, 0)
+        result["carts"] += deleted.get(Cart._meta.label, 0)
+        result["cart_items"] += deleted.get(CartItem._meta.label, 0)
+        result["batches"] += 1
+        if on_batch:
+            on_batch(time.perf_counter() - started, deleted)
+        if len(keys) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+
+def purge_expired_sessions(batch_size: int = 1000, pause: float = 0, on_batch=None,
+                           cart_lifetime: int | None = None) -> dict[str, int]:
+    """
+    Удаляет пачками по batch_size истекшие сессии и брошенные корзины - не изменявшиеся
+    дольше cart_lifetime секунд (по умолчанию SESSION_COOKIE_AGE, после него ключ корзины в сессии уже недоступен).
+    Ключи пачки выбираются по индексу expire_date или updated, каждая пачка удаляется в своей короткой транзакции,
+    поэтому строки не блокируются надолго. pause - пауза между пачками в секундах,
+    on_batch(seconds, deleted) вызывается после каждой пачки.
+    Возвращает количество удаленных сессий, корзин, позиций корзин и пачек.
+    """
+    now = timezone.now()
+    lifetime = timedelta(seconds=cart_lifetime if cart_lifetime is not None else settings.SESSION_COOKIE_AGE)
+    result = {"sessions": 0, "carts": 0, "cart_items": 0, "batches": 0}
+    _delete_in_batches(Session.objects.filter(expire_date__lt=now), "expire_date", batch_size, pause, on_batch, result)
+    _delete_in_batches(Cart.objects.filter(updated__lt=now - lifetime), "updated", batch_size, pause, on_batch, result)
+    return result
@@ -0,0 +1,184 @@
+import hashlib
+import threading
+from array import array
+from bisect import bisect_right
+
+from django.conf import settings
+
+from shop.catalog import get_catalog_version
+from shop.models import Product
+from .filters import FILTER_FIELDS, SORT_ORDERINGS
+from .pagination import PAGE_SIZE, encode_cursor, decode_cursor
+from .serializers import product_rows
+
+
+class CatalogIndex:
+    """
+    Колоночный индекс видимых товаров в памяти процесса.
+    Для каждого значения фильтра хранится битовая маска строк (int, бит i - строка i),
+    фильтрация - это AND масок, количество - число единичных бит.
+    Для каждой сортировки хранится порядок строк и ключи сортировки для поиска по курсору.
+    В базу остается только запрос за товарами итоговой страницы.
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        sort_fields = {ordering.lstrip("-") for orderings in SORT_ORDERINGS.values() for ordering in orderings}
+        columns = ["id", *FILTER_FIELDS, *sorted(sort_fields - {"id", *FILTER_FIELDS})]
+        column = {name: i for i, name in enumerate(columns)}
+        rows = list(Product.objects.filter(visible=True).values_list(*columns))
+
+        self.size = len(rows)
+        self.all = (1 << self.size) - 1
+        self.ids = array("q", (row[0] for row in rows))
+
+        self.bitmaps: dict[str, dict] = {}
+        self.value_ids: dict[str, dict] = {}
+        for name in FILTER_FIELDS:
+            bits = {}
+            for position, row in enumerate(rows):
+                value = row[column[name]]
+                if value not in bits:
+                    bits[value] = bytearray((self.size + 7) // 8)
+                bits[value][position >> 3] |= 1 << (position & 7)
+            bitmaps = {value: int.from_bytes(bitmap, "little") for value, bitmap in bits.items()}
+            self.bitmaps[name] = dict(sorted(bitmaps.items()))
+            self.value_ids[name] = {value: hashlib.md5(f"{value}".encode()).hexdigest() for value in bitmaps}
+
+        # Ключи сортировки приводятся к возрастающему порядку: поля с "-" берутся с обратным знаком
+        self.signs: dict[str, list] = {}
+        self.orders: dict[str, array] = {}
+        self.keys: dict[str, list] = {}
+        for sort, orderings in SORT_ORDERINGS.items():
+            signs = [-1 if ordering.startswith("-") else 1 for ordering in orderings]
+            indexes = [column[ordering.lstrip("-")] for ordering in orderings]
+            keys = [tuple(sign * row[i] for sign, i in zip(signs, indexes)) for row in rows]
+            order = sorted(range(self.size), key=keys.__getitem__)
+            self.signs[sort] = signs
+            self.orders[sort] = array("q", order)
+            self.keys[sort] = [keys[position] for position in order]
+
+    def match(self, filters: dict[str, list]) -> int:
+        mask = self.all
+        for name, values in filters.items():
+            bitmaps = self.bitmaps[name]
+            selected = 0
+            for value in values:
+                selected |= bitmaps.get(value, 0)
+            mask &= selected
+        return mask
+
+    def count(self, filters: dict[str, list]) -> int:
+        return self.match(filters).bit_count()
+
+    def _take(self, mask: int, sort: str, start: int, skip: int, limit: int) -> list[int]:
+        """
+        Номера строк порядка сортировки sort, начиная со start, товары которых входят в маску.
+        """
+        order = self.orders[sort]
+        if mask == self.all:
+            return list(range(start + skip, min(start + skip + limit, self.size)))
+        # Проверка бита в байтах вместо сдвига большого int на каждой строке
+        bits = mask.to_bytes((self.size + 7) // 8, "little")
+        result = []
+        for i in range(start, self.size):
+            position = order[i]
+            if bits[position >> 3] >> (position & 7) & 1:
+                if skip:
+                    skip -= 1
+                    continue
+                result.append(i)
+                if len(result) == limit:
+                    break
+        return result
+
+    def _ids(self, sort: str, taken: list[int]) -> list[int]:
+        order = self.orders[sort]
+        return [self.ids[order[i]] for i in taken]
+
+    def page(self, filters: dict[str, list], sort: str, page: int, page_size: int = PAGE_SIZE) -> tuple[list[int], int]:
+        """
+        Возвращает id товаров страницы и количество страниц.
+        Номера страниц ведут себя как у Paginator.get_page: номер меньше 1 - последняя страница.
+        """
+        mask = self.match(filters)
+        num_pages = max(1, -(-mask.bit_count() // page_size))
+        if page < 1:
+            page = num_pages
+        if page > num_pages:
+            return [], num_pages
+        return self._ids(sort, self._take(mask, sort, 0, (page - 1) * page_size, page_size)), num_pages
+
+    def cursor_page(self, filters: dict[str, list], sort: str, cursor: str,
+                    page_size: int = PAGE_SIZE) -> tuple[list[int], str | None]:
+        """
+        Страница по курсору в том же формате, что и api.pagination.cursor_paginate.
+        """
+        signs = self.signs[sort]
+        start = 0
+        if cursor:
+            values = decode_cursor(cursor, sort)
+            start = bisect_right(self.keys[sort], tuple(sign * value for sign, value in zip(signs, values)))
+        taken = self._take(self.match(filters), sort, start, 0, page_size + 1)
+        if len(taken) <= page_size:
+            return self._ids(sort, taken), None
+        taken = taken[:page_size]
+        values = [sign * key for sign, key in zip(signs, self.keys[sort][taken[-1]])]
+        return self._ids(sort, taken), encode_cursor(sort, values)
+
+    def facets(self, filters: dict[str, list]) -> dict[str, list]:
+        """
+        Счетчики значений фильтров в формате api.facets.get_facets.
+        """
+        masks = {name: self.match({name: values}) for name, values in filters.items()}
+        result = {}
+        for name, bitmaps in self.bitmaps.items():
+            base = self.all
+            for other, mask in masks.items():
+                if other != name:
+                    base &= mask
+            result[name] = [
+                {"id": self.value_ids[name][value], "label": value, "count": (base & bitmap).bit_count()}
+                for value, bitmap in bitmaps.items()
+            ]
+        return result
+
+
+def use_catalog_index() -> bool:
+    """
+    CATALOG_ENGINE = "memory" - список товаров и счетчики фильтров считаются по индексу в памяти,
+    "db" (по умолчанию) - запросами к базе.
+    """
+    return getattr(settings, "CATALOG_ENGINE", "db") == "memory"
+
+
+_index: CatalogIndex | None = None
+_lock = threading.Lock()
+
+
+def get_catalog_index() -> CatalogIndex:
+    """
+    Индекс текущей версии каталога. Пересобирается при первом обращении после изменения каталога,
+    пока идет пересборка, остальные потоки ждут ее на блокировке.
+    """
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        if _index is None or _index.version != version:
+            _index = CatalogIndex(version)
+        return _index
+
+
+def hydrate_products(ids: list[int], rows: bool = False) -> list[Product] | list[dict]:
+    """
+    Загружает товары по id, сохраняя порядок id.
+    rows=True - словари для быстрой сериализации (api.serializers.product_rows) вместо моделей.
+    """
+    if rows:
+        products = {row["id"]: row for row in product_rows(Product.objects.filter(id__in=ids))}
+    else:
+        products = Product.objects.prefetch_related("images").in_bulk(ids)
+    return [products[product_id] for product_id in ids if product_id in products]
@@ -0,0 +1,53 @@
+import hashlib
+import json
+from bisect import bisect_left
+
+from .data import cities_list
+
+CITIES_LIMIT = 10
+CITIES_MAX_LIMIT = 50
+# Ответы кэшируются браузером и прокси на сутки
+CITIES_MAX_AGE = 24 * 60 * 60
+
+
+def normalize(text: str) -> str:
+    """
+    Ключ поиска: без учета регистра, "ё" равна "е".
+    """
+    return text.strip().casefold().replace("ё", "е")
+
+
+# Список без повторов в алфавитном порядке и отсортированный индекс по ключу поиска строятся один раз при импорте
+CITIES = sorted(set(cities_list), key=lambda city: (normalize(city), city))
+_INDEX = [(normalize(city), city) for city in CITIES]
+_KEYS = [key for key, _ in _INDEX]
+
+# Список городов меняется только с кодом, поэтому ETag постоянный
+CITIES_ETAG = '"%s"' % hashlib.md5(json.dumps(CITIES, ensure_ascii=False).encode()).hexdigest()
+
+
+def search_cities(query: str, limit: int = CITIES_LIMIT) -> list[str]:
+    """
+    Города, начинающиеся с query (поиск по индексу бинарным поиском), затем, если их меньше limit,
+    города, содержащие query в середине названия. Не больше limit результатов.
+    """
+    key = normalize(query)
+    if not key:
+        return CITIES[:limit]
+    start = bisect_left(_KEYS, key)
+    result = []
+    for city_key, city in _INDEX[start:start + limit]:
+        if not city_key.startswith(key):
+            break
+        result.append(city)
+    if len(result) < limit:
+        for city_key, city in _INDEX:
+            if key in city_key and not city_key.startswith(key):
+                result.append(city)
+                if len(result) == limit:
+                    break
+    return result
+
+
+def cities_etag(request, *args, **kwargs) -> str:
+    return CITIES_ETAG
@@ -0,0 +1,57 @@
+import re
+
+from django.http import FileResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость, без нее ответы сжимаются только gzip
+    brotli = None
+
+ACCEPTS_BROTLI_RE = re.compile(r"\bbr\b")
+# Уровень сжатия brotli для ответов, которые сжимаются на каждый запрос: 11 в разы медленнее при небольшом выигрыше
+BROTLI_QUALITY = 5
+# Короткие ответы не сжимаются, как в GZipMiddleware
+MIN_LENGTH = 200
+# brotli только для ответов API. HTML (админка, вход) содержит CSRF-токен, а GZipMiddleware добавляет к сжатому
+# ответу случайные байты против BREACH, поэтому такие ответы сжимаются только gzip
+BROTLI_CONTENT_TYPES = ("application/json",)
+
+
+def accepts_brotli(request) -> bool:
+    return brotli is not None and bool(ACCEPTS_BROTLI_RE.search(request.META.get("HTTP_ACCEPT_ENCODING", "")))
+
+
+def brotli_content_type(response) -> bool:
+    return response.get("Content-Type", "").split(";")[0].strip().lower() in BROTLI_CONTENT_TYPES
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware, который выбирает brotli для ответов API (BROTLI_CONTENT_TYPES), если клиент его принимает
+    и установлен пакет brotli.
+    Потоковые ответы (выгрузка каталога) сжимаются gzip, файлы (FileResponse) не сжимаются.
+    Как и в GZipMiddleware, строгий ETag сжатого ответа становится слабым (W/"..."):
+    If-None-Match сравнивается без учета W/, поэтому 304 по-прежнему отдается до работы представления.
+    """
+
+    def process_response(self, request, response):
+        if isinstance(response, FileResponse):
+            # Статические файлы сжимаются заранее в collectstatic (shop.staticfiles), на лету не сжимаются
+            return response
+        if (not accepts_brotli(request) or not brotli_content_type(response) or response.streaming
+                or response.has_header("Content-Encoding") or len(response.content) < MIN_LENGTH):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(response.content))
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
@@ -0,0 +1,73 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from shop.catalog import get_catalog_version
+from shop.models import Product
+from .catalog_index import use_catalog_index, get_catalog_index
+from .filters import FILTER_FIELDS
+
+FACETS_CACHE_KEY = "facets:{version}"
+FACETS_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def build_facet_table() -> dict:
+    """
+    Одним сгруппированным запросом собирает количество видимых товаров
+    для каждой встречающейся комбинации значений фильтров.
+    Комбинаций намного меньше, чем товаров, по ним считаются счетчики для любого выбора.
+    """
+    names = list(FILTER_FIELDS)
+    rows = list(
+        Product.objects.filter(visible=True).values_list(*names).annotate(count=Count("id")).order_by()
+    )
+    values = {}
+    for i, name in enumerate(names):
+        values[name] = [
+            (value, hashlib.md5(f"{value}".encode()).hexdigest()) for value in sorted({row[i] for row in rows})
+        ]
+    return {"values": values, "rows": rows}
+
+
+def get_facet_table() -> dict:
+    """
+    Таблица комбинаций из кэша. Ключ содержит версию каталога,
+    поэтому после изменения товаров она собирается заново.
+    """
+    key = FACETS_CACHE_KEY.format(version=get_catalog_version())
+    return cache.get_or_set(key, build_facet_table, timeout=FACETS_CACHE_TIMEOUT)
+
+
+def get_facets(filters: dict[str, list] | None = None) -> dict[str, list]:
+    """
+    Возвращает значения фильтров с количеством товаров для каждого значения.
+    Счетчик значения фильтра считается с учетом всех выбранных фильтров, кроме его собственного:
+    сколько товаров будет найдено, если дополнительно отметить это значение.
+    """
+    if use_catalog_index():
+        return get_catalog_index().facets(filters or {})
+
+    filters = {name: set(values) for name, values in (filters or {}).items()}
+    table = get_facet_table()
+    names = list(FILTER_FIELDS)
+    selected = [(i, filters[name]) for i, name in enumerate(names) if name in filters]
+    counts = {name: {} for name in names}
+
+    for row in table["rows"]:
+        count = row[-1]
+        failed = [i for i, values in selected if row[i] not in values]
+        if len(failed) > 1:
+            continue
+        # Строка, не прошедшая ровно один фильтр, учитывается только в счетчиках этого фильтра
+        for i in failed or range(len(names)):
+            facet = counts[names[i]]
+            facet[row[i]] = facet.get(row[i], 0) + count
+
+    return {
+        name: [
+            {"id": value_id, "label": value, "count": counts[name].get(value, 0)}
+            for value, value_id in table["values"][name]
+        ]
+        for name in names
+    }
@@ -0,0 +1,53 @@
+from django.db.models import QuerySet
+from django.http import QueryDict
+
+# Поля, по которым фильтруется каталог, и их тип
+FILTER_FIELDS = {
+    "width": int,
+    "profile": int,
+    "diameter": int,
+    "season": str,
+    "manufacturer": str,
+}
+
+# Сортировки каталога. id в конце делает порядок однозначным для пагинации
+SORT_ORDERINGS = {
+    "popularity": ("-popularity", "id"),
+    "price": ("price", "id"),
+    "trending": ("-trending", "id"),
+}
+DEFAULT_SORT = "popularity"
+
+
+def parse_filters(params: QueryDict) -> dict[str, list]:
+    """
+    Разбирает параметры фильтрации вида width=205,215&season=summer.
+    Возвращает только непустые фильтры, значения отсортированы и без повторов.
+    """
+    filters = {}
+    for name, value_type in FILTER_FIELDS.items():
+        values = [v for v in params.get(name, "").split(",") if v]
+        if value_type is int:
+            values = [int(v) for v in values if v.isdigit()]
+        if values:
+            filters[name] = sorted(set(values))
+    return filters
+
+
+def parse_sort(params: QueryDict) -> str:
+    sort = params.get("sort")
+    return sort if sort in SORT_ORDERINGS else DEFAULT_SORT
+
+
+def sort_fields(sort: str) -> list[str]:
+    return [ordering.lstrip("-") for ordering in SORT_ORDERINGS[sort]]
+
+
+def filter_products(products: QuerySet, filters: dict[str, list]) -> QuerySet:
+    for name, values in filters.items():
+        products = products.filter(**{f"{name}__in": values})
+    return products
+
+
+def sort_products(products: QuerySet, sort: str) -> QuerySet:
+    return products.order_by(*SORT_ORDERINGS[sort])
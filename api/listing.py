@@ -0,0 +1,77 @@
+"""
+Данные ответов списка и карточки товара, общие для синхронных (api.views) и асинхронных (api.async_views)
+представлений. Оба варианта пишут в одни и те же записи кэша ответов, поэтому ответы должны совпадать
+при любых настройках (CATALOG_ENGINE, FAST_SERIALIZER_VIEWS).
+Функции возвращают (данные, код ответа).
+"""
+from django.core.paginator import Paginator
+from django.http import QueryDict
+from rest_framework import status
+
+from shop.models import Product
+from .catalog_index import use_catalog_index, get_catalog_index, hydrate_products
+from .filters import parse_filters, parse_sort, sort_fields, filter_products, sort_products
+from .pagination import PAGE_SIZE, cursor_paginate
+from .serializers import ProductSerializer, use_fast_serializer, product_rows, serialize_product_rows
+
+
+def serialize_products(products, fast: bool) -> list[dict]:
+    return serialize_product_rows(products) if fast else ProductSerializer(products, many=True).data
+
+
+def product_list_data(params: QueryDict) -> tuple[dict | list | None, int]:
+    """
+    Страница списка товаров по параметрам запроса (см. api.views.product_list).
+    """
+    products = Product.objects.filter(visible=True).prefetch_related("images")  # Фильтрация видимых товаров
+
+    # Фильтрация и сортировка по параметрам
+    sort = parse_sort(params)
+    filters = parse_filters(params)
+    products = filter_products(products, filters)
+    products = sort_products(products, sort)
+
+    fast = use_fast_serializer("product_list")
+    if fast:
+        products = product_rows(products, *sort_fields(sort))
+
+    cursor = params.get("cursor")
+    if cursor is not None:
+        try:
+            if use_catalog_index():
+                ids, next_cursor = get_catalog_index().cursor_page(filters, sort, cursor)
+                products = hydrate_products(ids, rows=fast)
+            else:
+                products, next_cursor = cursor_paginate(products, sort, cursor)
+        except ValueError as e:
+            return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+        return {"results": serialize_products(products, fast), "next_cursor": next_cursor}, status.HTTP_200_OK
+
+    page = int(params.get("page", 1))
+    if use_catalog_index():
+        # Индекс в памяти отдает id товаров страницы, из базы загружается только сама страница
+        ids, num_pages = get_catalog_index().page(filters, sort, page)
+        products = hydrate_products(ids, rows=fast)
+    else:
+        paginator = Paginator(products, PAGE_SIZE)
+        products = paginator.get_page(page)
+        num_pages = paginator.num_pages
+    if num_pages < page:
+        return None, status.HTTP_404_NOT_FOUND
+    return serialize_products(products, fast), status.HTTP_200_OK
+
+
+def product_detail_data(product_id: int) -> tuple[dict | None, int]:
+    """
+    Карточка товара (см. api.views.product_detail).
+    """
+    if use_fast_serializer("product_detail"):
+        rows = serialize_product_rows(product_rows(Product.objects.filter(id=product_id)))
+        if not rows:
+            return None, status.HTTP_404_NOT_FOUND
+        return rows[0], status.HTTP_200_OK
+    try:
+        product = Product.objects.prefetch_related("images").get(id=product_id)
+    except Product.DoesNotExist:
+        return None, status.HTTP_404_NOT_FOUND
+    return ProductSerializer(product).data, status.HTTP_200_OK
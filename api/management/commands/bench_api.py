@@ -0,0 +1,210 @@
+import json
+import platform
+import random
+import subprocess
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from api.benchmark import (seed_catalog, seed_orders, create_carts, random_filters, wsgi_request, run_concurrently,
+                           track_created, delete_ids, delete_products, DELETE_CHUNK, ORDER_DATA)
+from api.cache import RESPONSE_CACHE_ALIAS
+from api.filters import SORT_ORDERINGS
+from api.metrics import get_request_metrics
+from api.models import TelegramMessage
+from api.stats import percentile
+from shop.models import Order, Cart
+
+# Сценарий нагрузки -> имя URL из api/urls.py
+SCENARIOS = {
+    "product_list": "product_list",
+    "combined_filters": "combined_filters",
+    "cart_add": "add_to_cart",
+    "cart_items": "cart_items",
+    "cart_remove": "remove_from_cart",
+    "create_order": "create_order",
+}
+# Сценарии, которые пишут в базу. SQLite допускает только одну пишущую транзакцию,
+# поэтому на SQLite они выполняются последовательно, иначе результат - ошибки "database is locked"
+WRITE_SCENARIOS = {"cart_add", "cart_remove", "create_order"}
+# Позиций в каждой тестовой корзине
+CART_LINES = 3
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Воспроизводимый нагрузочный тест API: заполняет базу синтетическим каталогом с изображениями, "
+            "заказами и корзинами и параллельно выполняет запросы списка товаров со случайными фильтрами, "
+            "счетчиков фильтров, корзины и оформления заказа через WSGI-обработчик Django. "
+            "Выводит пропускную способность, p50/p95/p99 и количество SQL-запросов, сохраняет результат в JSON "
+            "(--output) и сравнивает с результатом предыдущего запуска (--compare). "
+            "Созданные данные удаляются после теста.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10000, help="Тестовых товаров")
+        parser.add_argument("--orders", type=int, default=1000, help="Тестовых заказов")
+        parser.add_argument("--carts", type=int, default=100, help="Тестовых корзин")
+        parser.add_argument("--requests", type=int, default=500, help="Запросов в каждом сценарии")
+        parser.add_argument("--concurrency", type=int, default=16, help="Параллельных запросов")
+        parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+        parser.add_argument("--seed", type=int, default=0, help="Зерно генератора данных и запросов")
+        parser.add_argument("--response-cache", action="store_true",
+                            help="Не отключать кэш ответов (по умолчанию каждый запрос идет в базу)")
+        parser.add_argument("--output", help="Файл для результата в JSON")
+        parser.add_argument("--compare", help="Результат предыдущего запуска в JSON для сравнения")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Допустимое ухудшение p95 и пропускной способности, доля (по умолчанию 0.2)")
+        parser.add_argument("--host", default="localhost")
+
+    def handle(self, *args, **options):
+        caches = dict(settings.CACHES)
+        if not options["response_cache"]:
+            caches[RESPONSE_CACHE_ALIAS] = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+
+        product_ids = seed_catalog(options["products"], seed=options["seed"])
+        order_ids = []
+        carts = []
+        # Удаляются только строки, созданные тестом: заказы и сообщения сценария create_order
+        # собираются по сигналам, а не по диапазону id, чтобы не задеть данные других процессов
+        with track_created(Order, TelegramMessage) as created:
+            try:
+                order_ids = seed_orders(options["orders"], product_ids, seed=options["seed"])
+                cart_products = product_ids[:CART_LINES]
+                # Количество каждого товара с запасом, чтобы удаление по одной штуке не опустошило корзину
+                carts = create_carts(options["carts"], cart_products, quantity=options["requests"])
+                order_carts = create_carts(options["requests"], cart_products)
+                carts.extend(order_carts)
+                with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, options["host"]], CACHES=caches):
+                    results = self.run(options, product_ids, carts[:options["carts"]], order_carts)
+            finally:
+                delete_ids(Order, {*order_ids, *created[Order]})
+                delete_ids(TelegramMessage, created[TelegramMessage])
+                delete_products(product_ids)
+                for offset in range(0, len(carts), DELETE_CHUNK):
+                    Cart.objects.filter(key__in=carts[offset:offset + DELETE_CHUNK]).delete()
+
+        report = {"meta": self.meta(options), "results": results}
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результат сохранен в {options['output']}")
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                self.compare(json.load(file), report, options["threshold"])
+
+    def meta(self, options: dict) -> dict:
+        return {
+            "commit": git_commit(),
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            **{name: options[name] for name in ("products", "orders", "carts", "requests", "concurrency", "seed",
+                                                "response_cache")},
+        }
+
+    def requests(self, scenario: str, rnd: random.Random, count: int, product_ids: list[int], carts: list[str],
+                 order_carts: list[str]) -> list[tuple[str, str, str, dict | None]]:
+        """
+        Запросы сценария: (метод, путь, параметры, тело).
+        """
+        path = reverse(SCENARIOS[scenario])
+        cart_products = product_ids[:CART_LINES]
+        result = []
+        for number in range(count):
+            if scenario == "product_list":
+                params = {**random_filters(rnd), "sort": rnd.choice(list(SORT_ORDERINGS))}
+                if rnd.random() < 0.3:
+                    params["cursor"] = ""
+                result.append(("GET", path, urlencode(params), None))
+            elif scenario == "combined_filters":
+                result.append(("GET", path, urlencode(random_filters(rnd)), None))
+            elif scenario == "cart_add":
+                data = {"session_id": rnd.choice(carts), "product_id": rnd.choice(product_ids)}
+                result.append(("POST", path, "", data))
+            elif scenario == "cart_items":
+                result.append(("GET", path, urlencode({"session_id": rnd.choice(carts)}), None))
+            elif scenario == "cart_remove":
+                data = {"session_id": rnd.choice(carts), "product_id": rnd.choice(cart_products)}
+                result.append(("POST", path, "", data))
+            elif scenario == "create_order":
+                result.append(("POST", path, "", {"session_id": order_carts[number], **ORDER_DATA}))
+        return result
+
+    def run(self, options: dict, product_ids: list[int], carts: list[str], order_carts: list[str]) -> dict:
+        handler = WSGIHandler()
+        rnd = random.Random(options["seed"])
+        host = options["host"]
+        results = {}
+        self.stdout.write(f"{'сценарий':<17} {'запросов/с':>11} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} "
+                          f"{'SQL':>5} {'параллельно':>11} {'ошибок':>7}")
+        for scenario in options["scenarios"]:
+            items = self.requests(scenario, rnd, options["requests"], product_ids, carts, order_carts)
+            # Прогрев запросом, который не меняет данные
+            wsgi_request(handler, host, "GET", reverse("product_list"))
+            concurrency = options["concurrency"]
+            if scenario in WRITE_SCENARIOS and connection.vendor == "sqlite":
+                concurrency = 1
+            get_request_metrics().reset()
+            timings, errors, elapsed = run_concurrently(
+                lambda item: wsgi_request(handler, host, *item) == 200, items, concurrency
+            )
+            metrics = get_request_metrics().snapshot().get(SCENARIOS[scenario])
+            results[scenario] = {
+                "requests": len(items),
+                "concurrency": concurrency,
+                "errors": errors,
+                "rps": round(len(timings) / elapsed, 1),
+                **{f"p{percent}": round(percentile(timings, percent), 2) for percent in (50, 95, 99)},
+                # Медиана количества SQL-запросов по api.metrics, если сбор статистики включен
+                "sql_queries": metrics["sql_queries"]["p50"] if metrics else None,
+            }
+            result = results[scenario]
+            self.stdout.write(
+                f"{scenario:<17} {result['rps']:>11.1f} {result['p50']:>9.1f} {result['p95']:>9.1f} "
+                f"{result['p99']:>9.1f} {str(result['sql_queries']):>5} {concurrency:>11} {errors:>7}"
+            )
+        return results
+
+    def compare(self, baseline: dict, report: dict, threshold: float):
+        """
+        Сравнивает с предыдущим запуском. Ухудшение p95 или пропускной способности больше чем на threshold,
+        рост количества SQL-запросов или новые ошибки считаются регрессией: команда завершается с ошибкой.
+        """
+        self.stdout.write(f"\nСравнение с {baseline['meta'].get('commit')} ({baseline['meta'].get('created')})")
+        self.stdout.write(f"{'сценарий':<17} {'запросов/с':>11} {'p95':>9} {'SQL':>9}")
+        regressions = []
+        for scenario, result in report["results"].items():
+            before = baseline["results"].get(scenario)
+            if before is None:
+                continue
+            rps_change = result["rps"] / before["rps"] - 1 if before["rps"] else 0
+            p95_change = result["p95"] / before["p95"] - 1 if before["p95"] else 0
+            self.stdout.write(f"{scenario:<17} {rps_change:>+11.0%} {p95_change:>+9.0%} "
+                              f"{str(before['sql_queries']) + '->' + str(result['sql_queries']):>9}")
+            if rps_change < -threshold:
+                regressions.append(f"{scenario}: пропускная способность {rps_change:+.0%}")
+            if p95_change > threshold:
+                regressions.append(f"{scenario}: p95 {p95_change:+.0%}")
+            if None not in (before["sql_queries"], result["sql_queries"]) and \
+                    result["sql_queries"] > before["sql_queries"]:
+                regressions.append(f"{scenario}: SQL-запросов {before['sql_queries']} -> {result['sql_queries']}")
+            if result["errors"] > before["errors"]:
+                regressions.append(f"{scenario}: ошибок {before['errors']} -> {result['errors']}")
+        if regressions:
+            raise CommandError("Регрессия производительности:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("Регрессий нет"))
@@ -0,0 +1,116 @@
+import asyncio
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from api.benchmark import (seed_catalog, create_carts, delete_products, run_concurrently, run_concurrently_async,
+                           wsgi_request)
+from api.cache import RESPONSE_CACHE_ALIAS
+from api.stats import percentile
+from shop.models import Cart
+
+ENDPOINTS = ["product_list", "product_detail", "combined_filters", "cart_items", "get_cities"]
+
+
+async def asgi_get(handler: ASGIHandler, host: str, path: str, query: str) -> bool:
+    """
+    GET-запрос к ASGI-приложению так же, как его передает ASGI-сервер.
+    """
+    statuses = []
+    body_sent = False
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(b"host", host.encode())], "server": (host, 80), "client": ("127.0.0.1", 0),
+    }
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Клиент не отключается, пока не получит ответ
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await handler(scope, receive, send)
+    return statuses == [200]
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает синхронные представления api.views под WSGI (пул потоков, как gunicorn --threads) "
+            "и асинхронные api.async_views под ASGI (один цикл событий) при большом количестве параллельных "
+            "запросов: p50/p95/p99 и запросов в секунду. Запросы передаются обработчикам Django напрямую, "
+            "без сетевого сервера. Тестовые товары и корзина создаются в текущей базе и удаляются после теста.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1000, help="Тестовых товаров")
+        parser.add_argument("--requests", type=int, default=500, help="Запросов на каждый замер")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100], help="Параллельных запросов")
+        parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+        parser.add_argument("--response-cache", action="store_true",
+                            help="Не отключать кэш ответов (по умолчанию каждый запрос идет в базу)")
+        parser.add_argument("--host", default="localhost")
+
+    def handle(self, *args, **options):
+        host = options["host"]
+        caches = dict(settings.CACHES)
+        if not options["response_cache"]:
+            caches[RESPONSE_CACHE_ALIAS] = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+
+        product_ids = seed_catalog(options["products"])
+        carts = create_carts(1, product_ids[:5])
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, host], CACHES=caches):
+                self.run(options, host, self.paths(product_ids[0], carts[0]))
+        finally:
+            delete_products(product_ids)
+            Cart.objects.filter(key__in=carts).delete()
+
+    def paths(self, product_id: int, cart_id: str) -> dict[str, tuple[str, str, str]]:
+        """
+        Для каждого представления: путь синхронной версии, путь асинхронной и параметры запроса.
+        """
+        return {
+            "product_list": (reverse("product_list"), reverse("async_product_list"), "sort=price"),
+            "product_detail": (reverse("product_detail", args=[product_id]),
+                               reverse("async_product_detail", args=[product_id]), ""),
+            "combined_filters": (reverse("combined_filters"), reverse("async_combined_filters"), "width=205"),
+            "cart_items": (reverse("cart_items"), reverse("async_cart_items"), urlencode({"session_id": cart_id})),
+            "get_cities": (reverse("get_cities"), reverse("async_get_cities"), urlencode({"q": "мо"})),
+        }
+
+    def run(self, options: dict, host: str, paths: dict):
+        wsgi = WSGIHandler()
+        asgi = ASGIHandler()
+        self.stdout.write(f"{'представление':<17} {'сервер':<5} {'параллельно':>11} {'p50, мс':>9} {'p95, мс':>9} "
+                          f"{'p99, мс':>9} {'запросов/с':>11} {'ошибок':>7}")
+        for name in options["endpoints"]:
+            sync_path, async_path, query = paths[name]
+            # Прогрев: загрузка модулей, индексов и соединений не попадает в замер
+            wsgi_request(wsgi, host, "GET", sync_path, query)
+            asyncio.run(asgi_get(asgi, host, async_path, query))
+            for concurrency in options["concurrency"]:
+                items = range(options["requests"])
+                results = {
+                    "WSGI": run_concurrently(
+                        lambda _: wsgi_request(wsgi, host, "GET", sync_path, query) == 200, items, concurrency
+                    ),
+                    "ASGI": asyncio.run(run_concurrently_async(
+                        lambda _: asgi_get(asgi, host, async_path, query), items, concurrency
+                    )),
+                }
+                for server, (timings, errors, elapsed) in results.items():
+                    self.stdout.write(
+                        f"{name:<17} {server:<5} {concurrency:>11} {percentile(timings, 50):>9.1f} "
+                        f"{percentile(timings, 95):>9.1f} {percentile(timings, 99):>9.1f} "
+                        f"{len(timings) / elapsed:>11.1f} {errors:>7}"
+                    )
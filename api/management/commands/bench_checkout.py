@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from api.benchmark import (seed_catalog, create_carts, run_concurrently, track_created, delete_ids, delete_products,
+                           ORDER_DATA)
+from api.models import TelegramMessage
+from api.stats import percentile
+from api.views import create_order
+from shop.models import Order, Cart
+
+
+class Command(BaseCommand):
+    help = ("Нагрузочный тест оформления заказа: количество SQL-запросов, p50/p95 и пропускная способность "
+            "для корзин разного размера при параллельных заказах. "
+            "Создает тестовые товары, корзины и заказы в текущей базе и удаляет их после теста.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lines", type=int, nargs="+", default=[1, 10, 50], help="Позиций в корзине")
+        parser.add_argument("--checkouts", type=int, default=100, help="Заказов на каждый размер корзины")
+        parser.add_argument("--concurrency", type=int, default=8, help="Параллельных заказов")
+
+    def checkout(self, session_id: str) -> bool:
+        request = APIRequestFactory().post("/api/order/", {"session_id": session_id, **ORDER_DATA}, format="json")
+        return create_order(request).status_code == 200
+
+    def handle(self, *args, **options):
+        product_ids = seed_catalog(max(options["lines"]), images=0)
+        carts_created = []
+        # Сообщения о заказах собираются по сигналу: удаляются только созданные тестом
+        with track_created(TelegramMessage) as created:
+            try:
+                self.stdout.write(f"{'позиций':>8} {'запросов':>9} {'p50, мс':>9} {'p95, мс':>9} "
+                                  f"{'заказов/с':>10} {'ошибок':>7}")
+                for lines in options["lines"]:
+                    carts = create_carts(options["checkouts"] + 1, product_ids[:lines])
+                    carts_created.extend(carts)
+                    with CaptureQueriesContext(connection) as queries:
+                        self.checkout(carts.pop())
+                    timings, errors, elapsed = run_concurrently(self.checkout, carts, options["concurrency"])
+                    self.stdout.write(
+                        f"{lines:>8} {len(queries):>9} {percentile(timings, 50):>9.1f} {percentile(timings, 95):>9.1f} "
+                        f"{len(timings) / elapsed:>10.1f} {errors:>7}"
+                    )
+            finally:
+                Order.objects.filter(orderitem__product_id__in=product_ids).delete()
+                delete_products(product_ids)
+                Cart.objects.filter(key__in=carts_created).delete()
+                delete_ids(TelegramMessage, created[TelegramMessage])
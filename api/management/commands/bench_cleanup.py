@@ -0,0 +1,98 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.benchmark import seed_catalog, create_carts, create_sessions, measure, delete_products, DELETE_CHUNK
+from api.cart import purge_expired_sessions
+from api.stats import percentile
+from shop.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = ("Нагрузочный тест очистки: создает много корзин с сессиями, большая часть из них брошенные, "
+            "и измеряет скорость purge_expired_sessions, время одной пачки и время чтения корзины до и после. "
+            "Если в базе уже есть истекшие сессии или брошенные корзины, они тоже будут удалены, "
+            "поэтому без --yes-destroy команда в такой базе не запускается.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--carts", type=int, default=1_000_000, help="Сколько корзин создать")
+        parser.add_argument("--expired", type=float, default=0.9, help="Доля брошенных корзин")
+        parser.add_argument("--items", type=int, default=2, help="Позиций в каждой корзине")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Строк в одной пачке очистки")
+        parser.add_argument("--chunk", type=int, default=10000, help="Корзин в одной вставке при заполнении")
+        parser.add_argument("--yes-destroy", action="store_true",
+                            help="Разрешить удаление уже существующих истекших сессий и брошенных корзин")
+
+    def cart_lookup_ms(self, keys: list[str]) -> float:
+        position = iter(keys * 10)
+        timings = measure(lambda: list(CartItem.objects.filter(cart_id=next(position))), min(len(keys) * 10, 200))
+        return percentile(timings, 50)
+
+    def existing_expired(self) -> dict[str, int]:
+        """
+        Истекшие сессии и брошенные корзины, которые уже есть в базе и будут удалены вместе с тестовыми.
+        """
+        now = timezone.now()
+        return {
+            "сессий": Session.objects.filter(expire_date__lt=now).count(),
+            "корзин": Cart.objects.filter(updated__lt=now - timedelta(seconds=settings.SESSION_COOKIE_AGE)).count(),
+        }
+
+    def handle(self, *args, **options):
+        existing = self.existing_expired()
+        if any(existing.values()) and not options["yes_destroy"]:
+            raise CommandError(
+                "В базе уже есть " + ", ".join(f"{name}: {count}" for name, count in existing.items()) + ". "
+                "purge_expired_sessions удалит их вместе с тестовыми корзинами: запустите тест на отдельной базе "
+                "или подтвердите удаление флагом --yes-destroy"
+            )
+        product_ids = seed_catalog(options["items"], images=0)
+        expired_count = int(options["carts"] * options["expired"])
+        now = timezone.now()
+        expired_updated = now - timedelta(seconds=settings.SESSION_COOKIE_AGE + 86400)
+        # Сессии брошенных корзин истекли, сессии остальных действуют
+        expired_sessions = now - timedelta(days=1)
+        live_sessions = now + timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        live, sessions = [], []
+        try:
+            started = time.perf_counter()
+            for offset in range(0, options["carts"], options["chunk"]):
+                count = min(options["chunk"], options["carts"] - offset)
+                expired = max(0, min(count, expired_count - offset))
+                sessions.extend(create_sessions(create_carts(expired, product_ids, updated=expired_updated),
+                                                expired_sessions))
+                keys = create_carts(count - expired, product_ids)
+                live.extend(keys)
+                sessions.extend(create_sessions(keys, live_sessions))
+            self.stdout.write(f"Создано корзин и сессий: {options['carts']} (брошенных {expired_count}) "
+                              f"за {time.perf_counter() - started:.1f} с")
+
+            sample = live[:20]
+            before = self.cart_lookup_ms(sample) if sample else 0
+
+            batches = []
+            started = time.perf_counter()
+            result = purge_expired_sessions(batch_size=options["batch_size"],
+                                            on_batch=lambda seconds, deleted: batches.append(seconds * 1000))
+            elapsed = time.perf_counter() - started
+            rows = sum(result[name] for name in ("sessions", "carts", "cart_items"))
+
+            after = self.cart_lookup_ms(sample) if sample else 0
+            self.stdout.write(
+                f"Удалено сессий: {result['sessions']}, корзин: {result['carts']}, "
+                f"позиций корзин: {result['cart_items']}, пачек: {result['batches']}\n"
+                f"Время: {elapsed:.1f} с, {rows / elapsed if elapsed else 0:.0f} строк/с\n"
+                f"Пачка, мс: p50 {percentile(batches, 50):.1f}, p95 {percentile(batches, 95):.1f}, "
+                f"max {max(batches, default=0):.1f}\n"
+                f"Чтение корзины, мс (p50): до {before:.2f}, после {after:.2f}"
+            )
+        finally:
+            for offset in range(0, len(live), DELETE_CHUNK):
+                Cart.objects.filter(key__in=live[offset:offset + DELETE_CHUNK]).delete()
+            for offset in range(0, len(sessions), DELETE_CHUNK):
+                Session.objects.filter(session_key__in=sessions[offset:offset + DELETE_CHUNK]).delete()
+            delete_products(product_ids)
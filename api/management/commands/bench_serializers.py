@@ -0,0 +1,40 @@
+import statistics
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.benchmark import seed_catalog, measure
+from api.serializers import ProductSerializer, product_rows, serialize_product_rows
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает ProductSerializer и быструю сериализацию serialize_product_rows на 20, 100 и 1000 товарах. "
+            "Товары для теста создаются во временной транзакции и откатываются.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[20, 100, 1000])
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = options["sizes"]
+        with transaction.atomic():
+            seed_catalog(max(sizes))
+            self.stdout.write(f"{'товаров':>8} {'ProductSerializer, мс':>22} {'быстрый, мс':>12} {'ускорение':>10}")
+            for size in sizes:
+                products = Product.objects.order_by("id")[:size]
+                renderer = JSONRenderer()
+
+                def drf():
+                    return renderer.render(ProductSerializer(products.prefetch_related("images"), many=True).data)
+
+                def fast():
+                    return renderer.render(serialize_product_rows(product_rows(products)))
+
+                if drf() != fast():
+                    self.stderr.write(self.style.ERROR(f"{size}: результаты сериализации отличаются"))
+                drf_ms = statistics.median(measure(drf, options["repeat"]))
+                fast_ms = statistics.median(measure(fast, options["repeat"]))
+                self.stdout.write(f"{size:>8} {drf_ms:>22.2f} {fast_ms:>12.2f} {drf_ms / fast_ms:>9.1f}x")
+            transaction.set_rollback(True)
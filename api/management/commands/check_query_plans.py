@@ -0,0 +1,162 @@
+import json
+import re
+from itertools import combinations
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.filters import FILTER_FIELDS, SORT_ORDERINGS, filter_products, sort_products
+from shop.models import Product
+
+# Значения по умолчанию, если в базе еще нет товаров
+DEFAULT_VALUES = {
+    "width": 205,
+    "profile": 55,
+    "diameter": 16,
+    "season": "summer",
+    "manufacturer": "Michelin",
+}
+# Первая колонка всех индексов каталога. Сама по себе почти не отбирает строк:
+# доступ по индексу только по visible читает почти весь каталог
+VISIBLE_COLUMN = "visible"
+# Длина ключа visible в MySQL (tinyint(1) NOT NULL), если в плане нет used_key_parts
+VISIBLE_KEY_LENGTH = 1
+
+
+def common_filter_combinations() -> list[tuple[str, ...]]:
+    """
+    Частые комбинации фильтров: без фильтров, любой один или два фильтра и полный типоразмер.
+    """
+    fields = list(FILTER_FIELDS)
+    result = [()]
+    for size in (1, 2):
+        result.extend(combinations(fields, size))
+    result.append(("width", "profile", "diameter"))
+    return result
+
+
+def parse_plan(plan: str, vendor: str) -> dict:
+    """
+    Разбирает вывод EXPLAIN: {"accesses": [...], "filesort": bool}.
+    Для каждого чтения таблицы: table, index (None - полное сканирование), columns - использованные колонки
+    индекса (None - неизвестно или индекс читается целиком без условия), rows - оценка числа строк (None - нет).
+    filesort - результат сортируется отдельно, а не читается из индекса в нужном порядке.
+    """
+    if vendor == "mysql":
+        return _parse_mysql_plan(json.loads(plan))
+    if vendor == "postgresql":
+        return _parse_postgresql_plan(plan)
+    return _parse_sqlite_plan(plan)
+
+
+def _parse_mysql_plan(plan: dict) -> dict:
+    accesses = []
+    filesort = False
+
+    def walk(node):
+        nonlocal filesort
+        if isinstance(node, dict):
+            if node.get("using_filesort"):
+                filesort = True
+            if "table_name" in node and "access_type" in node:
+                index = None if node["access_type"] == "ALL" else node.get("key")
+                columns = node.get("used_key_parts")
+                if columns is None and index and node.get("key_length") is not None:
+                    # Без used_key_parts (старые версии MySQL) ключ длиной в visible - это только visible
+                    if int(node["key_length"]) <= VISIBLE_KEY_LENGTH and node["access_type"] in ("ref", "range"):
+                        columns = [VISIBLE_COLUMN]
+                if node["access_type"] == "index":
+                    # Полное чтение индекса по порядку, условия на колонки индекса нет
+                    columns = None
+                rows = node.get("rows_examined_per_scan")
+                accesses.append({"table": node["table_name"], "index": index, "columns": columns,
+                                 "rows": int(rows) if rows is not None else None})
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(plan)
+    return {"accesses": accesses, "filesort": filesort}
+
+
+def _parse_postgresql_plan(plan: str) -> dict:
+    accesses = []
+    # Узел плана и его строки условий до следующего узла ("->")
+    for match in re.finditer(r"(Seq Scan|Index Scan|Index Only Scan) (?:using (\w+) )?on (\w+)"
+                             r"[^\n]*?rows=(\d+)[^\n]*((?:\n(?![ \t]*->)[^\n]*)*)", plan):
+        kind, index, table, rows, details = match.groups()
+        condition = re.search(r"Index Cond: (.+)", details)
+        columns = re.findall(r"\((\w+) =", condition.group(1)) if condition else None
+        accesses.append({"table": table, "index": None if kind == "Seq Scan" else index, "columns": columns,
+                         "rows": int(rows) if rows else None})
+    return {"accesses": accesses, "filesort": bool(re.search(r"\bSort\b", plan))}
+
+
+def _parse_sqlite_plan(plan: str) -> dict:
+    accesses = []
+    # SEARCH shop_product USING INDEX product_size_idx (visible=? AND diameter=?) - поиск по колонкам индекса,
+    # SCAN shop_product USING INDEX ... - чтение всего индекса, SCAN shop_product - всей таблицы
+    for match in re.finditer(r"(SCAN|SEARCH) (\w+)(?: USING (?:COVERING )?INDEX (\w+)(?: \(([^)]*)\))?)?", plan):
+        kind, table, index, condition = match.groups()
+        columns = re.findall(r"(\w+)[=><]", condition) if kind == "SEARCH" and condition else None
+        accesses.append({"table": table, "index": index, "columns": columns, "rows": None})
+    return {"accesses": accesses, "filesort": "USE TEMP B-TREE FOR ORDER BY" in plan}
+
+
+def plan_problems(plan: dict, table: str, filters: tuple[str, ...]) -> list[str]:
+    """
+    Проблемы плана запроса к table: полное сканирование, индекс, использованный только по visible
+    при наличии фильтров, и сортировка всего каталога без индекса.
+    """
+    problems = []
+    for access in plan["accesses"]:
+        if access["table"] != table:
+            continue
+        rows = f", ~{access['rows']} строк" if access["rows"] is not None else ""
+        columns = access["columns"]
+        if access["index"] is None:
+            problems.append(f"полное сканирование {table}{rows}")
+        elif filters and not (columns and set(columns) - {VISIBLE_COLUMN}):
+            used = ", ".join(columns) if columns else "без условия"
+            problems.append(f"индекс {access['index']} используется только по ({used}){rows}, "
+                            f"фильтры {', '.join(filters)} проверяются по каждой строке")
+        elif not filters and plan["filesort"]:
+            problems.append(f"сортировка всех товаров без индекса ({access['index']}){rows}")
+    return problems
+
+
+class Command(BaseCommand):
+    help = ("Проверяет через EXPLAIN, что частые фильтры каталога используют индексы: без полного сканирования, "
+            "с условием индекса не только по visible и без сортировки всего каталога")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="Печатать планы всех запросов")
+
+    def sample_values(self) -> dict:
+        values = dict(DEFAULT_VALUES)
+        sample = Product.objects.filter(visible=True).values(*FILTER_FIELDS).first()
+        if sample:
+            values.update(sample)
+        return values
+
+    def handle(self, *args, **options):
+        explain_options = {"format": "json"} if connection.vendor == "mysql" else {}
+        values = self.sample_values()
+        table = Product._meta.db_table
+        failures = []
+        for fields in common_filter_combinations():
+            filters = {name: [values[name]] for name in fields}
+            for sort in SORT_ORDERINGS:
+                products = sort_products(filter_products(Product.objects.filter(visible=True), filters), sort)
+                plan = products[:20].explain(**explain_options)
+                label = f"filters={','.join(fields) or '-'} sort={sort}"
+                if options["verbose_plans"]:
+                    self.stdout.write(f"{label}\n{plan}\n")
+                for problem in plan_problems(parse_plan(plan, connection.vendor), table, fields):
+                    failures.append(f"{label}: {problem}")
+
+        if failures:
+            raise CommandError("Запросы без подходящего индекса:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("Все частые комбинации фильтров используют индексы"))
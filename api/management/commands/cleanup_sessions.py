@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.cart import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = ("Удаляет пачками истекшие сессии и брошенные корзины. В отличие от clearsessions не удаляет "
+            "все строки одним запросом, поэтому подходит для запуска по расписанию на большой таблице")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Строк в одной транзакции")
+        parser.add_argument("--pause", type=float, default=0, help="Пауза между пачками в секундах")
+        parser.add_argument("--cart-lifetime", type=int, default=None,
+                            help="Через сколько секунд без изменений корзина считается брошенной "
+                                 "(по умолчанию SESSION_COOKIE_AGE)")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = purge_expired_sessions(batch_size=options["batch_size"], pause=options["pause"],
+                                        cart_lifetime=options["cart_lifetime"])
+        self.stdout.write(f"Удалено сессий: {result['sessions']}, корзин: {result['carts']}, "
+                          f"позиций корзин: {result['cart_items']}, пачек: {result['batches']}, "
+                          f"за {time.perf_counter() - started:.1f} с")
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.notifications import RateLimiter, process_outbox
+
+
+class Command(BaseCommand):
+    help = "Отправляет сообщения из очереди TelegramMessage с повторами и ограничением частоты"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Отправить одну пачку и завершиться")
+        parser.add_argument("--batch-size", type=int, default=10, help="Сообщений за одну выборку")
+        parser.add_argument("--max-attempts", type=int, default=5, help="Попыток до статуса failed")
+        parser.add_argument("--backoff", type=float, default=10,
+                            help="Задержка перед первой повторной попыткой в секундах, далее удваивается")
+        parser.add_argument("--max-backoff", type=float, default=3600, help="Максимальная задержка в секундах")
+        parser.add_argument("--rate", type=float, default=1, help="Не больше сообщений в секунду")
+        parser.add_argument("--interval", type=float, default=2, help="Пауза между проверками пустой очереди")
+        parser.add_argument("--lease", type=float, default=600,
+                            help="Через сколько секунд сообщения пачки снова доступны для отправки, "
+                                 "если воркер не сохранил результат (например, упал)")
+
+    def handle(self, *args, **options):
+        limiter = RateLimiter(options["rate"])
+        while True:
+            result = process_outbox(
+                batch_size=options["batch_size"],
+                max_attempts=options["max_attempts"],
+                backoff=options["backoff"],
+                max_backoff=options["max_backoff"],
+                limiter=limiter,
+                lease=options["lease"],
+            )
+            if any(result.values()):
+                self.stdout.write(f"Отправлено: {result['sent']}, отложено: {result['retry']}, "
+                                  f"не отправлено: {result['failed']}")
+            if options["once"]:
+                break
+            if result["sent"] + result["retry"] + result["failed"] < options["batch_size"]:
+                time.sleep(options["interval"])
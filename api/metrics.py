@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .stats import percentile
+
+slow_logger = logging.getLogger("api.slow")
+
+# Показатели запроса: время ответа, количество SQL-запросов, время SQL, время сериализации товаров и корзины
+# (включая SQL, который выполняется при сериализации) и время рендеринга ответа DRF в JSON
+METRICS = ("wall_ms", "sql_queries", "sql_ms", "serialize_ms", "render_ms")
+PERCENTILES = (50, 95, 99)
+# Сколько самых долгих SQL-запросов попадает в журнал медленных запросов
+SLOW_LOG_QUERIES = 20
+
+
+class RequestMetrics:
+    """
+    Скользящее окно последних window значений каждого показателя по именам URL.
+    Запись - добавление в deque под блокировкой, перцентили считаются только при чтении.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.samples: dict[str, dict[str, deque]] = {}
+        self.counts: dict[str, list[int]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, name: str, values: dict[str, float], error: bool = False):
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = {metric: deque(maxlen=self.window) for metric in METRICS}
+                self.counts[name] = [0, 0]
+            for metric in METRICS:
+                samples[metric].append(values[metric])
+            self.counts[name][0] += 1
+            self.counts[name][1] += error
+
+    def snapshot(self) -> dict[str, dict]:
+        """
+        По каждому имени URL: количество запросов и ошибок 5xx с запуска процесса,
+        p50/p95/p99 и максимум показателей по окну.
+        """
+        with self.lock:
+            samples = {name: {metric: list(values) for metric, values in metrics.items()}
+                       for name, metrics in self.samples.items()}
+            counts = {name: list(count) for name, count in self.counts.items()}
+        result = {}
+        for name in sorted(samples):
+            result[name] = {"requests": counts[name][0], "errors": counts[name][1]}
+            for metric, values in samples[name].items():
+                summary = {f"p{percent}": round(percentile(values, percent), 2) for percent in PERCENTILES}
+                summary["max"] = round(max(values, default=0), 2)
+                result[name][metric] = summary
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+
+
+_metrics: RequestMetrics | None = None
+_metrics_lock = threading.Lock()
+
+
+def get_request_metrics() -> RequestMetrics:
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = RequestMetrics(getattr(settings, "API_METRICS_WINDOW", 1000))
+        return _metrics
+
+
+@lru_cache
+def api_url_names() -> frozenset[str]:
+    """
+    Имена URL из api/urls.py, для которых собирается статистика.
+    """
+    from .urls import urlpatterns
+
+    return frozenset(pattern.name for pattern in urlpatterns if pattern.name)
+
+
+class SerializationTimer:
+    """
+    Суммарное время сериализации текущего запроса (timed_serialization).
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.running = False
+
+
+# Таймер сериализации запроса, который сейчас обрабатывается. Контекстная переменная видна и в потоках
+# sync_to_async, поэтому время считается и для асинхронных представлений
+_serialization_timer: ContextVar[SerializationTimer | None] = ContextVar("serialization_timer", default=None)
+
+
+@contextmanager
+def timed_serialization():
+    """
+    Добавляет время блока к времени сериализации текущего запроса.
+    Вложенные блоки (сериализатор товара внутри сериализатора корзины) не считаются повторно.
+    """
+    timer = _serialization_timer.get()
+    if timer is None or timer.running:
+        yield
+        return
+    timer.running = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.seconds += time.perf_counter() - started
+        timer.running = False
+
+
+class QueryTimer:
+    """
+    Обертка выполнения SQL (connection.execute_wrapper): количество и суммарное время запросов.
+    Текст запросов сохраняется, только если включен журнал медленных запросов.
+    """
+
+    def __init__(self, keep_sql: bool):
+        self.keep_sql = keep_sql
+        self.count = 0
+        self.seconds = 0.0
+        self.queries: list[tuple[float, str]] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.keep_sql:
+                self.queries.append((elapsed * 1000, sql))
+
+
+# Таймер SQL асинхронного запроса. Соединения с базой у каждого потока свои, а запросы асинхронного
+# представления выполняются в потоках sync_to_async, поэтому обертка ставится на все соединения
+# (async_query_wrapper) и находит таймер запроса через контекстную переменную
+_query_timer: ContextVar[QueryTimer | None] = ContextVar("query_timer", default=None)
+
+
+def async_query_wrapper(execute, sql, params, many, context):
+    timer = _query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_async_query_wrapper(sender, connection, **kwargs):
+    if async_query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(async_query_wrapper)
+
+
+class MetricsMiddleware:
+    """
+    Собирает для каждого запроса к api/urls.py время ответа, количество и время SQL-запросов,
+    время сериализации и время рендеринга ответа DRF. Статистика - /api/metrics/.
+    Запросы дольше SLOW_REQUEST_MS пишутся в журнал api.slow вместе с SQL.
+    Работает и под WSGI, и под ASGI (без перехода в поток для асинхронных представлений).
+    Отключается настройкой API_METRICS = False.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not getattr(settings, "API_METRICS", True):
+            return self.get_response(request)
+
+        timer, token = self.start(request)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            _serialization_timer.reset(token)
+        return self.finish(request, response, started, timer)
+
+    async def __acall__(self, request):
+        if not getattr(settings, "API_METRICS", True):
+            return await self.get_response(request)
+
+        timer, token = self.start(request)
+        query_token = _query_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_timer.reset(query_token)
+            _serialization_timer.reset(token)
+        return self.finish(request, response, started, timer)
+
+    def start(self, request):
+        request.render_seconds = 0.0
+        request.serialization_timer = SerializationTimer()
+        token = _serialization_timer.set(request.serialization_timer)
+        return QueryTimer(keep_sql=getattr(settings, "SLOW_REQUEST_MS", 0) > 0), token
+
+    def finish(self, request, response, started: float, timer: QueryTimer):
+        wall_ms = (time.perf_counter() - started) * 1000
+        match = request.resolver_match
+        if match is None or match.url_name not in api_url_names():
+            return response
+        get_request_metrics().record(match.url_name, {
+            "wall_ms": wall_ms,
+            "sql_queries": timer.count,
+            "sql_ms": timer.seconds * 1000,
+            "serialize_ms": request.serialization_timer.seconds * 1000,
+            "render_ms": request.render_seconds * 1000,
+        }, error=response.status_code >= 500)
+        slow_ms = getattr(settings, "SLOW_REQUEST_MS", 0)
+        if 0 < slow_ms <= wall_ms:
+            self.log_slow(request, response, wall_ms, timer)
+        return response
+
+    def process_template_response(self, request, response):
+        # Response из DRF рендерится после представления: время рендеринга - до post-render колбэка
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.render_seconds += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow(self, request, response, wall_ms: float, timer: QueryTimer):
+        slowest = sorted(timer.queries, reverse=True)[:SLOW_LOG_QUERIES]
+        queries = "\n".join(f"  {ms:.1f} мс: {sql}" for ms, sql in slowest)
+        slow_logger.warning(
+            f"{request.method} {request.get_full_path()} {response.status_code}: {wall_ms:.1f} мс, "
+            f"SQL: {timer.count} запросов, {timer.seconds * 1000:.1f} мс\n{queries}"
+        )
@@ -1,3 +1,31 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class TelegramMessage(models.Model):
+    """
+    Исходящее сообщение в Telegram. Создается в транзакции заказа,
+    отправляется отдельно командой send_notifications.
+    """
+    statuses = (
+        ("pending", "Ожидает отправки"),
+        ("sent", "Отправлено"),
+        ("failed", "Не отправлено"),
+    )
+    text = models.TextField(verbose_name="Текст")
+    status = models.CharField(max_length=20, choices=statuses, default="pending", verbose_name="Статус")
+    attempts = models.IntegerField(default=0, verbose_name="Попыток отправки")
+    next_attempt = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, default="", verbose_name="Последняя ошибка")
+    created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    sent = models.DateTimeField(blank=True, null=True, verbose_name="Дата отправки")
+
+    def __str__(self):
+        return f"#{self.id} {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = "Сообщение в Telegram"
+        verbose_name_plural = "Сообщения в Telegram"
+        indexes = [
+            models.Index(fields=["status", "next_attempt"], name="telegram_outbox_idx"),
+        ]
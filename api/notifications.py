@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TelegramMessage
+
+
+class TelegramError(Exception):
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Ограничение частоты отправки: не больше rate сообщений в секунду.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def queue_telegram_message(message: str) -> TelegramMessage:
+    """
+    Ставит сообщение в очередь отправки. Вызывается внутри транзакции заказа,
+    поэтому сообщение сохраняется только вместе с заказом.
+    """
+    return TelegramMessage.objects.create(text=message)
+
+
+def send_telegram_message(message: str) -> dict:
+    """
+    Отправляет сообщение в Telegram. Бросает TelegramError, если сообщение не принято.
+    """
+    url = f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
+    data = {
+        "chat_id": settings.TELEGRAM_CHAT_ID,
+        "text": message,
+        "parse_mode": "html",
+    }
+    try:
+        response = requests.post(url, data=data, timeout=settings.TELEGRAM_TIMEOUT)
+        result = response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise TelegramError(f"{type(e).__name__}: {e}") from e
+    if not result.get("ok"):
+        retry_after = result.get("parameters", {}).get("retry_after")
+        raise TelegramError(f"{response.status_code}: {result.get('description')}", retry_after)
+    return result
+
+
+def retry_delay(attempts: int, backoff: float, max_backoff: float) -> float:
+    """
+    Экспоненциальная задержка перед повторной отправкой: backoff, 2*backoff, 4*backoff...
+    """
+    return min(backoff * 2 ** (attempts - 1), max_backoff)
+
+
+def claim_messages(batch_size: int, lease: float) -> list[TelegramMessage]:
+    """
+    Забирает пачку сообщений, время отправки которых наступило, в короткой транзакции:
+    попытка засчитывается, а следующая переносится на lease секунд вперед. Пока идет отправка,
+    другие воркеры сообщения не видят, а если воркер упадет, они будут отправлены после lease.
+    Строки блокируются с skip_locked только на время этой транзакции.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            TelegramMessage.objects.select_for_update(skip_locked=True)
+            .filter(status="pending", next_attempt__lte=now)
+            .order_by("id")[:batch_size]
+        )
+        if messages:
+            TelegramMessage.objects.filter(id__in=[message.id for message in messages]).update(
+                attempts=F("attempts") + 1, next_attempt=now + timedelta(seconds=lease)
+            )
+    for message in messages:
+        message.attempts += 1
+    return messages
+
+
+def process_outbox(batch_size: int = 10, max_attempts: int = 5, backoff: float = 10, max_backoff: float = 3600,
+                   limiter: RateLimiter | None = None, lease: float = 600) -> dict[str, int]:
+    """
+    Отправляет одну пачку сообщений, время отправки которых наступило.
+    Сообщения забираются claim_messages, отправляются вне транзакции, а результат каждого
+    сохраняется отдельным UPDATE: ошибка на одном сообщении не отменяет уже отправленные.
+    lease должен быть больше времени отправки пачки (batch_size * TELEGRAM_TIMEOUT и паузы ограничения частоты).
+    Возвращает количество отправленных, отложенных и окончательно не отправленных сообщений.
+    """
+    result = {"sent": 0, "retry": 0, "failed": 0}
+    for message in claim_messages(batch_size, lease):
+        if limiter:
+            limiter.wait()
+        changes = {}
+        try:
+            send_telegram_message(message.text)
+        except TelegramError as e:
+            changes["last_error"] = str(e)
+            if message.attempts >= max_attempts:
+                changes["status"] = "failed"
+                result["failed"] += 1
+                logging.error(f"Сообщение в Telegram #{message.id} не отправлено: {e}")
+            else:
+                delay = e.retry_after or retry_delay(message.attempts, backoff, max_backoff)
+                changes["next_attempt"] = timezone.now() + timedelta(seconds=delay)
+                result["retry"] += 1
+        else:
+            changes.update(status="sent", sent=timezone.now())
+            result["sent"] += 1
+        TelegramMessage.objects.filter(id=message.id).update(**changes)
+    return result
@@ -0,0 +1,97 @@
+import base64
+import json
+import math
+
+from django.db.models import Q, QuerySet
+
+from .filters import SORT_ORDERINGS, sort_fields
+
+PAGE_SIZE = 20
+# Целые значения курсора должны помещаться в BIGINT, иначе база не примет параметр запроса
+MAX_INT = 2 ** 63 - 1
+
+
+def encode_cursor(sort: str, values: list) -> str:
+    payload = json.dumps({"s": sort, "k": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, key_size: int | None = None) -> list:
+    """
+    Возвращает значения ключа сортировки последнего товара предыдущей страницы.
+    key_size - количество значений ключа, по умолчанию по SORT_ORDERINGS[sort].
+    Последнее значение - id товара (целое число), остальные - числа.
+    Бросает ValueError, если курсор поврежден или выдан для другой сортировки.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError as e:
+        # binascii.Error, UnicodeDecodeError, JSONDecodeError и не-ASCII символы в курсоре
+        raise ValueError("Некорректный курсор") from e
+    if not isinstance(payload, dict):
+        raise ValueError("Некорректный курсор")
+    if payload.get("s") != sort:
+        raise ValueError("Курсор выдан для другой сортировки")
+    values = payload.get("k")
+    if key_size is None:
+        key_size = len(SORT_ORDERINGS[sort])
+    if not isinstance(values, list) or len(values) != key_size or not all(map(is_key_value, values[:-1])) \
+            or not is_id(values[-1]):
+        raise ValueError("Некорректный курсор")
+    return values
+
+
+def is_key_value(value) -> bool:
+    """
+    Значение ключа сортировки из курсора: число (цена, популярность), bool и NaN не подходят.
+    """
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return is_id(value)
+
+
+def is_id(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and -MAX_INT <= value <= MAX_INT
+
+
+def after_cursor(sort: str, values: list) -> Q:
+    """
+    Условие "строго после" значений ключа для упорядочивания SORT_ORDERINGS[sort].
+    Для (-popularity, id): popularity < v OR (popularity = v AND id > last_id).
+    """
+    condition = Q()
+    equal = Q()
+    for ordering, value in zip(SORT_ORDERINGS[sort], values):
+        field = ordering.lstrip("-")
+        lookup = "lt" if ordering.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{field}__{lookup}": value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+def cursor_queryset(products: QuerySet, sort: str, cursor: str, page_size: int = PAGE_SIZE) -> QuerySet:
+    """
+    Товары страницы по курсору и еще один товар, по которому видно, есть ли следующая страница.
+    """
+    if cursor:
+        products = products.filter(after_cursor(sort, decode_cursor(cursor, sort)))
+    return products[:page_size + 1]
+
+
+def cursor_result(page: list, sort: str, page_size: int = PAGE_SIZE) -> tuple[list, str | None]:
+    if len(page) <= page_size:
+        return page, None
+    page = page[:page_size]
+    last = page[-1]
+    values = [last[field] if isinstance(last, dict) else getattr(last, field) for field in sort_fields(sort)]
+    return page, encode_cursor(sort, values)
+
+
+def cursor_paginate(products: QuerySet, sort: str, cursor: str, page_size: int = PAGE_SIZE) -> tuple[list, str | None]:
+    """
+    Keyset-пагинация: страница берется по условию на ключ сортировки вместо OFFSET,
+    общее количество товаров не считается. Пустой курсор - первая страница.
+    Возвращает товары страницы и курсор следующей страницы (None, если страница последняя).
+    Товары могут быть как моделями, так и словарями values().
+    """
+    return cursor_result(list(cursor_queryset(products, sort, cursor, page_size)), sort, page_size)
@@ -0,0 +1,157 @@
+import re
+import threading
+from bisect import bisect_left, bisect_right
+
+from shop.catalog import get_catalog_version
+from shop.models import Product
+from .filters import FILTER_FIELDS
+from .pagination import PAGE_SIZE, encode_cursor, decode_cursor
+
+# Вес совпадения слова запроса в поле товара. Совпадение по началу слова весит вдвое меньше полного
+SEARCH_WEIGHTS = {
+    "product_code": 4,
+    "manufacturer": 3,
+    "tire_model": 3,
+    "name": 1,
+}
+SEARCH_CURSOR = "search"
+
+# Размер шины: 205/55 R16, 205/55R16, 205 55 16; отдельно 205/55 и R16 (латинская или русская R)
+SIZE_PATTERNS = [
+    (re.compile(r"\b(\d{3})\s*[/ ]\s*(\d{2})\s*z?[rр]?\s*(\d{2})\b"), ("width", "profile", "diameter")),
+    (re.compile(r"\b(\d{3})\s*/\s*(\d{2})\b"), ("width", "profile")),
+    (re.compile(r"(?<!\w)z?[rр]\s?(\d{2})\b"), ("diameter",)),
+]
+TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return text.casefold().replace("ё", "е")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(normalize(text))
+
+
+def parse_query(query: str) -> tuple[dict[str, list], list[str]]:
+    """
+    Разбирает поисковый запрос на фильтры размера и слова.
+    "michelin 205/55 R16" -> ({"width": [205], "profile": [55], "diameter": [16]}, ["michelin"])
+    """
+    text = normalize(query)
+    filters = {}
+    for pattern, names in SIZE_PATTERNS:
+        match = pattern.search(text)
+        if match and not any(name in filters for name in names):
+            filters.update({name: [int(value)] for name, value in zip(names, match.groups())})
+            text = text[:match.start()] + " " + text[match.end():]
+    return filters, TOKEN_RE.findall(text)
+
+
+class SearchIndex:
+    """
+    Обратный индекс товаров в памяти процесса: слово -> {id товара: вес}.
+    Слова запроса ищутся по началу слова бинарным поиском в отсортированном списке слов индекса,
+    товар должен содержать все слова запроса. Ранжирование: сумма весов, затем популярность.
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        columns = ["id", "visible", "popularity", *SEARCH_WEIGHTS, *FILTER_FIELDS]
+        rows = Product.objects.values_list(*columns)
+
+        self.postings: dict[str, dict[int, int]] = {}
+        self.popularity: dict[int, int] = {}
+        self.values: dict[int, dict] = {}
+        self.visible: set[int] = set()
+        for row in rows:
+            product = dict(zip(columns, row))
+            product_id = product["id"]
+            self.popularity[product_id] = product["popularity"]
+            self.values[product_id] = {name: product[name] for name in FILTER_FIELDS}
+            if product["visible"]:
+                self.visible.add(product_id)
+            for field, weight in SEARCH_WEIGHTS.items():
+                for token in tokenize(str(product[field])):
+                    posting = self.postings.setdefault(token, {})
+                    posting[product_id] = max(posting.get(product_id, 0), weight)
+        self.tokens = sorted(self.postings)
+
+    def _expand(self, term: str) -> list[str]:
+        """
+        Слова индекса, начинающиеся с term. Числа (артикул, индекс нагрузки) ищутся только целиком.
+        """
+        if term.isdigit():
+            return [term] if term in self.postings else []
+        return self.tokens[bisect_left(self.tokens, term):bisect_right(self.tokens, term + "\uffff")]
+
+    def ranked(self, terms: list[str], filters: dict[str, list], include_hidden: bool = False) -> list[tuple]:
+        """
+        Ключи ранжирования найденных товаров (-вес, -популярность, id) по возрастанию.
+        """
+        scores = dict.fromkeys(self.popularity if include_hidden else self.visible, 0)
+        for term in terms:
+            term_scores = {}
+            for token in self._expand(term):
+                factor = 2 if token == term else 1
+                for product_id, weight in self.postings[token].items():
+                    if product_id in scores:
+                        term_scores[product_id] = max(term_scores.get(product_id, 0), weight * factor)
+            scores = {product_id: scores[product_id] + score for product_id, score in term_scores.items()}
+        for name, values in filters.items():
+            values = set(values)
+            scores = {product_id: score for product_id, score in scores.items()
+                      if self.values[product_id][name] in values}
+        return sorted((-score, -self.popularity[product_id], product_id) for product_id, score in scores.items())
+
+    def search(self, terms: list[str], filters: dict[str, list], include_hidden: bool = False) -> list[int]:
+        """
+        id найденных товаров в порядке ранжирования.
+        """
+        return [key[-1] for key in self.ranked(terms, filters, include_hidden)]
+
+    def page(self, terms: list[str], filters: dict[str, list], page: int,
+             page_size: int = PAGE_SIZE) -> tuple[list[int], int]:
+        """
+        id товаров страницы и количество страниц, номера страниц как у Paginator.get_page.
+        """
+        ids = self.search(terms, filters)
+        num_pages = max(1, -(-len(ids) // page_size))
+        if page < 1:
+            page = num_pages
+        return ids[(page - 1) * page_size:page * page_size], num_pages
+
+    def cursor_page(self, terms: list[str], filters: dict[str, list], cursor: str,
+                    page_size: int = PAGE_SIZE) -> tuple[list[int], str | None]:
+        """
+        Страница по курсору в формате api.pagination: курсор хранит ключ ранжирования последнего товара,
+        поэтому страницы не сдвигаются, если между запросами каталог изменился.
+        """
+        keys = self.ranked(terms, filters)
+        start = 0
+        if cursor:
+            start = bisect_right(keys, tuple(decode_cursor(cursor, SEARCH_CURSOR, key_size=3)))
+        taken = keys[start:start + page_size + 1]
+        if len(taken) <= page_size:
+            return [key[-1] for key in taken], None
+        taken = taken[:page_size]
+        return [key[-1] for key in taken], encode_cursor(SEARCH_CURSOR, list(taken[-1]))
+
+
+_index: SearchIndex | None = None
+_lock = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    """
+    Индекс текущей версии каталога, пересобирается при первом обращении после изменения товаров.
+    """
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        if _index is None or _index.version != version:
+            _index = SearchIndex(version)
+        return _index
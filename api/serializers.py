@@ -1,5 +1,13 @@
+from collections import defaultdict
+from typing import Iterable
+
+from django.conf import settings
+from django.db.models import QuerySet
 from rest_framework import serializers
+from shop.images import image_srcset
 from shop.models import Product, ProductImage, CartItem
+from .cart import add_cart_item
+from .metrics import timed_serialization
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
@@ -12,8 +20,20 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return instance.image.url
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """
+    Время to_representation попадает в показатель serialize_ms статистики запросов (api.metrics).
+    """
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
+    # Для каждого изображения из images - уменьшенные копии: {"webp": "url 320w, url 640w", "jpeg": "..."}
+    srcset = serializers.SerializerMethodField()
     popularity = serializers.IntegerField(default=0, read_only=True)
 
     class Meta:
@@ -22,11 +42,68 @@ class ProductSerializer(serializers.ModelSerializer):
             "id", "name", "season", "width",
             "load_index", "profile", "speed_index", "diameter",
             "tire_model", "product_code", "manufacturer",
-            "description", "price", "images", "popularity"
+            "description", "price", "images", "srcset", "popularity"
         ]
 
+    def get_srcset(self, product: Product) -> list[dict]:
+        return [image_srcset(image.derivatives) for image in product.images.all()]
+
+
+# Поля ProductSerializer, которые читаются напрямую из строки товара
+PRODUCT_ROW_FIELDS = [name for name in ProductSerializer.Meta.fields if name not in ("images", "srcset")]
+
+
+def use_fast_serializer(view_name: str) -> bool:
+    """
+    Включена ли быстрая сериализация товаров для представления (настройка FAST_SERIALIZER_VIEWS).
+    """
+    return view_name in getattr(settings, "FAST_SERIALIZER_VIEWS", ())
+
+
+def product_rows(products: QuerySet, *extra_fields: str) -> QuerySet:
+    """
+    Товары в виде словарей values() с полями ProductSerializer, без изображений.
+    extra_fields - дополнительные поля, например ключ сортировки для курсора.
+    """
+    return products.prefetch_related(None).values(*PRODUCT_ROW_FIELDS, *extra_fields)
+
+
+def product_images(rows: list[dict]) -> QuerySet:
+    """
+    Изображения товаров rows: (product_id, image, derivatives).
+    """
+    return ProductImage.objects.filter(product_id__in=[row["id"] for row in rows]).values_list(
+        "product_id", "image", "derivatives"
+    )
+
+
+def build_product_rows(rows: list[dict], images_rows: Iterable[tuple]) -> list[dict]:
+    images = defaultdict(list)
+    srcsets = defaultdict(list)
+    storage = ProductImage._meta.get_field("image").storage
+    for product_id, name, derivatives in images_rows:
+        images[product_id].append(storage.url(name))
+        srcsets[product_id].append(image_srcset(derivatives))
+    return [
+        {
+            name: images[row["id"]] if name == "images" else srcsets[row["id"]] if name == "srcset" else row[name]
+            for name in ProductSerializer.Meta.fields
+        }
+        for row in rows
+    ]
+
+
+def serialize_product_rows(rows: Iterable[dict]) -> list[dict]:
+    """
+    Быстрая сериализация только для чтения: тот же результат, что ProductSerializer(many=True).data,
+    но без экземпляров моделей и полей DRF. URL изображений загружаются одним запросом.
+    """
+    with timed_serialization():
+        rows = list(rows)
+        return build_product_rows(rows, product_images(rows) if rows else [])
+
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
 
@@ -36,18 +113,12 @@ class CartItemSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         # Логика для создания нового CartItem
-        session_id = self.context['request'].session.session_key
+        cart_id = self.context['request'].session["cart_id"]
         product_id = validated_data.get('product_id')
         quantity = validated_data.get('quantity', 1)
 
-        cart_item, created = CartItem.objects.get_or_create(
-            session_id=session_id,
-            product_id=product_id,
-            defaults={'quantity': quantity}
-        )
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        add_cart_item(cart_id, product_id, quantity)
+        cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
 
         return cart_item
 
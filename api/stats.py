@@ -0,0 +1,11 @@
+import math
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
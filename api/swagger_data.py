@@ -3,19 +3,19 @@ from drf_yasg import openapi
 combined_filters_example = {
     "application/json": {
         "width": [
-            1, 2
+            {"id": "eae27d77ca20db309e056e3d2dcd7d69", "label": 205, "count": 12},
         ],
         "profile": [
-            3, 4
+            {"id": "b53b3a3d6ab90ce0268229151c9bde11", "label": 55, "count": 7},
         ],
         "diameter": [
-            5, 67, 89
+            {"id": "70efdf2ec9b086079795c442636b55fb", "label": 17, "count": 4},
         ],
         "season": [
-            "winter studded", "winter non-studded", "summer"
+            {"id": "6b1628b016dff46e6fa35684be6acc96", "label": "summer", "count": 9},
         ],
         "manufacturer": [
-            "Компания1", "компания2",
+            {"id": "6748731ce226b05ced8f0178907e80e7", "label": "Компания1", "count": 3},
         ]
     }
 }
@@ -92,6 +92,15 @@ product_detail_example = {
     "images": [
         "/media/product_images/wheel-1.png",
         "/media/product_images/wheel-2.png"
+    ],
+    "srcset": [
+        {
+            "webp": "/media/product_images/derived/wheel-1_320.webp 320w, "
+                    "/media/product_images/derived/wheel-1_640.webp 640w",
+            "jpeg": "/media/product_images/derived/wheel-1_320.jpeg 320w, "
+                    "/media/product_images/derived/wheel-1_640.jpeg 640w"
+        },
+        {}
     ]
 }
 
@@ -147,3 +156,10 @@ cart_example = {
 
         ]}
 }
+
+# Операция пакетного изменения корзины
+cart_operation_properties = {
+    'product_id': openapi.Schema(type=openapi.TYPE_INTEGER, description="ID продукта"),
+    'delta': openapi.Schema(type=openapi.TYPE_INTEGER, description="Изменение количества"),
+    'set_quantity': openapi.Schema(type=openapi.TYPE_INTEGER, description="Новое количество, 0 - удалить"),
+}
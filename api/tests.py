@@ -1,3 +1,1223 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from unittest import SkipTest, mock, skipIf
+from urllib.parse import parse_qs, urlencode
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse, QueryDict
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from django.contrib.sessions.models import Session
+from django.utils.crypto import get_random_string
+from shop.catalog import get_catalog_version
+from shop.models import Product, ProductImage, Cart, CartItem, Order, OrderItem
+from .cart import (add_cart_item, remove_cart_item, invalidate_cart, purge_expired_sessions, build_cart,
+                   cart_cache_key)
+from .benchmark import create_carts, delete_ids, delete_products, seed_catalog, seed_orders, track_created, ORDER_DATA
+from .compression import brotli
+from .filters import FILTER_FIELDS, parse_filters, filter_products, sort_products
+from .management.commands.check_query_plans import common_filter_combinations, parse_plan, plan_problems
+from .metrics import MetricsMiddleware, get_request_metrics, timed_serialization
+from .models import TelegramMessage
+from .notifications import RateLimiter, claim_messages, process_outbox
+from .pagination import PAGE_SIZE, encode_cursor
+from .search import get_search_index, parse_query
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+def create_product(number: int, **kwargs) -> Product:
+    fields = {
+        "name": f"Шина {number}",
+        "season": "summer",
+        "width": 205,
+        "load_index": 91,
+        "profile": 55,
+        "speed_index": "V",
+        "diameter": 16,
+        "tire_model": "Primacy 4",
+        "product_code": number,
+        "manufacturer": "Michelin",
+        "description": "Описание",
+        "price": 5000 + number,
+    }
+    fields.update(kwargs)
+    product = Product.objects.create(**fields)
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image=f"product_images/{number}_{i}.jpg") for i in range(2)
+    ])
+    return product
+
+
+class QueryCountTests(TestCase):
+    """
+    Фиксирует количество SQL-запросов каждого эндпоинта api/urls.py,
+    чтобы N+1 в сериализации не появлялись незаметно.
+    Количество не должно зависеть от числа товаров в ответе.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.products = [create_product(i) for i in range(25)]
+        self.session_id = self.client.get(reverse("session_manage")).json()["session_id"]
+        # Без cookie сессии в счетчик не попадает загрузка сессии в SessionMiddleware
+        self.session_cookie = self.client.cookies["sessionid"].value
+        self.client.cookies.clear()
+
+    def fill_cart(self, count: int = 5):
+        Cart.objects.get_or_create(key=self.session_id)
+        CartItem.objects.bulk_create([
+            CartItem(cart_id=self.session_id, product=product, quantity=2) for product in self.products[:count]
+        ])
+        invalidate_cart(self.session_id)
+
+    def test_combined_filters(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse("combined_filters"))
+        # Повторный запрос берется из кэша
+        with self.assertNumQueries(0):
+            self.client.get(reverse("combined_filters"), {"width": "205"})
+
+    def test_product_list(self):
+        # Страница, COUNT(*) и изображения всех товаров страницы
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.json()), 20)
+        with self.assertNumQueries(3):
+            self.client.get(reverse("product_list"), {"sort": "price", "page": 2, "width": "205"})
+
+    def test_product_list_cursor(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("product_list"), {"cursor": ""})
+        with self.assertNumQueries(2):
+            self.client.get(reverse("product_list"), {"cursor": response.json()["next_cursor"]})
+
+    @override_settings(CATALOG_ENGINE="memory")
+    def test_product_list_memory_engine(self):
+        self.client.get(reverse("product_list"))
+        with self.assertNumQueries(2):
+            self.client.get(reverse("product_list"), {"page": 2})
+
+    def test_product_detail(self):
+        with self.assertNumQueries(2):
+            self.client.get(reverse("product_detail", args=[self.products[0].id]))
+
+    def test_product_search(self):
+        self.client.get(reverse("product_search"), {"q": "шина"})
+        # Поиск по индексу в памяти, из базы загружаются только товары страницы и изображения
+        with self.assertNumQueries(2):
+            self.client.get(reverse("product_search"), {"q": "michelin 205/55 R16"})
+
+    def test_session_manage(self):
+        # Сохранение новой сессии в базу (SessionStore.create)
+        with self.assertNumQueries(4):
+            self.client.get(reverse("session_manage"))
+
+    @override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies")
+    def test_session_manage_signed_cookies(self):
+        # Новый клиент: SessionMiddleware загружает движок сессий при первом запросе
+        with self.assertNumQueries(0):
+            response = Client().get(reverse("session_manage"))
+        self.assertTrue(response.json()["created"])
+        self.assertFalse(Cart.objects.filter(key=response.json()["session_id"]).exists())
+
+    def test_session_manage_cart_count(self):
+        self.fill_cart()
+        self.client.get(reverse("cart_items"), {"session_id": self.session_id})
+        self.client.cookies["sessionid"] = self.session_cookie
+        # Загрузка сессии в SessionMiddleware, счетчик корзины - из кэша
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("session_manage"))
+        self.assertEqual(response.json(), {"session_id": self.session_id, "cart_items_count": 5, "created": False})
+
+    def test_cart_items(self):
+        self.fill_cart()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("cart_items"), {"session_id": self.session_id})
+        self.assertEqual(len(response.json()["items"]), 5)
+        with self.assertNumQueries(0):
+            self.client.get(reverse("cart_items"), {"session_id": self.session_id})
+
+    def test_add_to_cart(self):
+        self.fill_cart(0)
+        # Отметка изменения корзины, изменение позиции и запись корзины в кэш (товары и изображения)
+        with self.assertNumQueries(8):
+            self.client.post(reverse("add_to_cart"), {"session_id": self.session_id, "product_id": self.products[0].id})
+
+    def test_remove_from_cart(self):
+        self.fill_cart()
+        with self.assertNumQueries(4):
+            self.client.post(reverse("remove_from_cart"),
+                             {"session_id": self.session_id, "product_id": self.products[0].id})
+
+    def test_cart_batch(self):
+        self.fill_cart(2)
+        operations = [{"product_id": product.id, "delta": 1} for product in self.products[:10]]
+        # Проверка товаров, savepoint, отметка изменения корзины, блокировка позиций, UPDATE, INSERT, release
+        # и итоговая корзина с изображениями. Количество запросов не зависит от числа операций
+        with self.assertNumQueries(9):
+            self.client.post(reverse("cart_batch"), {"session_id": self.session_id, "operations": operations},
+                             content_type="application/json")
+
+    def test_create_order(self):
+        self.fill_cart()
+        data = {
+            "session_id": self.session_id,
+            "contact_info": {"individual": {"surname": "Иванов", "name": "Иван", "patronymic": "", "phone": "1"}},
+            "address": {"city": "Москва", "street": "Тверская", "house_number": "1", "apartment_or_office": "1",
+                        "entrance": "1", "floor": "1", "intercom": "1"},
+        }
+        # Корзина, заказ, адрес, контакт, позиции, популярность, очистка корзины, уведомление
+        # и SAVEPOINT/RELEASE транзакции заказа внутри транзакции теста, затем пустая корзина записывается в кэш
+        with self.assertNumQueries(11):
+            response = self.client.post(reverse("create_order"), data, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_create_order_empty_cart(self):
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse("create_order"), {"session_id": self.session_id},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_cities(self):
+        with self.assertNumQueries(0):
+            self.client.get(reverse("get_cities"))
+
+    def test_callback_order(self):
+        with self.assertNumQueries(1):
+            self.client.post(reverse("callback_order"), {"name": "Иван", "phone": "1", "question": "Вопрос"})
+
+
+class PopularityTests(TestCase):
+    """
+    Счетчики популярности: увеличение при заказе, пересчет командой rebuild_popularity и сортировки по ним.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.first, self.second, self.third = [create_product(i) for i in range(3)]
+
+    def order(self, products: list[Product], days_ago: float = 0):
+        order = Order.objects.create(total_price=0)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=1) for product in products])
+        Order.objects.filter(id=order.id).update(created=timezone.now() - timedelta(days=days_ago))
+
+    def listed(self, sort: str) -> list[int]:
+        return [product["id"] for product in self.client.get(reverse("product_list"), {"sort": sort}).json()]
+
+    def test_create_order_increments_popularity(self):
+        self.assertEqual(self.listed("popularity"), [self.first.id, self.second.id, self.third.id])
+        etag = self.client.get(reverse("product_detail", args=[self.second.id]))["ETag"]
+        for products in ([self.first, self.second], [self.second]):
+            cart_id = create_carts(1, [product.id for product in products], quantity=3)[0]
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse("create_order"), {"session_id": cart_id, **ORDER_DATA},
+                                            content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+        # Позиция заказа увеличивает популярность на 1 независимо от количества
+        popularity = dict(Product.objects.values_list("id", "popularity"))
+        self.assertEqual(popularity, {self.first.id: 1, self.second.id: 2, self.third.id: 0})
+        # Заказ меняет версию каталога: кэш ответов и ETag не отдают прежнюю популярность
+        self.assertEqual(self.listed("popularity"), [self.second.id, self.first.id, self.third.id])
+        response = self.client.get(reverse("product_detail", args=[self.second.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()["popularity"], 2)
+
+    def test_rebuild_popularity(self):
+        self.order([self.first])
+        self.order([self.second, self.third], days_ago=56)
+        self.order([self.second], days_ago=56)
+        for _ in range(3):
+            self.order([self.third], days_ago=14)
+        # Счетчики разошлись с историей заказов
+        Product.objects.update(popularity=100, trending=100)
+        self.listed("popularity")
+
+        call_command("rebuild_popularity", "--trending", "--half-life", "14", stdout=StringIO())
+        products = {product.id: product for product in Product.objects.all()}
+        self.assertEqual([products[product.id].popularity for product in (self.first, self.second, self.third)],
+                         [1, 2, 4])
+        # Вес заказа: 0.5 ** (возраст / период полураспада)
+        for product, expected in ((self.first, 1), (self.second, 2 * 0.0625), (self.third, 3 * 0.5 + 0.0625)):
+            self.assertAlmostEqual(products[product.id].trending, expected, places=4)
+
+        # Кэш списка товаров старой версии каталога не используется
+        self.assertEqual(self.listed("popularity"), [self.third.id, self.second.id, self.first.id])
+        self.assertEqual(self.listed("trending"), [self.third.id, self.first.id, self.second.id])
+
+    def test_rebuild_without_trending_keeps_it(self):
+        self.order([self.second])
+        Product.objects.filter(id=self.first.id).update(trending=5)
+        # popularity пересчитывается одним UPDATE с подзапросом, без чтения товаров
+        with self.assertNumQueries(1):
+            call_command("rebuild_popularity", stdout=StringIO())
+        self.assertEqual(Product.objects.get(id=self.first.id).trending, 5)
+        self.assertEqual(self.listed("popularity"), [self.second.id, self.first.id, self.third.id])
+
+
+class FastSerializerTests(TestCase):
+    """
+    Быстрая сериализация товаров должна давать тот же JSON, что и ProductSerializer.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.products = [create_product(i, popularity=i % 4, price=5000 + i % 3) for i in range(30)]
+        ProductImage.objects.filter(product=self.products[1]).delete()
+
+    def responses(self) -> list[bytes]:
+        caches["responses"].clear()
+        result = []
+        for params in [{}, {"sort": "price", "page": 2}, {"cursor": ""}, {"cursor": "", "sort": "trending"}]:
+            result.append(self.client.get(reverse("product_list"), params).content)
+        for product in self.products[:2]:
+            result.append(self.client.get(reverse("product_detail", args=[product.id])).content)
+        return result
+
+    def test_same_json(self):
+        with override_settings(FAST_SERIALIZER_VIEWS=[]):
+            expected = self.responses()
+        with override_settings(FAST_SERIALIZER_VIEWS=["product_list", "product_detail"]):
+            self.assertEqual(self.responses(), expected)
+        with override_settings(FAST_SERIALIZER_VIEWS=["product_list", "product_detail"], CATALOG_ENGINE="memory"):
+            self.assertEqual(self.responses(), expected)
+
+
+def raw_cursor(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+# Курсоры, которые нельзя принять: не base64/JSON, не тот формат, значения не тех типов
+MALFORMED_CURSORS = [
+    "bad", "курсор", raw_cursor(["a", None]), raw_cursor({"s": "price"}), raw_cursor({"s": "price", "k": [1]}),
+    encode_cursor("price", [[1], 2]), encode_cursor("price", ["a", None]), encode_cursor("price", [5000, "1"]),
+    encode_cursor("price", [5000, 1.5]), encode_cursor("price", [True, 1]), encode_cursor("price", [5000, 2 ** 70]),
+    raw_cursor({"s": "price", "k": [float("nan"), 1]}),
+]
+
+
+class CursorPaginationTests(TestCase):
+    """
+    Постраничный вывод списка товаров по курсору.
+    """
+
+    def setUp(self):
+        clear_caches()
+        # Много товаров с одинаковой ценой и популярностью: страницы режутся внутри групп равных значений
+        for i in range(45):
+            create_product(i, width=205 + i % 2 * 10, price=5000 + i % 4, popularity=i % 3)
+        create_product(100, visible=False, price=4000, popularity=10)
+
+    def walk(self, params: dict) -> list[int]:
+        ids = []
+        cursor = ""
+        while cursor is not None:
+            response = self.client.get(reverse("product_list"), {**params, "cursor": cursor})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data["results"]), PAGE_SIZE)
+            ids.extend(product["id"] for product in data["results"])
+            cursor = data["next_cursor"]
+        return ids
+
+    def expected(self, params: dict) -> list[int]:
+        products = filter_products(Product.objects.filter(visible=True), parse_filters(params))
+        return list(sort_products(products, params.get("sort", "popularity")).values_list("id", flat=True))
+
+    def test_walk_without_duplicates_or_gaps(self):
+        for params in ({}, {"sort": "price"}, {"sort": "trending"}, {"sort": "price", "width": "215"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.walk(params), self.expected(params))
+
+    def test_malformed_cursor(self):
+        for cursor in MALFORMED_CURSORS:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse("product_list"), {"sort": "price", "cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"error": "Некорректный курсор"})
+
+    def test_sort_mismatch(self):
+        cursor = self.client.get(reverse("product_list"), {"sort": "price", "cursor": ""}).json()["next_cursor"]
+        response = self.client.get(reverse("product_list"), {"sort": "popularity", "cursor": cursor})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Курсор выдан для другой сортировки"})
+
+
+class AsyncViewsTests(TestCase):
+    """
+    Асинхронные представления api.async_views отдают те же ответы, что и синхронные api.views.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.products = [create_product(i, width=205 + i % 2 * 10, popularity=i % 4) for i in range(25)]
+        self.cart_id = create_carts(1, [product.id for product in self.products[:3]])[0]
+
+    def test_same_responses(self):
+        product_id = self.products[0].id
+        cases = [
+            ("product_list", [], {}),
+            ("product_list", [], {"sort": "price", "page": 2, "width": "205,215"}),
+            ("product_list", [], {"page": 5}),
+            ("product_list", [], {"cursor": "", "sort": "trending"}),
+            ("product_list", [], {"cursor": "bad"}),
+            ("product_detail", [product_id], {}),
+            ("product_detail", [0], {}),
+            ("combined_filters", [], {"width": "205"}),
+            ("cart_items", [], {"session_id": self.cart_id}),
+            ("cart_items", [], {}),
+            ("get_cities", [], {"q": "моск"}),
+        ]
+        settings = [{"CATALOG_ENGINE": engine, "FAST_SERIALIZER_VIEWS": fast}
+                    for engine in ("db", "memory") for fast in (["product_list", "product_detail"], [])]
+        for options in settings:
+            for name, args, params in cases:
+                with self.subTest(name=name, params=params, **options), override_settings(**options):
+                    caches["responses"].clear()
+                    expected = self.client.get(reverse(name, args=args), params)
+                    caches["responses"].clear()
+                    response = self.client.get(reverse(f"async_{name}", args=args), params)
+                    self.assertEqual(response.status_code, expected.status_code)
+                    self.assertEqual(response.content, expected.content)
+                    self.assertEqual(response.get("ETag"), expected.get("ETag"))
+
+    @override_settings(FAST_SERIALIZER_VIEWS=[])
+    def test_fast_serializer_setting(self):
+        with mock.patch("api.listing.serialize_product_rows", side_effect=AssertionError("быстрый путь выключен")):
+            for params in ({}, {"cursor": ""}):
+                self.assertEqual(self.client.get(reverse("async_product_list"), params).status_code, 200)
+            self.assertEqual(self.client.get(reverse("async_product_detail", args=[self.products[0].id])).status_code,
+                             200)
+
+    def test_shared_response_cache(self):
+        self.client.get(reverse("product_list"))
+        response = self.client.get(reverse("async_product_list"))
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    def test_conditional_and_methods(self):
+        response = self.client.get(reverse("async_get_cities"))
+        self.assertIn("public", response["Cache-Control"])
+        response = self.client.get(reverse("async_get_cities"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.post(reverse("async_product_list")).status_code, 405)
+
+    async def test_async_client(self):
+        response = await self.async_client.get(reverse("async_product_detail", args=[self.products[1].id]))
+        self.assertEqual(response.json()["product_code"], 1)
+        response = await self.async_client.get(reverse("async_cart_items"), {"session_id": self.cart_id})
+        self.assertEqual(len(response.json()["items"]), 3)
+
+
+# Новое изображение без файла: уменьшенные копии не создаются, пул процессов в тестах не нужен
+@override_settings(IMAGE_WORKERS=0)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.product = create_product(1, width=205)
+        create_product(2, width=215)
+
+    def test_hit_after_miss(self):
+        response = self.client.get(reverse("product_list"), {"width": "215,205"})
+        self.assertEqual(response["X-Cache"], "MISS")
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse("product_list"), {"width": "205,215"})
+        self.assertEqual(cached["X-Cache"], "HIT")
+        self.assertEqual(cached.content, response.content)
+
+    def test_product_change_invalidates(self):
+        url = reverse("product_detail", args=[self.product.id])
+        self.client.get(url)
+        self.product.price = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["price"], 1)
+
+    def test_image_change_invalidates(self):
+        url = reverse("product_detail", args=[self.product.id])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image="product_images/new.jpg")
+        response = self.client.get(url)
+        self.assertEqual(len(response.json()["images"]), 3)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        get_request_metrics().reset()
+        create_product(1)
+
+    def test_metrics_endpoint(self):
+        for _ in range(3):
+            self.client.get(reverse("product_list"))
+        self.client.get(reverse("index"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        data = self.client.get(reverse("metrics"), {"reset": "1"}).json()
+        self.assertEqual(list(data), ["metrics", "product_list"])
+        stats = data["product_list"]
+        self.assertEqual((stats["requests"], stats["errors"]), (3, 0))
+        # Первый запрос - промах кэша ответов с запросами к базе, остальные из кэша
+        self.assertEqual(stats["sql_queries"]["p50"], 0)
+        self.assertGreater(stats["sql_queries"]["max"], 0)
+        self.assertGreater(stats["serialize_ms"]["max"], 0)
+        self.assertGreater(stats["render_ms"]["max"], 0)
+        self.assertGreaterEqual(stats["wall_ms"]["p99"], stats["wall_ms"]["p50"])
+        self.assertEqual(list(self.client.get(reverse("metrics")).json()), ["metrics"])
+
+    @override_settings(FAST_SERIALIZER_VIEWS=[])
+    async def test_async_requests(self):
+        # AsyncClient собирает цепочку middleware в асинхронном режиме: MetricsMiddleware.__acall__
+        response = await self.async_client.get(reverse("async_product_list"))
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse("async_cart_items"), {"session_id": "missing"})
+        self.assertEqual(response.status_code, 200)
+        snapshot = get_request_metrics().snapshot()
+        self.assertEqual(snapshot["async_product_list"]["requests"], 1)
+        self.assertGreater(snapshot["async_product_list"]["serialize_ms"]["max"], 0)
+        self.assertEqual(snapshot["async_cart_items"]["requests"], 1)
+
+    async def test_async_sql_in_worker_thread(self):
+        # Как под ASGI: синхронный код запроса выполняется в отдельном потоке со своим соединением с базой
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            # Соединение другого потока не видит общую базу в памяти, пока ее держит транзакция теста
+            raise SkipTest("SQLite в памяти: таблица заблокирована транзакцией теста")
+        def view():
+            try:
+                list(Product.objects.values_list("id", flat=True))
+                with timed_serialization():
+                    time.sleep(0.01)
+            finally:
+                connection.close()
+            return HttpResponse()
+
+        async def get_response(request):
+            request.resolver_match = resolve(reverse("async_product_list"))
+            return await sync_to_async(view, thread_sensitive=False)()
+
+        middleware = MetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        await middleware(RequestFactory().get(reverse("async_product_list")))
+        stats = get_request_metrics().snapshot()["async_product_list"]
+        self.assertEqual(stats["sql_queries"]["max"], 1)
+        self.assertGreaterEqual(stats["serialize_ms"]["max"], 10)
+
+    @override_settings(SLOW_REQUEST_MS=0.001)
+    def test_slow_log(self):
+        with self.assertLogs("api.slow", "WARNING") as logs:
+            self.client.get(reverse("product_list"))
+        self.assertIn("GET /api/products/ 200", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+
+class CartCacheTests(TestCase):
+    """
+    Корзина в кэше обновляется при каждом изменении через API и при изменении цен.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.products = [create_product(i) for i in range(2)]
+        self.session_id = get_random_string(32)
+
+    def cart(self):
+        return self.client.get(reverse("cart_items"), {"session_id": self.session_id}).json()
+
+    def test_write_through(self):
+        self.assertEqual(self.cart()["items"], [])
+        self.client.post(reverse("add_to_cart"), {"session_id": self.session_id, "product_id": self.products[0].id})
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.cart()["items"]), 1)
+        self.client.post(reverse("remove_from_cart"),
+                         {"session_id": self.session_id, "product_id": self.products[0].id})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cart()["items"], [])
+
+    def test_invalid_session_id(self):
+        # Ключ длиннее Cart.key или с недопустимыми символами - 400 до обращения к базе
+        for session_id in ["x" * 41, "a b", ["list"]]:
+            for name in ["add_to_cart", "remove_from_cart", "cart_batch", "create_order"]:
+                data = {"session_id": session_id, "product_id": self.products[0].id,
+                        "operations": [{"product_id": self.products[0].id, "delta": 1}]}
+                with self.assertNumQueries(0):
+                    response = self.client.post(reverse(name), data, content_type="application/json")
+                self.assertEqual(response.status_code, 400, name)
+            if isinstance(session_id, str):
+                for name in ["cart_items", "async_cart_items"]:
+                    self.assertEqual(self.client.get(reverse(name), {"session_id": session_id}).status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_stale_snapshot_is_not_served(self):
+        # Параллельный запрос собрал корзину до изменения, а записал в кэш после refresh_cart
+        key = cart_cache_key(self.session_id)
+        stale = build_cart(self.session_id)
+        self.client.post(reverse("add_to_cart"), {"session_id": self.session_id, "product_id": self.products[0].id})
+        cache.set(key, stale)
+        self.assertEqual(len(self.cart()["items"]), 1)
+
+    def test_price_change(self):
+        add_cart_item(self.session_id, self.products[0].id, 2)
+        self.assertEqual(self.cart()["total_price"], self.products[0].price * 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.products[0]
+            product.price = 100
+            product.save()
+        self.assertEqual(self.cart()["total_price"], 200)
+
+
+class ConditionalGetTests(TestCase):
+    """
+    ETag по версиям каталога и корзины: 304 отдается до обращения к базе, сжатые ответы сохраняют ETag.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.product = create_product(1)
+        self.session_id = get_random_string(32)
+
+    def test_catalog_not_modified(self):
+        for url in [reverse("product_list"), reverse("product_detail", args=[self.product.id])]:
+            etag = self.client.get(url)["ETag"]
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cart_not_modified(self):
+        url = reverse("cart_items")
+        etag = self.client.get(url, {"session_id": self.session_id})["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {"session_id": self.session_id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.client.post(reverse("add_to_cart"), {"session_id": self.session_id, "product_id": self.product.id})
+        response = self.client.get(url, {"session_id": self.session_id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(response.json()["items"]), 1)
+        # Другая корзина - другой ETag
+        other = self.client.get(url, {"session_id": get_random_string(32)})
+        self.assertNotEqual(other["ETag"], response["ETag"])
+
+    def test_gzip(self):
+        plain = self.client.get(reverse("get_cities"))
+        response = self.client.get(reverse("get_cities"), HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(response["ETag"], "W/" + plain["ETag"])
+        response = self.client.get(reverse("get_cities"), HTTP_ACCEPT_ENCODING="gzip",
+                                   HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    @skipIf(brotli is None, "пакет brotli не установлен")
+    def test_brotli(self):
+        plain = self.client.get(reverse("get_cities"))
+        response = self.client.get(reverse("get_cities"), HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+    @skipIf(brotli is None, "пакет brotli не установлен")
+    def test_brotli_skips_html(self):
+        # HTML с CSRF-токеном сжимается только gzip со случайными байтами против BREACH
+        response = self.client.get(reverse("admin:login"), HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+
+def catalog_sample() -> list[Product]:
+    """
+    Товары с разными сочетаниями значений всех фильтров и несколько скрытых.
+    """
+    seasons = [season for season, _ in Product.seasons]
+    manufacturers = ["Michelin", "Nokian", "Pirelli"]
+    return [
+        create_product(i, width=(195, 205, 215)[i % 3], profile=(55, 60)[i % 2], diameter=(15, 16, 17, 18)[i % 4],
+                       season=seasons[i % 5 % 3], manufacturer=manufacturers[i % 7 % 3], price=5000 + i % 6 * 100,
+                       popularity=i % 5, visible=i % 11 != 0)
+        for i in range(60)
+    ]
+
+
+# Сочетания фильтров: по одному значению, несколько значений, несколько фильтров и значение без товаров
+FACET_FILTERS = [
+    {}, {"width": "205"}, {"width": "195,215", "season": "summer"},
+    {"diameter": "16,17", "profile": "55", "manufacturer": "Nokian"},
+    {"width": "205", "profile": "60", "diameter": "15,18", "season": "summer,winter studded"},
+    {"manufacturer": "Michelin,Pirelli", "width": "999"},
+]
+
+
+class FacetTests(TestCase):
+    """
+    Счетчики combined_filters совпадают с наивным подсчетом DISTINCT-запросами к базе.
+    """
+
+    def setUp(self):
+        clear_caches()
+        catalog_sample()
+
+    def naive_facets(self, filters: dict[str, list]) -> dict[str, list]:
+        visible = Product.objects.filter(visible=True)
+        result = {}
+        for name in FILTER_FIELDS:
+            # Собственный фильтр значения не учитывается
+            others = {other: values for other, values in filters.items() if other != name}
+            products = filter_products(visible, others)
+            result[name] = [
+                {"id": hashlib.md5(f"{value}".encode()).hexdigest(), "label": value,
+                 "count": products.filter(**{name: value}).count()}
+                for value in visible.values_list(name, flat=True).distinct().order_by(name)
+            ]
+        return result
+
+    def test_counts_match_naive(self):
+        for params in FACET_FILTERS:
+            with self.subTest(params=params):
+                response = self.client.get(reverse("combined_filters"), params)
+                self.assertEqual(response.json(), self.naive_facets(parse_filters(QueryDict(urlencode(params)))))
+
+
+class CatalogIndexTests(TestCase):
+    """
+    CATALOG_ENGINE = "memory" отдает те же страницы и счетчики, что и запросы к базе.
+    """
+
+    def setUp(self):
+        clear_caches()
+        catalog_sample()
+
+    def get(self, engine: str, name: str, params: dict):
+        caches["responses"].clear()
+        with override_settings(CATALOG_ENGINE=engine):
+            return self.client.get(reverse(name), params)
+
+    def walk(self, engine: str, params: dict) -> list[int]:
+        ids = []
+        cursor = ""
+        while cursor is not None:
+            data = self.get(engine, "product_list", {**params, "cursor": cursor}).json()
+            ids.extend(product["id"] for product in data["results"])
+            cursor = data["next_cursor"]
+        return ids
+
+    def test_same_as_db(self):
+        for filters in FACET_FILTERS:
+            with self.subTest(filters=filters):
+                self.assertEqual(self.get("memory", "combined_filters", filters).json(),
+                                 self.get("db", "combined_filters", filters).json())
+            for sort in ("popularity", "price", "trending"):
+                params = {**filters, "sort": sort}
+                with self.subTest(params=params):
+                    for page in (1, 2, 3, 0):
+                        expected = self.get("db", "product_list", {**params, "page": page})
+                        response = self.get("memory", "product_list", {**params, "page": page})
+                        self.assertEqual(response.status_code, expected.status_code)
+                        self.assertEqual(response.content, expected.content)
+                    self.assertEqual(self.walk("memory", params), self.walk("db", params))
+
+    def test_malformed_cursor(self):
+        for cursor in MALFORMED_CURSORS:
+            with self.subTest(cursor=cursor):
+                response = self.get("memory", "product_list", {"sort": "price", "cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+        cursor = self.get("memory", "product_list", {"sort": "price", "cursor": ""}).json()["next_cursor"]
+        self.assertEqual(self.get("memory", "product_list", {"sort": "trending", "cursor": cursor}).status_code, 400)
+
+
+@override_settings(IMAGE_WORKERS=0)
+class CatalogVersionTests(TestCase):
+    """
+    Версия каталога: заголовки ETag и Last-Modified, ее изменение при правке товаров и счетчики фильтров.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.products = [create_product(i, width=205 + i % 2 * 10) for i in range(4)]
+
+    def assertBumped(self, change):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertGreater(get_catalog_version(), version)
+
+    def test_headers_and_not_modified(self):
+        version = get_catalog_version()
+        for url in [reverse("product_list"), reverse("combined_filters"), reverse("product_search") + "?q=шина"]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response["ETag"], f'"catalog-{version}"')
+                self.assertEqual(response["Last-Modified"], http_date(version // 1000))
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+                    response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+                self.assertEqual(response.status_code, 304)
+
+    def test_signals_bump_version(self):
+        product = self.products[0]
+        self.assertBumped(lambda: Product.objects.filter(id=product.id).get().save())
+        self.assertBumped(lambda: ProductImage.objects.create(product=product, image="product_images/new.jpg"))
+        self.assertBumped(lambda: product.images.first().delete())
+        self.assertBumped(product.delete)
+
+    def test_admin_actions_bump_version(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        url = reverse("admin:shop_product_changelist")
+        selected = [product.id for product in self.products[:2]]
+        for action in ("make_hidden", "make_visible", "delete_selected"):
+            with self.subTest(action=action):
+                data = {"action": action, "_selected_action": selected, "post": "yes"}
+                self.assertBumped(lambda: self.client.post(url, data))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_hidden_products_disappear(self):
+        etag = self.client.get(reverse("product_list"))["ETag"]
+        facets = self.client.get(reverse("combined_filters")).json()
+        self.assertEqual({value["label"]: value["count"] for value in facets["width"]}, {205: 2, 215: 2})
+
+        url = reverse("admin:shop_product_changelist")
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        self.client.post(url, {"action": "make_hidden", "_selected_action": [self.products[1].id]})
+        # Другие страницы и воркеры видят новую версию: старый ETag больше не дает 304
+        response = self.client.get(reverse("product_list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(self.products[1].id, [product["id"] for product in response.json()])
+        for engine in ("db", "memory"):
+            with self.subTest(engine=engine), override_settings(CATALOG_ENGINE=engine):
+                facets = self.client.get(reverse("combined_filters")).json()
+                self.assertEqual({value["label"]: value["count"] for value in facets["width"]}, {205: 2, 215: 1})
+
+
+class SessionCleanupTests(TestCase):
+    def test_purge_expired_sessions(self):
+        product = create_product(1)
+        Session.objects.create(session_key="expired", session_data="", expire_date=timezone.now() - timedelta(days=1))
+        abandoned = create_carts(4, [product.id], updated=timezone.now() - timedelta(days=30))
+        live = create_carts(2, [product.id], updated=timezone.now() - timedelta(days=1))
+        batches = []
+        result = purge_expired_sessions(batch_size=2, cart_lifetime=14 * 24 * 60 * 60,
+                                        on_batch=lambda seconds, deleted: batches.append(deleted))
+        self.assertEqual(result, {"sessions": 1, "carts": 4, "cart_items": 4, "batches": 3})
+        self.assertEqual(len(batches), 3)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.filter(key__in=abandoned).exists())
+        self.assertEqual(CartItem.objects.filter(cart_id__in=live).count(), 2)
+
+
+class BenchmarkCleanupTests(TestCase):
+    """
+    Нагрузочные тесты удаляют только созданные ими данные.
+    """
+
+    def test_created_data_is_tracked(self):
+        product = create_product(1)
+        other_order = Order.objects.create(total_price=100)
+        other_message = TelegramMessage.objects.create(text="чужое")
+        with track_created(Order, TelegramMessage) as created:
+            order_ids = seed_orders(3, [product.id])
+            message = TelegramMessage.objects.create(text="тест")
+        # Заказ, созданный после теста другим процессом, получает id больше всех тестовых
+        later_order = Order.objects.create(total_price=200)
+        self.assertEqual(created[TelegramMessage], {message.id})
+
+        delete_ids(Order, {*order_ids, *created[Order]})
+        delete_ids(TelegramMessage, created[TelegramMessage])
+        self.assertEqual(set(Order.objects.values_list("id", flat=True)), {other_order.id, later_order.id})
+        self.assertEqual(list(TelegramMessage.objects.values_list("id", flat=True)), [other_message.id])
+
+    def test_seed_catalog_ids(self):
+        existing = create_product(1)
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            product_ids = seed_catalog(5, images=1, batch_size=2)
+        self.assertEqual(len(product_ids), 5)
+        self.assertEqual(ProductImage.objects.filter(product_id__in=product_ids).count(), 5)
+        # Кэши каталога не отдают состояние до заполнения и после удаления
+        seeded = get_catalog_version()
+        self.assertGreater(seeded, version)
+        self.assertEqual(delete_products(product_ids), 10)
+        self.assertGreater(get_catalog_version(), seeded)
+        self.assertEqual(list(Product.objects.values_list("id", flat=True)), [existing.id])
+
+    def test_bench_cleanup_refuses_existing_data(self):
+        Session.objects.create(session_key="expired", session_data="", expire_date=timezone.now() - timedelta(days=1))
+        with self.assertRaisesMessage(CommandError, "--yes-destroy"):
+            call_command("bench_cleanup", carts=10, stdout=StringIO())
+        self.assertTrue(Session.objects.exists())
+
+        stdout = StringIO()
+        call_command("bench_cleanup", carts=10, chunk=4, yes_destroy=True, stdout=stdout)
+        # Удалены сессии брошенных корзин (9) и существовавшая истекшая, сессия живой корзины - после теста
+        self.assertIn("Удалено сессий: 10,", stdout.getvalue())
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Product.objects.exists())
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        self.products = [create_product(i) for i in range(3)]
+        self.session_id = get_random_string(32)
+        add_cart_item(self.session_id, self.products[0].id, 5)
+        add_cart_item(self.session_id, self.products[1].id, 1)
+
+    def batch(self, operations):
+        return self.client.post(reverse("cart_batch"), {"session_id": self.session_id, "operations": operations},
+                                content_type="application/json")
+
+    def test_operations(self):
+        first, second, third = self.products
+        response = self.batch([
+            {"product_id": first.id, "delta": -2},
+            {"product_id": second.id, "set_quantity": 0},
+            {"product_id": third.id, "set_quantity": 4},
+            {"product_id": third.id, "delta": 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        quantities = {item["product"]["id"]: item["quantity"] for item in response.json()["items"]}
+        self.assertEqual(quantities, {first.id: 3, third.id: 5})
+        self.assertEqual(response.json()["total_price"], first.price * 3 + third.price * 5)
+
+    def test_unknown_product_changes_nothing(self):
+        response = self.batch([{"product_id": self.products[0].id, "delta": 1}, {"product_id": 999, "delta": 1}])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["product_ids"], [999])
+        self.assertEqual(CartItem.objects.get(product=self.products[0]).quantity, 5)
+
+    def test_invalid_operation(self):
+        response = self.batch([{"product_id": self.products[0].id, "delta": 1, "set_quantity": 2}])
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.summer = create_product(1, name="Michelin Primacy 4 205/55 R16", popularity=5)
+        self.winter = create_product(2, name="Nokian Hakkapeliitta 10 215/60 R17", manufacturer="Nokian",
+                                     tire_model="Hakkapeliitta 10", width=215, profile=60, diameter=17,
+                                     season="winter studded")
+        self.other = create_product(3, name="Michelin Pilot Sport 205/55 R17", tire_model="Pilot Sport", diameter=17)
+
+    def search(self, **params) -> list[int]:
+        response = self.client.get(reverse("product_search"), params)
+        self.assertEqual(response.status_code, 200)
+        return [product["id"] for product in response.json()]
+
+    def test_parse_query(self):
+        self.assertEqual(parse_query("Michelin 205/55 R16"),
+                         ({"width": [205], "profile": [55], "diameter": [16]}, ["michelin"]))
+        self.assertEqual(parse_query("205/55ZR16"), ({"width": [205], "profile": [55], "diameter": [16]}, []))
+        self.assertEqual(parse_query("нокиан р17"), ({"diameter": [17]}, ["нокиан"]))
+
+    def test_search(self):
+        self.assertEqual(self.search(q="hakka"), [self.winter.id])
+        self.assertEqual(self.search(q="michelin"), [self.summer.id, self.other.id])
+        self.assertEqual(self.search(q="205/55 R17"), [self.other.id])
+        self.assertEqual(self.search(q="michelin", diameter="16"), [self.summer.id])
+        self.assertEqual(self.search(q=str(self.winter.product_code)), [self.winter.id])
+        self.assertEqual(self.client.get(reverse("product_search")).status_code, 400)
+
+    def test_ranking(self):
+        # Совпадение в модели весит больше совпадения только в названии
+        self.assertEqual(self.search(q="pilot")[0], self.other.id)
+        # При равном весе выше более популярный товар
+        self.assertEqual(self.search(q="205")[:2], [self.summer.id, self.other.id])
+
+    def test_cursor(self):
+        index = get_search_index()
+        ids, cursor = [], ""
+        while cursor is not None:
+            page, cursor = index.cursor_page(["michelin"], {}, cursor, page_size=1)
+            ids.extend(page)
+        self.assertEqual(ids, [self.summer.id, self.other.id])
+        data = self.client.get(reverse("product_search"), {"q": "michelin", "cursor": ""}).json()
+        self.assertEqual([product["id"] for product in data["results"]], ids)
+        self.assertIsNone(data["next_cursor"])
+
+    def test_malformed_cursor(self):
+        # Ключ поиска из трех значений: значения другого типа не должны доходить до сравнения ключей индекса
+        cursors = MALFORMED_CURSORS + [
+            encode_cursor("search", ["a", None, 1]), encode_cursor("search", [-1, 0]),
+            encode_cursor("search", [-1, 0, "1"]), encode_cursor("search", [[1], 0, 1]),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse("product_search"), {"q": "michelin", "cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(response.json()["error"], ["Некорректный курсор", "Курсор выдан для другой сортировки"])
+
+    def test_product_change_refreshes_index(self):
+        self.assertEqual(self.search(q="primacy"), [self.summer.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.summer.visible = False
+            self.summer.save()
+        self.assertEqual(self.search(q="primacy"), [])
+
+
+class CitiesTests(TestCase):
+    def test_full_list(self):
+        response = self.client.get(reverse("get_cities"))
+        cities = response.json()["cities"]
+        self.assertEqual(len(cities), len(set(cities)))
+        self.assertEqual(cities.count("Белогорск"), 1)
+        self.assertIn("public", response["Cache-Control"])
+        self.assertFalse(response["ETag"].startswith("W/"))
+        response = self.client.get(reverse("get_cities"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_search(self):
+        response = self.client.get(reverse("get_cities"), {"q": "ОРЕЛ"})
+        self.assertEqual(response.json()["cities"], ["Орёл"])
+        cities = self.client.get(reverse("get_cities"), {"q": "град", "limit": 3}).json()["cities"]
+        self.assertEqual(len(cities), 3)
+        self.assertTrue(all("град" in city for city in cities))
+        # Сначала города, начинающиеся с запроса
+        cities = self.client.get(reverse("get_cities"), {"q": "моск"}).json()["cities"]
+        self.assertEqual(cities[:2], ["Москва", "Московский"])
+        self.assertIn("Новомосковск", cities)
+
+
+def mysql_plan(key: str | None, used_key_parts: list[str] | None, rows: int, filesort: bool = False,
+               access_type: str = "ref") -> str:
+    table = {"table_name": "shop_product", "access_type": access_type, "rows_examined_per_scan": rows}
+    if key:
+        table.update(key=key, key_length=str(len(used_key_parts or []) * 4 - 3))
+    if used_key_parts is not None:
+        table["used_key_parts"] = used_key_parts
+    return json.dumps({"query_block": {"select_id": 1, "ordering_operation": {
+        "using_filesort": filesort, "table": table,
+    }}})
+
+
+class QueryPlanTests(SimpleTestCase):
+    """
+    Разбор EXPLAIN в check_query_plans.
+    """
+
+    def problems(self, plan: str, vendor: str, filters: tuple[str, ...]) -> list[str]:
+        return plan_problems(parse_plan(plan, vendor), "shop_product", filters)
+
+    def test_mysql(self):
+        plan = parse_plan(mysql_plan("product_size_idx", ["visible", "diameter", "width"], 40), "mysql")
+        self.assertEqual(plan, {"filesort": False, "accesses": [{
+            "table": "shop_product", "index": "product_size_idx", "columns": ["visible", "diameter", "width"],
+            "rows": 40,
+        }]})
+        self.assertEqual(self.problems(mysql_plan("product_size_idx", ["visible", "diameter"], 40, filesort=True),
+                                       "mysql", ("diameter",)), [])
+
+        problems = self.problems(mysql_plan(None, None, 10000, access_type="ALL"), "mysql", ("width",))
+        self.assertEqual(problems, ["полное сканирование shop_product, ~10000 строк"])
+        # Доступ по ref только на visible читает почти все товары
+        problems = self.problems(mysql_plan("product_popularity_idx", ["visible"], 9500), "mysql", ("width",))
+        self.assertEqual(len(problems), 1)
+        self.assertIn("только по (visible), ~9500 строк", problems[0])
+        # Без used_key_parts - по длине ключа
+        plan = json.loads(mysql_plan("product_price_idx", None, 9500))
+        plan["query_block"]["ordering_operation"]["table"]["key_length"] = "1"
+        self.assertEqual(len(self.problems(json.dumps(plan), "mysql", ("profile",))), 1)
+
+        # Без фильтров доступ по visible допустим, если порядок берется из индекса
+        self.assertEqual(self.problems(mysql_plan("product_price_idx", ["visible"], 9500), "mysql", ()), [])
+        problems = self.problems(mysql_plan("product_size_idx", ["visible"], 9500, filesort=True), "mysql", ())
+        self.assertIn("сортировка всех товаров", problems[0])
+
+    def test_sqlite(self):
+        plan = ("5 0 0 SEARCH shop_product USING INDEX product_size_idx (visible=? AND diameter=?)\n"
+                "37 0 0 USE TEMP B-TREE FOR ORDER BY")
+        self.assertEqual(parse_plan(plan, "sqlite")["accesses"][0]["columns"], ["visible", "diameter"])
+        self.assertEqual(self.problems(plan, "sqlite", ("diameter",)), [])
+        self.assertEqual(len(self.problems("5 0 0 SEARCH shop_product USING INDEX product_price_idx (visible=?)",
+                                           "sqlite", ("width",))), 1)
+        self.assertEqual(len(self.problems("5 0 0 SCAN shop_product USING INDEX product_size_idx\n"
+                                           "37 0 0 USE TEMP B-TREE FOR ORDER BY", "sqlite", ("width",))), 1)
+        self.assertEqual(self.problems("4 0 0 SCAN shop_product", "sqlite", ()),
+                         ["полное сканирование shop_product"])
+        self.assertEqual(self.problems("4 0 0 SCAN shop_product USING INDEX product_price_idx", "sqlite", ()), [])
+
+    def test_postgresql(self):
+        plan = ("Limit  (cost=0.29..8.31 rows=20 width=100)\n"
+                "  ->  Index Scan using product_width_idx on shop_product  (cost=0.29..8.31 rows=35 width=100)\n"
+                "        Index Cond: ((visible = true) AND (width = 205))")
+        self.assertEqual(parse_plan(plan, "postgresql")["accesses"], [{
+            "table": "shop_product", "index": "product_width_idx", "columns": ["visible", "width"], "rows": 35,
+        }])
+        self.assertEqual(self.problems(plan, "postgresql", ("width",)), [])
+        plan = ("Limit  (cost=0.29..8.31 rows=20 width=100)\n"
+                "  ->  Sort  (cost=0.29..8.31 rows=9000 width=100)\n"
+                "        Sort Key: popularity DESC, id\n"
+                "        ->  Seq Scan on shop_product  (cost=0.00..300.00 rows=9000 width=100)\n"
+                "              Filter: (visible AND (width = 205))")
+        self.assertEqual(self.problems(plan, "postgresql", ("width",)),
+                         ["полное сканирование shop_product, ~9000 строк"])
+
+    def test_common_combinations_have_index_prefix(self):
+        # Для каждой частой комбинации фильтров есть индекс, который начинается с visible и одного из фильтров
+        prefixes = {tuple(index.fields[:2]) for index in Product._meta.indexes}
+        for fields in common_filter_combinations():
+            if fields:
+                self.assertTrue(any(("visible", field) in prefixes for field in fields), fields)
+
+
+class StubTelegramHandler(BaseHTTPRequestHandler):
+    """
+    Заглушка Bot API: отвечает статусами из server.responses по очереди, затем 200.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        self.server.received.append(parse_qs(body)["text"][0])
+        status, payload = self.server.responses.pop(0) if self.server.responses else (200, {"ok": True})
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TelegramOutboxTests(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StubTelegramHandler)
+        self.server.received = []
+        self.server.responses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings = override_settings(TELEGRAM_API_URL=f"http://127.0.0.1:{self.server.server_port}")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_callback_is_queued_not_sent(self):
+        self.client.post(reverse("callback_order"), {"name": "Иван", "phone": "1", "question": "Вопрос"})
+        self.assertEqual(self.server.received, [])
+        self.assertEqual(TelegramMessage.objects.get().status, "pending")
+
+        self.assertEqual(process_outbox(), {"sent": 1, "retry": 0, "failed": 0})
+        self.assertIn("Иван", self.server.received[0])
+        self.assertEqual(TelegramMessage.objects.get().status, "sent")
+
+    def test_retry_with_backoff(self):
+        message = TelegramMessage.objects.create(text="Заказ")
+        self.server.responses = [(500, {"ok": False, "description": "Internal Server Error"})]
+        self.assertEqual(process_outbox(backoff=60), {"sent": 0, "retry": 1, "failed": 0})
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.next_attempt, message.created)
+        # Время повтора еще не наступило
+        self.assertEqual(process_outbox(), {"sent": 0, "retry": 0, "failed": 0})
+
+        TelegramMessage.objects.update(next_attempt=message.created)
+        self.assertEqual(process_outbox(), {"sent": 1, "retry": 0, "failed": 0})
+        self.assertEqual(len(self.server.received), 2)
+
+    def test_failed_after_max_attempts(self):
+        TelegramMessage.objects.create(text="Заказ")
+        self.server.responses = [(400, {"ok": False, "description": "Bad Request: chat not found"})]
+        self.assertEqual(process_outbox(max_attempts=1), {"sent": 0, "retry": 0, "failed": 1})
+        self.assertEqual(TelegramMessage.objects.get().last_error, "400: Bad Request: chat not found")
+
+    def test_claimed_messages_are_hidden(self):
+        TelegramMessage.objects.bulk_create([TelegramMessage(text=str(i)) for i in range(3)])
+        self.assertEqual(len(claim_messages(batch_size=2, lease=60)), 2)
+        # Пока первый воркер отправляет пачку, второй забирает только оставшееся сообщение
+        self.assertEqual([message.text for message in claim_messages(batch_size=10, lease=60)], ["2"])
+        self.assertEqual(process_outbox(), {"sent": 0, "retry": 0, "failed": 0})
+        self.assertEqual(set(TelegramMessage.objects.values_list("attempts", flat=True)), {1})
+
+    def test_unexpected_error_keeps_sent_messages(self):
+        TelegramMessage.objects.bulk_create([TelegramMessage(text=str(i)) for i in range(3)])
+        with mock.patch("api.notifications.send_telegram_message", side_effect=[{}, RuntimeError("сбой")]):
+            with self.assertRaises(RuntimeError):
+                process_outbox(lease=60)
+        statuses = dict(TelegramMessage.objects.values_list("text", "status"))
+        self.assertEqual(statuses, {"0": "sent", "1": "pending", "2": "pending"})
+
+        # После окончания аренды остальные сообщения отправляются, уже отправленное - нет
+        TelegramMessage.objects.filter(status="pending").update(next_attempt=timezone.now())
+        self.assertEqual(process_outbox(), {"sent": 2, "retry": 0, "failed": 0})
+        self.assertEqual(self.server.received, ["1", "2"])
+
+    def test_rate_limit(self):
+        TelegramMessage.objects.bulk_create([TelegramMessage(text=str(i)) for i in range(3)])
+        limiter = RateLimiter(rate=20)
+        started = time.monotonic()
+        self.assertEqual(process_outbox(limiter=limiter)["sent"], 3)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    """
+    Параллельные изменения одной корзины не должны терять обновления.
+    """
+    threads = 8
+
+    @classmethod
+    def setUpClass(cls):
+        # Проверяется тестовая база: она создается раньше setUpClass, но позже импорта модуля
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            raise SkipTest("SQLite в памяти не ждет блокировку таблицы, а сразу возвращает ошибку")
+        super().setUpClass()
+
+    def setUp(self):
+        self.products = [create_product(i) for i in range(2)]
+        self.session_id = get_random_string(32)
+
+    def run_parallel(self, operations: list):
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def worker(chunk):
+            try:
+                barrier.wait()
+                for operation in chunk:
+                    operation()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(operations[i::self.threads],)) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def quantity(self, product: Product) -> int:
+        return CartItem.objects.get(cart_id=self.session_id, product=product).quantity
+
+    def test_parallel_adds_and_removes(self):
+        first, second = self.products
+        # Первое добавление товара одновременно из всех потоков
+        self.run_parallel([lambda: add_cart_item(self.session_id, first.id, 1)] * 300)
+        self.assertEqual(self.quantity(first), 300)
+
+        add = lambda: add_cart_item(self.session_id, first.id, 2)  # noqa: E731
+        remove = lambda: self.assertTrue(remove_cart_item(self.session_id, first.id))  # noqa: E731
+        self.run_parallel([add] * 100 + [remove] * 200)
+        self.assertEqual(self.quantity(first), 300)
+
+        add_cart_item(self.session_id, second.id, 50)
+        self.run_parallel([lambda: self.assertTrue(remove_cart_item(self.session_id, second.id))] * 50)
+        self.assertFalse(CartItem.objects.filter(cart_id=self.session_id, product=second).exists())
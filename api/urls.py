@@ -3,7 +3,7 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
-from . import views
+from . import views, async_views
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -17,14 +17,24 @@ schema_view = get_schema_view(
 urlpatterns = [
     path("combined-filters/", views.combined_filters, name="combined_filters"),
     path("products/", views.product_list, name="product_list"),
+    path("search/", views.product_search, name="product_search"),
     path("product/<int:product_id>/", views.product_detail, name="product_detail"),
     path("order/", views.create_order, name="create_order"),
     path("session/", views.session_manage, name="session_manage"),
     path("cart/", views.get_cart_items, name="cart_items"),
     path("cart/add/", views.add_to_cart, name="add_to_cart"),
     path("cart/remove/", views.remove_from_cart, name="remove_from_cart"),
+    path("cart/batch/", views.cart_batch, name="cart_batch"),
     path("cities/", views.get_cities, name="get_cities"),
     path("callback-order/", views.callback_order, name="callback_order"),
+    path("cache-stats/", views.cache_stats, name="cache_stats"),
+    path("metrics/", views.metrics, name="metrics"),
+    # Асинхронные версии представлений чтения для запуска под ASGI (api.async_views)
+    path("async/combined-filters/", async_views.combined_filters, name="async_combined_filters"),
+    path("async/products/", async_views.product_list, name="async_product_list"),
+    path("async/product/<int:product_id>/", async_views.product_detail, name="async_product_detail"),
+    path("async/cart/", async_views.get_cart_items, name="async_cart_items"),
+    path("async/cities/", async_views.get_cities, name="async_get_cities"),
     path("swagger<format>/", schema_view.without_ui(cache_timeout=0), name="schema-json"),
     path("swagger/", schema_view.with_ui("swagger", cache_timeout=0), name="schema-swagger-ui"),
 ]
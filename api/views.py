@@ -1,14 +1,13 @@
-import hashlib
 import logging
 import traceback
 
-import requests
-from django.core.paginator import Paginator
-from django.db import transaction
-from django.db.models import Count
-from django.contrib.sessions.models import Session
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.crypto import get_random_string
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from rest_framework import status
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
@@ -16,11 +15,22 @@ from drf_yasg.utils import swagger_auto_schema
 
 from .serializers import *
 from .swagger_data import *
-from carTire import settings
 from shop.models import Product, Order, OrderItem, CartItem, Individual, Address
-from .data import cities_list
-
-
+from shop.catalog import bump_catalog_version
+from .cache import catalog_etag, catalog_modified, cache_catalog_response, response_cache_stats
+from .cart import (add_cart_item, remove_cart_item, parse_cart_operations, apply_cart_operations, get_cart,
+                   refresh_cart, cart_etag, valid_cart_id)
+from .catalog_index import hydrate_products
+from .cities import CITIES, CITIES_LIMIT, CITIES_MAX_LIMIT, CITIES_MAX_AGE, cities_etag, search_cities
+from .facets import get_facets
+from .listing import product_list_data, product_detail_data
+from .filters import parse_filters
+from .metrics import get_request_metrics
+from .notifications import queue_telegram_message
+from .search import parse_query, get_search_index
+
+
+@condition(etag_func=catalog_etag, last_modified_func=catalog_modified)
 @swagger_auto_schema(
     method="get",
     responses={200: openapi.Response(
@@ -31,61 +41,74 @@ from .data import cities_list
 @api_view(["GET"])
 def combined_filters(request: Request):
     """
-    Возвращает возможные значения фильтров для товаров.
+    Возвращает возможные значения фильтров для видимых товаров с количеством товаров по каждому значению.
+    Принимает те же параметры фильтрации, что и список товаров: width, profile, diameter, season, manufacturer.
+    Количество для значения считается без учета выбора в его собственном фильтре.
+    Данные для подсчета кэшируются до изменения каталога.
     """
-    products = Product.objects.all()
-    filters = {}
-    for name in ["width", "profile", "diameter", "season", "manufacturer"]:
-        values = products.values_list(name, flat=True).distinct()
-        filters[name] = [{"id": hashlib.md5(f"{value}".encode()).hexdigest(), "label": value} for value in values]
-    return Response(filters)
+    return Response(get_facets(parse_filters(request.GET)))
 
 
+@condition(etag_func=catalog_etag, last_modified_func=catalog_modified)
 @api_view(["GET"])
+@cache_catalog_response("product_list")
 def product_list(request: Request):
     """
     Возвращает список товаров, имеет возможность фильтрации.
     Возможные параметры фильтрации: width, profile, diameter, season, manufacturer
-    По умолчанию сортировка по популярности.
+    По умолчанию сортировка по популярности, sort=price - по цене, sort=trending - по популярности за последнее время.
     Параметр page - номер страницы (по умолчанию 1).
+    Параметр cursor - постраничный вывод по курсору вместо page: пустой cursor - первая страница,
+    далее передается next_cursor из ответа. Ответ: {"results": [...], "next_cursor": "..." | null}
+    ETag ответа - версия каталога, с If-None-Match ответ 304 без обращения к базе.
+    """
+    data, code = product_list_data(request.GET)
+    return Response(data, status=code)
+
+
+@condition(etag_func=catalog_etag, last_modified_func=catalog_modified)
+@api_view(["GET"])
+@cache_catalog_response("product_search")
+def product_search(request: Request):
     """
-    products = Product.objects.filter(visible=True)  # Фильтрация видимых товаров
+    Поиск товаров по названию, модели, производителю и артикулу.
+    Размер в запросе ("205/55 R16", "205/55", "R16") превращается в фильтры width, profile, diameter.
+    Принимает те же параметры фильтрации и постраничного вывода (page или cursor), что и список товаров.
+    Товары упорядочены по релевантности, затем по популярности.
+    Пример: /api/search/?q=michelin 205/55 R16
+    """
+    query = request.GET.get("q", "").strip()
+    if not query:
+        return Response({"error": "Не указан запрос"}, status=status.HTTP_400_BAD_REQUEST)
+
+    size_filters, terms = parse_query(query)
+    filters = parse_filters(request.GET)
+    for name, values in size_filters.items():
+        filters[name] = sorted(set(filters.get(name, values)) & set(values))
+
+    index = get_search_index()
+    fast = use_fast_serializer("product_search")
+    cursor = request.GET.get("cursor")
+    if cursor is not None:
+        try:
+            ids, next_cursor = index.cursor_page(terms, filters, cursor)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        products = hydrate_products(ids, rows=fast)
+        data = serialize_product_rows(products) if fast else ProductSerializer(products, many=True).data
+        return Response({"results": data, "next_cursor": next_cursor})
 
     page = int(request.GET.get("page", 1))
-    # Фильтрация по параметрам
-    width = [int(w) for w in request.GET.get("width", "").split(",") if w.isdigit()]
-    profile = [int(p) for p in request.GET.get("profile", "").split(",") if p.isdigit()]
-    diameter = [int(d) for d in request.GET.get("diameter", "").split(",") if d.isdigit()]
-    season: list[str] = [s for s in request.GET.get("season", "").split(",") if s]
-    manufacturer: list[str] = [m for m in request.GET.get("manufacturer", "").split(",") if m]
-
-    sort = request.GET.get("sort")
-
-    if width:
-        products = products.filter(width__in=width)
-    if profile:
-        products = products.filter(profile__in=profile)
-    if diameter:
-        products = products.filter(diameter__in=diameter)
-    if season:
-        products = products.filter(season__in=season)
-    if manufacturer:
-        products = products.filter(manufacturer__in=manufacturer)
-
-    if sort == "price":
-        products = products.order_by("price")
-    else:
-        products = products.annotate(popularity=Count("orderitem")).order_by("-popularity")
-
-    paginator = Paginator(products, 20)
-    products = paginator.get_page(page)
-    if paginator.num_pages < page:
+    ids, num_pages = index.page(terms, filters, page)
+    if num_pages < page:
         return Response(status=status.HTTP_404_NOT_FOUND)
-    # Сериализация данных
-    serializer = ProductSerializer(products, many=True)
-    return Response(serializer.data)
+    products = hydrate_products(ids, rows=fast)
+    if fast:
+        return Response(serialize_product_rows(products))
+    return Response(ProductSerializer(products, many=True).data)
 
 
+@condition(etag_func=catalog_etag, last_modified_func=catalog_modified)
 @swagger_auto_schema(
     method="get",
     responses={200: openapi.Response(
@@ -96,16 +119,13 @@ def product_list(request: Request):
     )}
 )
 @api_view(["GET"])
+@cache_catalog_response("product_detail")
 def product_detail(request: Request, product_id: int):
     """
     Возвращает информацию о товаре по его ID.
     """
-    try:
-        product = Product.objects.get(id=product_id)
-        serializer = ProductSerializer(product)
-        return Response(serializer.data)
-    except Product.DoesNotExist:
-        return Response(status=status.HTTP_404_NOT_FOUND)
+    data, code = product_detail_data(product_id)
+    return Response(data, status=code)
 
 
 @swagger_auto_schema(
@@ -126,26 +146,29 @@ def create_order(request: Request):
     """
     try:
         session_id = request.data.get("session_id")
-        if not session_id or not CartItem.objects.filter(session_id=session_id).exists():
+        if not session_id:
             return Response({"error": "Корзина пуста"}, status=404)
+        if not valid_cart_id(session_id):
+            return Response({"error": "Некорректный ID сессии"}, status=400)
 
         contact_data = request.data.get("contact_info")
         address_data = request.data.get("address")
 
         with transaction.atomic():
+            # Корзина с товарами одним запросом. Строки корзины блокируются до конца транзакции,
+            # чтобы параллельный заказ или изменение корзины не привели к двойному заказу
+            lock = {"of": ("self",)} if connection.features.has_select_for_update_of else {}
+            cart_items = list(
+                CartItem.objects.select_for_update(**lock).filter(cart_id=session_id).select_related("product")
+            )
+            if not cart_items:
+                return Response({"error": "Корзина пуста"}, status=404)
 
             # Создание заказа
-            cart_items = CartItem.objects.filter(session_id=session_id)
             total_price = sum(item.product.price * item.quantity for item in cart_items)
-            order = Order.objects.create(
-                total_price=total_price
-            )
-
-            # Обработка информации об адресе
-            address, _ = Address.objects.get_or_create(**address_data, order=order)
-
-            # Обработка информации о контакте
-            contact_info, _ = Individual.objects.get_or_create(
+            order = Order.objects.create(total_price=total_price)
+            address = Address.objects.create(order=order, **address_data)
+            contact_info = Individual.objects.create(
                 order=order,
                 surname=contact_data["individual"]["surname"],
                 name=contact_data["individual"]["name"],
@@ -157,6 +180,15 @@ def create_order(request: Request):
             OrderItem.objects.bulk_create([
                 OrderItem(order=order, product=item.product, quantity=item.quantity) for item in cart_items
             ])
+            # Каждая позиция заказа увеличивает популярность товара на 1, как и прежний Count("orderitem")
+            Product.objects.filter(id__in=[item.product_id for item in cart_items]).update(
+                popularity=F("popularity") + 1
+            )
+            # Популярность отдается в ответах каталога и задает сортировку по умолчанию, а update() не вызывает
+            # сигналы, поэтому версия каталога (кэши ответов, индексы в памяти, ETag) меняется явно
+            transaction.on_commit(bump_catalog_version)
+            # Удаляются только заблокированные строки: товар, добавленный после начала заказа, остается в корзине
+            CartItem.objects.filter(id__in=[item.id for item in cart_items]).delete()
 
             text = [f"<b>Заказ №{order.id}</b>\n"
                     f"<b>Клиент:</b> {contact_info}\n"
@@ -166,9 +198,10 @@ def create_order(request: Request):
                     f"<b>Товары:</b>"]
             for item in cart_items:
                 text.append(f"<b>{item.product}</b> - {item.quantity}шт ({item.quantity * item.product.price}₽)")
-            cart_items.delete()
 
-        send_telegram_message("\n".join(text))
+            # Уведомление сохраняется вместе с заказом и отправляется командой send_notifications
+            queue_telegram_message("\n".join(text))
+        refresh_cart(session_id)
     except Exception as e:
         logging.error(f"Ошибка при создании заказа: {e}\n"
                       f"{traceback.format_exc()}")
@@ -180,26 +213,27 @@ def create_order(request: Request):
 def session_manage(request: Request):
     """
     Возвращает информацию о сессии.
+    session_id - ключ корзины посетителя, он передается во все запросы корзины.
+    Ключ хранится в сессии, строка корзины в базе создается только при первом изменении корзины,
+    а с SESSION_ENGINE signed_cookies или cache просмотр каталога вообще не пишет в базу.
     """
-    # Создаем новую сессию, если она еще не существует
-    if not request.session.session_key:
-        request.session.save()
-
-    session_key = request.session.session_key
-
-    # Получаем или создаем сессию в базе данных
-    session, created = Session.objects.get_or_create(session_key=session_key)
+    cart_id = request.session.get("cart_id")
+    created = cart_id is None
+    if created:
+        cart_id = get_random_string(32)
+        request.session["cart_id"] = cart_id
 
-    # Подсчет количества товаров в корзине
-    cart_items_count = CartItem.objects.filter(session=session).count()
+    # Количество товаров в корзине берется из кэша корзины, у новой корзины оно равно 0
+    cart_items_count = 0 if created else len(get_cart(cart_id)["items"])
 
     return Response({
-        "session_id": session.session_key,
+        "session_id": cart_id,
         "cart_items_count": cart_items_count,
         "created": created
     })
 
 
+@condition(etag_func=cart_etag)
 @swagger_auto_schema(
     method="get",
     responses={200: openapi.Response(
@@ -213,19 +247,15 @@ def get_cart_items(request: Request):
     """
     Возвращает товары в корзине.
     Параметры: {"session_id": "123abc"}
+    ETag ответа меняется при изменении корзины или цен, с If-None-Match ответ 304 без сборки корзины.
     """
     session_id = request.GET.get("session_id")
     if not session_id:
         return Response({"error": "Не указан ID сессии"}, status=400)
+    if not valid_cart_id(session_id):
+        return Response({"error": "Некорректный ID сессии"}, status=400)
 
-    items = CartItem.objects.filter(session_id=session_id)
-    total_price = sum(item.product.price * item.quantity for item in items)
-
-    serializer = CartItemSerializer(items, many=True)
-    return Response({
-        "items": serializer.data,
-        "total_price": total_price
-    })
+    return Response(get_cart(session_id))
 
 
 @swagger_auto_schema(
@@ -260,21 +290,17 @@ def add_to_cart(request: Request):
     session_id = request.data.get("session_id")
     if not session_id:
         return Response({"error": "Сессия не найдена"}, status=404)
+    if not valid_cart_id(session_id):
+        return Response({"error": "Некорректный ID сессии"}, status=400)
 
     product_id = int(request.data.get("product_id"))
     quantity = int(request.data.get("quantity", 1))
 
-    try:
-        product = Product.objects.get(id=product_id)
-    except Product.DoesNotExist:
+    if not Product.objects.filter(id=product_id).exists():
         return Response({"error": "Продукт не найден"}, status=404)
 
-    item, created = CartItem.objects.get_or_create(
-        session_id=session_id, product=product, defaults={"quantity": quantity}
-    )
-    if not created:
-        item.quantity += quantity
-        item.save()
+    add_cart_item(session_id, product_id, quantity)
+    refresh_cart(session_id)
 
     return Response({"detail": "Товар добавлен в корзину"})
 
@@ -291,34 +317,101 @@ def remove_from_cart(request: Request):
     session_id = request.data.get("session_id")
     if not session_id:
         return Response({"error": "Корзина не найдена"}, status=404)
+    if not valid_cart_id(session_id):
+        return Response({"error": "Некорректный ID сессии"}, status=400)
 
     product_id = request.data.get("product_id")
     remove_all = request.data.get("all", False)
 
-    try:
-        item = CartItem.objects.get(session_id=session_id, product_id=product_id)
-        if remove_all:
-            # Удаление всех экземпляров товара
-            item.delete()
-        else:
-            # Удаление одного экземпляра товара
-            if item.quantity > 1:
-                item.quantity -= 1
-                item.save()
-            else:
-                item.delete()
-
-        return Response({"detail": "Товар(ы) удален(ы) из корзины"})
-    except CartItem.DoesNotExist:
+    if not remove_cart_item(session_id, product_id, remove_all):
         return Response({"error": "Товар в корзине не найден"}, status=404)
+    refresh_cart(session_id)
+
+    return Response({"detail": "Товар(ы) удален(ы) из корзины"})
+
+
+@swagger_auto_schema(
+    method="post",
+    operation_description="Пакетное изменение корзины: все операции применяются в одной транзакции",
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            "session_id": openapi.Schema(type=openapi.TYPE_STRING, description="ID сессии"),
+            "operations": openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(type=openapi.TYPE_OBJECT, properties=cart_operation_properties),
+            ),
+        },
+        required=["session_id", "operations"],
+        examples={
+            "application/json": {
+                "session_id": "123abc",
+                "operations": [{"product_id": 1, "delta": 2}, {"product_id": 2, "set_quantity": 0}],
+            }
+        }
+    ),
+    responses={
+        200: openapi.Response(description="Обновленная корзина", examples=cart_example),
+        400: openapi.Response(description="Некорректные операции"),
+        404: openapi.Response(description="Продукт не найден")
+    }
+)
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def cart_batch(request: Request):
+    """
+    Пакетное изменение корзины, например для восстановления сохраненной корзины за один запрос.
+    delta - добавить (или убрать при отрицательном значении) количество, set_quantity - установить количество,
+    0 удаляет товар из корзины. Возвращает корзину в формате /api/cart/.
+    Пример: {"session_id": "123abc",
+             "operations": [{"product_id": 1, "delta": 2}, {"product_id": 2, "set_quantity": 0}]}
+    """
+    session_id = request.data.get("session_id")
+    if not session_id:
+        return Response({"error": "Сессия не найдена"}, status=404)
+    if not valid_cart_id(session_id):
+        return Response({"error": "Некорректный ID сессии"}, status=400)
 
+    try:
+        operations = parse_cart_operations(request.data.get("operations"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
 
+    # Все товары проверяются одним запросом
+    product_ids = {product_id for product_id, _, _ in operations}
+    missing = product_ids - set(Product.objects.filter(id__in=product_ids).values_list("id", flat=True))
+    if missing:
+        return Response({"error": "Продукт не найден", "product_ids": sorted(missing)}, status=404)
+
+    apply_cart_operations(session_id, operations)
+    return Response(refresh_cart(session_id))
+
+
+@condition(etag_func=cities_etag)
+@cache_control(public=True, max_age=CITIES_MAX_AGE)
+@swagger_auto_schema(
+    method="get",
+    manual_parameters=[
+        openapi.Parameter("q", openapi.IN_QUERY, description="Начало или часть названия города",
+                          type=openapi.TYPE_STRING),
+        openapi.Parameter("limit", openapi.IN_QUERY, description=f"Количество городов (по умолчанию {CITIES_LIMIT}, "
+                                                                 f"не больше {CITIES_MAX_LIMIT})",
+                          type=openapi.TYPE_INTEGER),
+    ],
+)
 @api_view(["GET"])
 def get_cities(request: Request):
     """
-    Возвращает список городов.
+    Возвращает список городов без повторов.
+    С параметром q - подсказки для автодополнения: сначала города, начинающиеся с q, затем содержащие q,
+    не больше limit. Регистр и "ё"/"е" не различаются.
     """
-    return Response({"cities": cities_list})
+    query = request.GET.get("q")
+    if query is None:
+        return Response({"cities": CITIES})
+    limit = request.GET.get("limit", "")
+    limit = min(int(limit), CITIES_MAX_LIMIT) if limit.isdigit() else CITIES_LIMIT
+    return Response({"cities": search_cities(query, limit)})
 
 
 @api_view(["POST"])
@@ -331,19 +424,33 @@ def callback_order(request: Request):
     name = request.data.get("name").replace("<", "&lt;")
     phone = request.data.get("phone")
     question = request.data.get("question").replace("<", "&lt;")
-    send_telegram_message(f"<b>Заявка на обратный звонок</b>\n"
-                          f"<b>Имя:</b> {name}\n"
-                          f"<b>Телефон:</b> {phone}\n"
-                          f"<b>Вопрос:</b> {question}")
+    queue_telegram_message(f"<b>Заявка на обратный звонок</b>\n"
+                           f"<b>Имя:</b> {name}\n"
+                           f"<b>Телефон:</b> {phone}\n"
+                           f"<b>Вопрос:</b> {question}")
     return Response({"detail": "Заявка отправлена"})
 
 
-def send_telegram_message(message: str):
-    url = f"https://api.telegram.org/bot{settings.logs_bot_token}/sendMessage"
-    data = {
-        "chat_id": settings.logs_chat_id,
-        "text": message,
-        "parse_mode": "html",
-    }
-    response = requests.post(url, data=data)
-    return response.json()
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def cache_stats(request: Request):
+    """
+    Статистика кэша ответов текущего процесса: попадания, промахи и доля попаданий по представлениям.
+    Доступно только администраторам.
+    """
+    return Response(response_cache_stats())
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics(request: Request):
+    """
+    Статистика запросов к API текущего процесса по именам URL: количество запросов и ошибок,
+    p50/p95/p99 и максимум времени ответа, количества и времени SQL-запросов и времени рендеринга.
+    Параметр reset=1 - сбросить статистику после ответа. Доступно только администраторам.
+    """
+    request_metrics = get_request_metrics()
+    data = request_metrics.snapshot()
+    if request.GET.get("reset") == "1":
+        request_metrics.reset()
+    return Response(data)
@@ -12,8 +12,11 @@ if not environ.get('SECRET_KEY'):
     load_dotenv()
 
 SECRET_KEY = environ.get('SECRET_KEY')
-logs_bot_token = environ.get('logs_bot_token')
-logs_chat_id = int(environ.get('logs_chat_id'))
+# Бот и чат для уведомлений о заказах (api.notifications)
+TELEGRAM_BOT_TOKEN = environ.get('logs_bot_token')
+TELEGRAM_CHAT_ID = int(environ.get('logs_chat_id'))
+TELEGRAM_API_URL = environ.get('TELEGRAM_API_URL', "https://api.telegram.org")
+TELEGRAM_TIMEOUT = int(environ.get('TELEGRAM_TIMEOUT', 10))
 
 DEBUG = int(environ.get('DEBUG', default=0))
 
@@ -38,8 +41,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы время ответа включало остальные middleware
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Сжатие gzip или brotli (если установлен пакет brotli) по Accept-Encoding, выше всех, кто меняет ответ
+    'api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # 304 по If-None-Match для ответов с ETag и ETag по содержимому для ответов без него.
+    # Представления каталога и корзины проверяют ETag сами до обращения к базе (django.views.decorators.http.condition)
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -82,6 +92,55 @@ DATABASES = {
     }
 }
 
+# В default хранятся версии каталога и корзин, от которых зависят все кэши, индексы в памяти и ETag,
+# поэтому при нескольких воркерах gunicorn он должен быть общим: REDIS_URL (RedisCache, нужен пакет redis)
+# или CACHE_BACKEND/CACHE_LOCATION, например DatabaseCache. По умолчанию LocMemCache - у каждого процесса
+# свой, подходит только для одного процесса
+REDIS_URL = environ.get("REDIS_URL")
+if REDIS_URL:
+    DEFAULT_CACHE = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL}
+else:
+    DEFAULT_CACHE = {
+        "BACKEND": environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": environ.get("CACHE_LOCATION", "default"),
+        "OPTIONS": {"MAX_ENTRIES": int(environ.get("CACHE_MAX_ENTRIES", 10000))},
+    }
+CACHES = {
+    "default": DEFAULT_CACHE,
+    # Кэш готовых ответов списка и карточки товара (api.cache.cache_catalog_response)
+    "responses": {
+        "BACKEND": environ.get("RESPONSE_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": environ.get("RESPONSE_CACHE_LOCATION", "responses"),
+        "TIMEOUT": int(environ.get("RESPONSE_CACHE_TIMEOUT", 300)),
+        "OPTIONS": {"MAX_ENTRIES": int(environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1000))},
+    },
+}
+# Тесты подменяют кэши на LocMemCache (carTire.test_runner)
+TEST_RUNNER = "carTire.test_runner.TestRunner"
+
+# Хранилище сессий. В сессии хранится только ключ корзины (api.views.session_manage), поэтому подходят
+# "django.contrib.sessions.backends.signed_cookies" или "django.contrib.sessions.backends.cache":
+# с ними просмотр каталога не создает строк в базе
+SESSION_ENGINE = environ.get("SESSION_ENGINE", "django.contrib.sessions.backends.db")
+
+# Движок каталога: "db" - фильтрация запросами к базе, "memory" - по индексу в памяти воркера (api.catalog_index)
+CATALOG_ENGINE = environ.get("CATALOG_ENGINE", "db")
+
+# Представления, в которых товары сериализуются быстрым путем api.serializers.serialize_product_rows
+# (тот же JSON, что ProductSerializer). Пустое значение - везде ProductSerializer
+FAST_SERIALIZER_VIEWS = environ.get("FAST_SERIALIZER_VIEWS", "product_list product_detail product_search").split()
+
+# Ширины уменьшенных копий изображений товаров (shop.images) и количество процессов, которые их создают.
+# IMAGE_WORKERS = 0 - копии создаются сразу в процессе, который сохранил изображение
+IMAGE_DERIVATIVE_WIDTHS = [int(width) for width in environ.get("IMAGE_DERIVATIVE_WIDTHS", "320 640 1280").split()]
+IMAGE_WORKERS = int(environ.get("IMAGE_WORKERS", 2))
+
+# Статистика запросов к API по именам URL (api.metrics): окно последних API_METRICS_WINDOW запросов.
+# SLOW_REQUEST_MS > 0 - запросы дольше этого времени пишутся в logs/slow.log вместе с SQL
+API_METRICS = bool(int(environ.get("API_METRICS", 1)))
+API_METRICS_WINDOW = int(environ.get("API_METRICS_WINDOW", 1000))
+SLOW_REQUEST_MS = float(environ.get("SLOW_REQUEST_MS", 0))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -125,12 +184,23 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'formatter': 'file',
             'filename': 'logs/error.log'
+        },
+        'slow_file': {
+            'level': 'WARNING',
+            'class': 'logging.FileHandler',
+            'formatter': 'file',
+            'filename': 'logs/slow.log'
         }
     },
     'loggers': {
         '': {
             'level': 'ERROR',
             'handlers': ['console', 'file']
+        },
+        'api.slow': {
+            'level': 'WARNING',
+            'handlers': ['slow_file'],
+            'propagate': False
         }
     }
 }
@@ -143,6 +213,18 @@ if DEBUG:
 else:
     STATIC_ROOT = 'static/'
 
+# STATIC_MANIFEST = 1 - collectstatic создает файлы с хэшем содержимого в имени (staticfiles.json)
+# и сжатые копии .gz/.br (brotli - если установлен пакет brotli) всех файлов STATIC_ROOT.
+# Включается явно при развертывании вместе с collectstatic: до него {% static %} не находит файлы в STATIC_ROOT
+STATIC_MANIFEST = bool(int(environ.get("STATIC_MANIFEST", 0)))
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "shop.staticfiles.CompressedManifestStaticFilesStorage" if STATIC_MANIFEST
+                    else "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+# Django сам отдает STATIC_ROOT (/static/ и сборку Vite /assets/) - для развертывания без отдельного веб-сервера
+SERVE_STATIC = bool(int(environ.get("SERVE_STATIC", 0 if DEBUG else 1)))
+
 if DEBUG:
     MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
     MEDIA_URL = "/media/"
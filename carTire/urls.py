@@ -1,11 +1,14 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from shop import views
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
     path("", views.index, name="index"),
+    # Статические файлы из STATIC_ROOT при SERVE_STATIC (shop.views.static_file)
+    re_path(r"^static/(?P<path>.+)$", views.static_file, name="static_file"),
+    re_path(r"^assets/(?P<path>.+)$", views.static_file, {"prefix": "assets"}, name="static_asset"),
 ]
 
 handler404 = "shop.views.index"
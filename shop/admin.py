@@ -1,12 +1,31 @@
-from django.contrib import admin
+import csv
+import io
 
+from django import forms
+from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from .catalog import bump_catalog_version
+from .catalog_io import CATALOG_FIELDS, IMAGES_FIELD, detect_format, export_rows, format_rows, \
+    import_catalog, read_rows
 from .models import *
 
+# Сколько изменений показывать на странице загрузки каталога
+IMPORT_CHANGES_SHOWN = 500
+
 
 class InlineProductImage(admin.TabularInline):
     model = ProductImage
 
 
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(label="Файл каталога (CSV или JSON Lines)")
+    dry_run = forms.BooleanField(label="Только показать изменения", required=False, initial=True)
+
+
 class InlineOnlyView(admin.TabularInline):
 
     def has_delete_permission(self, request, obj=None):
@@ -35,10 +54,71 @@ class InlineOrderItem(InlineOnlyView):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ["name", "price", "season", "manufacturer", "visible"]
+    list_display = ["name", "price", "season", "manufacturer", "popularity", "visible"]
     list_filter = ["season", "visible"]
     search_fields = ["name"]
     inlines = [InlineProductImage]
+    actions = ["make_visible", "make_hidden", "export_catalog"]
+
+    @admin.action(description="Показать выбранные товары")
+    def make_visible(self, request, queryset):
+        # update() не вызывает сигналы модели, поэтому версия каталога меняется явно
+        queryset.update(visible=True)
+        bump_catalog_version()
+
+    @admin.action(description="Скрыть выбранные товары")
+    def make_hidden(self, request, queryset):
+        queryset.update(visible=False)
+        bump_catalog_version()
+
+    @admin.action(description="Выгрузить выбранные товары в CSV")
+    def export_catalog(self, request, queryset):
+        response = StreamingHttpResponse(format_rows(export_rows(queryset), "csv"), content_type="text/csv")
+        response["Content-Disposition"] = 'attachment; filename="catalog.csv"'
+        return response
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_catalog_version()
+
+    def get_urls(self):
+        urls = [path("import/", self.admin_site.admin_view(self.import_view), name="shop_product_import")]
+        return urls + super().get_urls()
+
+    def import_view(self, request):
+        """
+        Загрузка каталога из файла, как команда import_catalog, но без изображений.
+        """
+        if not self.has_change_permission(request) or not self.has_add_permission(request):
+            raise PermissionDenied
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        stats, changes = None, []
+
+        def on_change(text: str):
+            if len(changes) < IMPORT_CHANGES_SHOWN:
+                changes.append(text)
+
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["file"]
+            file = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+            try:
+                stats = import_catalog(
+                    read_rows(file, detect_format(upload.name)), dry_run=form.cleaned_data["dry_run"],
+                    on_change=on_change,
+                )
+            except (UnicodeDecodeError, csv.Error) as e:
+                form.add_error("file", str(e))
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Загрузка каталога",
+            "form": form,
+            "fields": [*CATALOG_FIELDS, IMAGES_FIELD],
+            "stats": stats,
+            "changes": changes,
+            "dry_run": form.cleaned_data.get("dry_run") if stats else False,
+        }
+        return TemplateResponse(request, "admin/shop/product/import_catalog.html", context)
 
 
 @admin.register(Order)
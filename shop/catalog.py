@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = "catalog_version"
+
+
+def get_catalog_version() -> int:
+    """
+    Версия каталога - время последнего изменения товаров в миллисекундах.
+    Все кэши, зависящие от каталога, используют ее в ключе.
+    Если версии еще нет в кэше (первый запуск, очистка кэша), начинается новая версия.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        cache.add(CATALOG_VERSION_KEY, version, timeout=None)
+        # Другой процесс мог успеть записать свою версию раньше
+        version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+async def aget_catalog_version() -> int:
+    """
+    get_catalog_version для асинхронных представлений.
+    """
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        await cache.aadd(CATALOG_VERSION_KEY, version, timeout=None)
+        version = await cache.aget(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version() -> int:
+    """
+    Отмечает изменение каталога, после чего кэши старой версии больше не используются.
+    """
+    version = max(int(time.time() * 1000), get_catalog_version() + 1)
+    cache.set(CATALOG_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def catalog_last_modified() -> datetime:
+    return datetime.fromtimestamp(get_catalog_version() / 1000, tz=timezone.utc)
@@ -0,0 +1,300 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from typing import Callable, Iterable, Iterator, TextIO
+
+from django.core.files import File
+from django.db import transaction
+
+from .catalog import bump_catalog_version
+from .images import schedule_derivatives
+from .models import Product, ProductImage
+
+# Колонки файла каталога. Товар ищется по product_code, images - имена файлов изображений
+CATALOG_FIELDS = ["product_code", "name", "season", "width", "load_index", "profile", "speed_index", "diameter",
+                  "tire_model", "manufacturer", "description", "price", "visible"]
+IMAGES_FIELD = "images"
+UPDATE_FIELDS = CATALOG_FIELDS[1:]
+INT_FIELDS = {"product_code", "width", "load_index", "profile", "diameter", "price"}
+SEASONS = {season for season, _ in Product.seasons}
+FORMATS = ("csv", "jsonl")
+CHUNK_SIZE = 1000
+MAX_ERRORS = 100
+
+
+class CatalogImportError(ValueError):
+    def __init__(self, line: int, message: str):
+        super().__init__(f"Строка {line}: {message}")
+        self.line = line
+
+
+def detect_format(path: str, default: str = "csv") -> str:
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return {"csv": "csv", "jsonl": "jsonl", "ndjson": "jsonl"}.get(extension, default)
+
+
+def read_rows(file: TextIO, file_format: str) -> Iterator[tuple[int, dict]]:
+    """
+    Построчно читает файл каталога, не загружая его целиком. Возвращает пары (номер строки, значения).
+    В CSV изображения перечисляются через ";", в JSON Lines - списком.
+    Вместо значений некорректной строки JSON возвращается CatalogImportError: загрузка не прерывается,
+    ошибка попадает в статистику вместе с остальными ошибками строк (parse_row).
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line, text in enumerate(file, 1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except json.JSONDecodeError as e:
+                    yield line, CatalogImportError(line, f"некорректный JSON: {e}")
+
+
+def parse_row(line: int, raw: dict | CatalogImportError) -> tuple[dict, list[str]]:
+    """
+    Проверяет и приводит к типам значения товара. Возвращает поля товара и имена изображений.
+    """
+    if isinstance(raw, CatalogImportError):
+        raise raw
+    if not isinstance(raw, dict):
+        raise CatalogImportError(line, f"ожидается объект JSON, получено: {type(raw).__name__}")
+    values = {}
+    for field in CATALOG_FIELDS:
+        value = raw.get(field)
+        if value is None or value == "":
+            if field == "visible":
+                value = True
+            elif field == "description":
+                value = ""
+            else:
+                raise CatalogImportError(line, f"не заполнено поле {field}")
+        elif field in INT_FIELDS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise CatalogImportError(line, f"{field} должно быть целым числом: {value!r}")
+        elif field == "visible":
+            value = value if isinstance(value, bool) else str(value).strip().lower() in ("1", "true", "yes", "да")
+        else:
+            value = str(value).strip()
+        values[field] = value
+    if values["season"] not in SEASONS:
+        raise CatalogImportError(line, f"неизвестный сезон {values['season']!r}")
+
+    images = raw.get(IMAGES_FIELD) or []
+    if isinstance(images, str):
+        images = [name.strip() for name in images.split(";")]
+    return values, [name for name in images if name]
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _attach_images(product_ids: dict[int, int], images: dict[int, list[str]], images_dir: str) -> tuple[int, list]:
+    """
+    Копирует изображения из images_dir в хранилище и привязывает к товарам.
+    Файл хранится под именем upload_to/<product_code>/<хэш содержимого>/<имя файла>: одинаковые имена файлов
+    у разных товаров не смешиваются, а измененный файл с прежним именем копируется заново и заменяет
+    изображение товара с тем же именем файла. Неизмененное изображение пропускается.
+    Возвращает количество привязанных (и замененных) изображений и имена ненайденных файлов.
+    """
+    storage = ProductImage._meta.get_field("image").storage
+    upload_to = ProductImage._meta.get_field("image").upload_to
+    existing = {
+        (image.product_id, os.path.basename(image.image.name)): image
+        for image in ProductImage.objects.filter(product_id__in=product_ids.values()).only("product_id", "image")
+    }
+    new_images, replaced, previous = [], [], []
+    missing = []
+    for code, names in images.items():
+        product_id = product_ids[code]
+        for name in names:
+            basename = os.path.basename(name)
+            current = existing.get((product_id, basename))
+            path = os.path.join(images_dir, name)
+            if not os.path.isfile(path):
+                # Уже привязанное изображение не требует файла при повторной загрузке
+                if current is None:
+                    missing.append(name)
+                continue
+            target = f"{upload_to}{code}/{_file_digest(path)}/{basename}"
+            if current is not None and current.image.name == target:
+                continue
+            if not storage.exists(target):
+                with open(path, "rb") as source:
+                    target = storage.save(target, File(source))
+            if current is None:
+                image = ProductImage(product_id=product_id, image=target)
+                new_images.append(image)
+                existing[(product_id, basename)] = image
+                continue
+            if current.pk is not None and current not in replaced:
+                previous.append(current.image.name)
+                replaced.append(current)
+            current.image = target
+    ProductImage.objects.bulk_create(new_images)
+    ProductImage.objects.bulk_update(replaced, ["image"])
+    # bulk-операции не вызывают post_save (shop.signals.image_saved), поэтому копии изображений создаются явно.
+    # Прежние копии замененных изображений удаляет replace_derivatives
+    scheduled = [(image.id, image.image.name) for image in replaced]
+    if new_images:
+        # MySQL не возвращает id после bulk_create, поэтому id берутся по парам (товар, файл)
+        pairs = {(image.product_id, image.image.name) for image in new_images}
+        rows = ProductImage.objects.filter(
+            product_id__in={product_id for product_id, _ in pairs}, image__in={name for _, name in pairs}
+        ).values_list("id", "product_id", "image")
+        scheduled += [(image_id, name) for image_id, product_id, name in rows if (product_id, name) in pairs]
+    if scheduled:
+        transaction.on_commit(lambda: [schedule_derivatives(image_id, name) for image_id, name in scheduled])
+    if previous:
+        transaction.on_commit(lambda: _delete_unused_files(storage, previous))
+    return len(new_images) + len(replaced), missing
+
+
+def _delete_unused_files(storage, names: list[str]):
+    # Файлы прежнего формата имен (upload_to/<имя файла>) могли быть общими для нескольких товаров
+    used = set(ProductImage.objects.filter(image__in=names).values_list("image", flat=True))
+    for name in set(names) - used:
+        storage.delete(name)
+
+
+def import_catalog(rows: Iterable[tuple[int, dict]], images_dir: str | None = None, chunk_size: int = CHUNK_SIZE,
+                   dry_run: bool = False, on_change: Callable[[str], None] | None = None) -> dict:
+    """
+    Загружает товары пачками по chunk_size: по каждой пачке один запрос существующих товаров по product_code,
+    затем bulk_update измененных и bulk_create новых в одной транзакции. В памяти одновременно только одна пачка.
+    Строки с ошибками пропускаются и попадают в errors (первые MAX_ERRORS).
+    dry_run - ничего не записывает, on_change(text) получает описание каждого изменения.
+    Возвращает статистику загрузки.
+    """
+    stats = {"rows": 0, "created": 0, "updated": 0, "unchanged": 0, "images": 0, "errors": [], "seconds": 0.0}
+    started = time.perf_counter()
+
+    def report(text: str):
+        if on_change:
+            on_change(text)
+
+    def error(text: str):
+        if len(stats["errors"]) < MAX_ERRORS:
+            stats["errors"].append(text)
+
+    def parsed_rows():
+        for line, raw in rows:
+            stats["rows"] += 1
+            try:
+                yield parse_row(line, raw)
+            except CatalogImportError as e:
+                error(str(e))
+
+    for chunk in _chunks(parsed_rows(), chunk_size):
+        # Повтор product_code внутри пачки - действует последняя строка
+        values = {row["product_code"]: row for row, _ in chunk}
+        images = {row["product_code"]: names for row, names in chunk if names}
+        existing = {}
+        for product in Product.objects.filter(product_code__in=values).order_by("id"):
+            existing.setdefault(product.product_code, product)
+
+        changed, created = [], []
+        for code, row in values.items():
+            product = existing.get(code)
+            if product is None:
+                created.append(Product(**row))
+                report(f"+ {code} {row['name']}")
+                continue
+            diff = [field for field in UPDATE_FIELDS if getattr(product, field) != row[field]]
+            if not diff:
+                stats["unchanged"] += 1
+                continue
+            report(f"~ {code} " + ", ".join(f"{field}: {getattr(product, field)!r} -> {row[field]!r}"
+                                              for field in diff))
+            for field in diff:
+                setattr(product, field, row[field])
+            changed.append(product)
+        stats["created"] += len(created)
+        stats["updated"] += len(changed)
+        if dry_run:
+            continue
+
+        with transaction.atomic():
+            Product.objects.bulk_update(changed, UPDATE_FIELDS)
+            Product.objects.bulk_create(created)
+            if images and images_dir:
+                # MySQL не возвращает id после bulk_create, поэтому id берутся по product_code
+                product_ids = dict(
+                    Product.objects.filter(product_code__in=images).order_by("-id").values_list("product_code", "id")
+                )
+                attached, missing = _attach_images(product_ids, images, images_dir)
+                stats["images"] += attached
+                for name in missing:
+                    error(f"Изображение не найдено: {name}")
+
+    if not dry_run and (stats["created"] or stats["updated"] or stats["images"]):
+        # bulk-операции не вызывают сигналы модели, поэтому версия каталога меняется явно
+        bump_catalog_version()
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def export_rows(queryset=None, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Товары в формате файла каталога. Читаются пачками по id, изображения пачки - одним запросом,
+    поэтому в памяти не больше одной пачки.
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    last_id = 0
+    while True:
+        products = list(queryset.filter(id__gt=last_id).order_by("id").values("id", *CATALOG_FIELDS)[:chunk_size])
+        if not products:
+            break
+        last_id = products[-1]["id"]
+        images = {}
+        product_images = ProductImage.objects.filter(product_id__in=[product["id"] for product in products])
+        for product_id, name in product_images.order_by("id").values_list("product_id", "image"):
+            images.setdefault(product_id, []).append(os.path.basename(name))
+        for product in products:
+            row = {field: product[field] for field in CATALOG_FIELDS}
+            row[IMAGES_FIELD] = images.get(product["id"], [])
+            yield row
+
+
+def format_rows(rows: Iterable[dict], file_format: str) -> Iterator[str]:
+    """
+    Строки файла каталога для записи в файл или StreamingHttpResponse.
+    """
+    if file_format == "jsonl":
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=[*CATALOG_FIELDS, IMAGES_FIELD])
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({**row, IMAGES_FIELD: ";".join(row[IMAGES_FIELD])})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Пустой каталог - только заголовок
+        yield buffer.getvalue()
@@ -0,0 +1,184 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+
+from .catalog import bump_catalog_version
+
+# Форматы уменьшенных копий: расширение и параметры сохранения Pillow
+DERIVATIVE_FORMATS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+}
+DERIVATIVES_DIR = "product_images/derived"
+
+
+def image_storage():
+    from .models import ProductImage
+
+    return ProductImage._meta.get_field("image").storage
+
+
+def derivative_widths() -> list[int]:
+    return sorted(getattr(settings, "IMAGE_DERIVATIVE_WIDTHS", [320, 640, 1280]))
+
+
+def derivative_prefix(name: str) -> str:
+    """
+    Начало имен копий изображения name. Хэш полного имени различает оригиналы с одинаковым именем файла
+    в разных каталогах, поэтому копии одного изображения не перезаписывают копии другого.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    digest = hashlib.sha1(name.encode()).hexdigest()[:12]
+    return f"{DERIVATIVES_DIR}/{stem}_{digest}"
+
+
+def build_derivatives(name: str, widths: list[int] | None = None) -> dict:
+    """
+    Создает уменьшенные копии изображения name в форматах DERIVATIVE_FORMATS для каждой ширины из widths,
+    которая меньше ширины оригинала (оригинал не увеличивается, вместо этого добавляется копия в исходной ширине).
+    Возвращает {"source": name, "webp": {"320": имя файла, ...}, "jpeg": {...}}.
+    Существующие файлы не удаляются: при повторном создании storage выбирает свободное имя,
+    а прежние копии удаляет тот, кто сохраняет новый результат (replace_derivatives).
+    Работает без базы, поэтому может выполняться в отдельном процессе.
+    """
+    from PIL import Image, ImageOps
+
+    storage = image_storage()
+    widths = widths or derivative_widths()
+    prefix = derivative_prefix(name)
+    result = {"source": name, **{extension: {} for extension in DERIVATIVE_FORMATS}}
+    with storage.open(name, "rb") as file, Image.open(file) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+    sizes = [width for width in widths if width < image.width] or [image.width]
+    for width in sizes:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+        for extension, options in DERIVATIVE_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, **options)
+            target = f"{prefix}_{width}.{extension}"
+            result[extension][str(width)] = storage.save(target, ContentFile(buffer.getvalue()))
+    return result
+
+
+def derivative_names(derivatives: dict) -> set[str]:
+    return {name for extension in DERIVATIVE_FORMATS for name in derivatives.get(extension, {}).values()}
+
+
+def delete_derivatives(derivatives: dict, keep: dict | None = None):
+    """
+    Удаляет файлы копий derivatives, кроме тех, что есть в keep.
+    """
+    storage = image_storage()
+    for name in derivative_names(derivatives) - derivative_names(keep or {}):
+        storage.delete(name)
+
+
+def image_srcset(derivatives: dict) -> dict[str, str]:
+    """
+    Значения srcset для тега <picture>: {"webp": "url 320w, url 640w", "jpeg": "..."}.
+    Пустой словарь, если уменьшенные копии еще не созданы.
+    """
+    storage = image_storage()
+    return {
+        extension: ", ".join(f"{storage.url(name)} {width}w" for width, name in sorted(
+            derivatives[extension].items(), key=lambda item: int(item[0])
+        ))
+        for extension in DERIVATIVE_FORMATS if derivatives.get(extension)
+    }
+
+
+def replace_derivatives(image_id: int, name: str, derivatives: dict) -> bool:
+    """
+    Записывает копии изображения, если его за это время не заменили, и удаляет прежние копии.
+    Если изображение заменили или удалили, удаляются только что созданные копии.
+    """
+    from .models import ProductImage
+
+    images = ProductImage.objects.filter(id=image_id, image=name)
+    with transaction.atomic():
+        previous = images.select_for_update().values_list("derivatives", flat=True).first()
+        updated = previous is not None and images.update(derivatives=derivatives)
+    if updated:
+        delete_derivatives(previous, keep=derivatives)
+    else:
+        delete_derivatives(derivatives)
+    return bool(updated)
+
+
+def save_derivatives(image_id: int, name: str, derivatives: dict) -> bool:
+    """
+    Сохраняет результат (replace_derivatives). update() не вызывает сигналы,
+    поэтому версия каталога (и кэши ответов с srcset) меняется явно.
+    """
+    updated = replace_derivatives(image_id, name, derivatives)
+    if updated:
+        bump_catalog_version()
+    return updated
+
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    # Процессы пула запускаются через spawn: при fork они унаследовали бы открытые соединения с базой
+    # процесса сайта. DJANGO_SETTINGS_MODULE передается через окружение
+    import django
+
+    django.setup()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS, mp_context=get_context("spawn"),
+                                            initializer=_init_worker)
+        return _executor
+
+
+def process_derivatives(image_id: int, name: str, widths: list[int]) -> bool:
+    """
+    Создает копии и записывает их (replace_derivatives) в процессе пула, со своим соединением с базой,
+    которое закрывается после задачи. Версию каталога меняет _on_done в процессе сайта:
+    кэш по умолчанию (LocMemCache) у каждого процесса свой.
+    """
+    try:
+        return replace_derivatives(image_id, name, build_derivatives(name, widths))
+    finally:
+        close_old_connections()
+
+
+def _on_done(name: str, future: Future):
+    # Колбэк выполняется в потоке пула или, если задача уже завершена, в потоке запроса:
+    # здесь только кэш, без обращений к базе
+    try:
+        if future.result():
+            bump_catalog_version()
+    except Exception as e:
+        logging.error(f"Не удалось создать уменьшенные копии изображения {name}: {e}")
+
+
+def schedule_derivatives(image_id: int, name: str):
+    """
+    Создает уменьшенные копии загруженного изображения: в пуле процессов (IMAGE_WORKERS > 0)
+    или сразу в текущем процессе (IMAGE_WORKERS = 0, например в тестах).
+    """
+    if settings.IMAGE_WORKERS <= 0:
+        try:
+            save_derivatives(image_id, name, build_derivatives(name))
+        except Exception as e:
+            logging.error(f"Не удалось создать уменьшенные копии изображения {name}: {e}")
+        return
+    future = get_executor().submit(process_derivatives, image_id, name, derivative_widths())
+    future.add_done_callback(partial(_on_done, name))
@@ -0,0 +1,52 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.catalog import bump_catalog_version
+from shop.images import build_derivatives, derivative_widths, replace_derivatives
+from shop.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = ("Создает уменьшенные копии (WebP и JPEG по ширинам IMAGE_DERIVATIVE_WIDTHS) для изображений товаров, "
+            "у которых их еще нет, в пуле процессов")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Пересоздать копии для всех изображений")
+        parser.add_argument("--workers", type=int, default=max(settings.IMAGE_WORKERS, 1), help="Процессов")
+        parser.add_argument("--chunk-size", type=int, default=100, help="Изображений в одной пачке")
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by("id").values_list("id", "image", "derivatives")
+        widths = derivative_widths()
+        done = failed = 0
+        started = time.perf_counter()
+        last_id = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            while True:
+                chunk = list(images.filter(id__gt=last_id)[:options["chunk_size"]])
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                futures = {
+                    executor.submit(build_derivatives, name, widths): (image_id, name)
+                    for image_id, name, derivatives in chunk
+                    if options["all"] or derivatives.get("source") != name
+                }
+                for future in as_completed(futures):
+                    image_id, name = futures[future]
+                    try:
+                        derivatives = future.result()
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"{name}: {e}")
+                        continue
+                    # Изображение могли заменить, пока создавались копии. Прежние копии (--all) удаляются
+                    done += replace_derivatives(image_id, name, derivatives)
+        if done:
+            bump_catalog_version()
+        seconds = time.perf_counter() - started
+        self.stdout.write(f"Обработано изображений: {done}, ошибок: {failed}, за {seconds:.1f} с "
+                          f"({done / seconds if seconds else 0:.1f} изображений/с)")
@@ -0,0 +1,35 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.catalog_io import CHUNK_SIZE, FORMATS, detect_format, export_rows, format_rows
+
+
+class Command(BaseCommand):
+    help = "Выгружает товары в CSV или JSON Lines пачками, не загружая каталог в память целиком"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл каталога, - для вывода в stdout")
+        parser.add_argument("--format", choices=FORMATS, help="Формат файла (по умолчанию по расширению)")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Товаров в одном запросе")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or detect_format(options["path"])
+        started = time.perf_counter()
+        count = 0
+
+        def counted():
+            nonlocal count
+            for row in export_rows(chunk_size=options["chunk_size"]):
+                count += 1
+                yield row
+
+        if options["path"] == "-":
+            sys.stdout.writelines(format_rows(counted(), file_format))
+        else:
+            with open(options["path"], "w", encoding="utf-8", newline="") as file:
+                file.writelines(format_rows(counted(), file_format))
+        seconds = time.perf_counter() - started
+        self.stderr.write(f"Выгружено товаров: {count} за {seconds:.1f} с, "
+                          f"{count / seconds if seconds else 0:.0f} строк/с")
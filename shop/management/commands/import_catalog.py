@@ -0,0 +1,39 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import CHUNK_SIZE, FORMATS, detect_format, import_catalog, read_rows
+
+
+class Command(BaseCommand):
+    help = ("Загружает товары из CSV или JSON Lines. Товары ищутся по product_code: новые создаются, "
+            "измененные обновляются. Файл читается потоково, пачками по --chunk-size строк")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл каталога")
+        parser.add_argument("--format", choices=FORMATS, help="Формат файла (по умолчанию по расширению)")
+        parser.add_argument("--images-dir", help="Каталог с файлами изображений из колонки images")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Строк в одной транзакции")
+        parser.add_argument("--dry-run", action="store_true", help="Показать изменения без записи в базу")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or detect_format(options["path"])
+        on_change = self.stdout.write if options["dry_run"] or options["verbosity"] > 1 else None
+        try:
+            with open(options["path"], encoding="utf-8-sig", newline="") as file:
+                stats = import_catalog(read_rows(file, file_format), images_dir=options["images_dir"],
+                                       chunk_size=options["chunk_size"], dry_run=options["dry_run"],
+                                       on_change=on_change)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            # Ошибки отдельных строк попадают в stats["errors"], здесь - только ошибки файла целиком
+            raise CommandError(e)
+
+        for error in stats["errors"]:
+            self.stderr.write(error)
+        prefix = "Без записи (--dry-run). " if options["dry_run"] else ""
+        seconds = stats["seconds"]
+        self.stdout.write(
+            f"{prefix}Строк: {stats['rows']}, создано: {stats['created']}, обновлено: {stats['updated']}, "
+            f"без изменений: {stats['unchanged']}, изображений: {stats['images']}, ошибок: {len(stats['errors'])}\n"
+            f"Время: {seconds:.1f} с, {stats['rows'] / seconds if seconds else 0:.0f} строк/с"
+        )
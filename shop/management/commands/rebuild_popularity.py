@@ -0,0 +1,64 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from shop.catalog import bump_catalog_version
+from shop.models import Product, OrderItem
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счетчики популярности товаров по истории заказов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trending", action="store_true",
+                            help="Также пересчитать популярность с затуханием по времени (поле trending)")
+        parser.add_argument("--half-life", type=float, default=14,
+                            help="Период полураспада веса заказа в днях для trending (по умолчанию 14)")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Размер пачки для bulk_update trending (по умолчанию 1000)")
+
+    def handle(self, *args, **options):
+        # Один UPDATE с подзапросом: увеличение popularity при заказе (api.views.create_order), выполненное
+        # параллельно, либо уже учтено в подзапросе, либо применится к новому значению, и не будет потеряно
+        order_items = OrderItem.objects.filter(product=OuterRef("pk")).values("product").annotate(n=Count("id"))
+        popularity = Coalesce(Subquery(order_items.values("n")), 0)
+        updated = Product.objects.exclude(popularity=popularity).update(popularity=popularity)
+
+        # trending меняется только здесь, поэтому его можно пересчитать в памяти и записать bulk_update
+        updated_trending = 0
+        if options["trending"]:
+            updated_trending = self.rebuild_trending(options["half_life"], options["batch_size"])
+        if updated or updated_trending:
+            # update() и bulk_update не вызывают сигналы, а от популярности зависит порядок товаров в кэшах каталога
+            bump_catalog_version()
+
+        self.stdout.write(self.style.SUCCESS(f"Обновлено товаров: popularity {updated}, trending {updated_trending}"))
+
+    def rebuild_trending(self, half_life_days: float, batch_size: int) -> int:
+        trending = defaultdict(float)
+        now = timezone.now()
+        half_life = half_life_days * 86400
+        items = OrderItem.objects.values_list("product_id", "order__created")
+        for product_id, created in items.iterator(chunk_size=batch_size):
+            age = (now - created).total_seconds()
+            trending[product_id] += 0.5 ** (max(age, 0) / half_life)
+
+        changed = []
+        updated = 0
+        for product in Product.objects.only("id", "trending").iterator(chunk_size=batch_size):
+            new_trending = round(trending[product.id], 6)
+            if product.trending == new_trending:
+                continue
+            product.trending = new_trending
+            changed.append(product)
+            if len(changed) >= batch_size:
+                Product.objects.bulk_update(changed, ["trending"])
+                updated += len(changed)
+                changed = []
+        if changed:
+            Product.objects.bulk_update(changed, ["trending"])
+            updated += len(changed)
+        return updated
@@ -1,7 +1,7 @@
-from django.contrib.sessions.models import Session
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Model, CharField, IntegerField, TextField, ForeignKey, CASCADE, DateTimeField, ImageField, \
-    BooleanField
+    BooleanField, FloatField, Index, JSONField
+from django.utils import timezone
 
 
 class Product(Model):
@@ -23,6 +23,11 @@ class Product(Model):
     description = TextField(max_length=5000, verbose_name="Описание")
     price = IntegerField(verbose_name="Цена")
     visible = BooleanField(default=True, verbose_name="Видимость")
+    # Счетчики популярности хранятся в таблице, чтобы сортировка каталога не группировала OrderItem.
+    # popularity - количество позиций заказов с товаром, trending - то же с затуханием по времени.
+    # Пересчитываются командой rebuild_popularity.
+    popularity = IntegerField(default=0, editable=False, verbose_name="Популярность")
+    trending = FloatField(default=0, editable=False, verbose_name="Популярность за последнее время")
 
     def __str__(self):
         return self.name
@@ -30,13 +35,31 @@ class Product(Model):
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
+        # Каталог всегда фильтруется по visible, поэтому оно идет первым во всех индексах.
+        # Проверка планов запросов: python manage.py check_query_plans
+        indexes = [
+            Index(fields=["visible", "diameter", "width", "profile"], name="product_size_idx"),
+            # Ширина и профиль без диаметра: по product_size_idx такой фильтр читал бы все видимые товары
+            Index(fields=["visible", "width", "profile"], name="product_width_idx"),
+            Index(fields=["visible", "profile"], name="product_profile_idx"),
+            Index(fields=["visible", "season"], name="product_season_idx"),
+            Index(fields=["visible", "manufacturer"], name="product_manufacturer_idx"),
+            Index(fields=["visible", "price"], name="product_price_idx"),
+            Index(fields=["visible", "-popularity"], name="product_popularity_idx"),
+            Index(fields=["visible", "-trending"], name="product_trending_idx"),
+            # Загрузка каталога (import_catalog) ищет товары по коду
+            Index(fields=["product_code"], name="product_code_idx"),
+        ]
 
 
 class ProductImage(Model):
     product = ForeignKey(Product, related_name='images', on_delete=CASCADE, verbose_name="Товар")
     image = ImageField(upload_to='product_images/', verbose_name="Изображение")
+    # Уменьшенные копии в WebP и JPEG по ширинам (shop.images.build_derivatives), создаются после загрузки
+    derivatives = JSONField(default=dict, blank=True, editable=False, verbose_name="Уменьшенные копии")
 
     class Meta:
+        ordering = ["id"]
         verbose_name = "Изображение товара"
         verbose_name_plural = "Изображения товаров"
 
@@ -123,8 +146,25 @@ class OrderItem(Model):
         verbose_name_plural = "Товары в заказе"
 
 
+class Cart(Model):
+    """
+    Корзина посетителя. Ключ хранится в сессии (api.views.session_manage), строка создается
+    только при первом изменении корзины, поэтому просмотр каталога не пишет в базу.
+    """
+    key = CharField(max_length=40, primary_key=True, verbose_name="Ключ")
+    created = DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated = DateTimeField(default=timezone.now, db_index=True, verbose_name="Дата изменения")
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = "Корзина"
+        verbose_name_plural = "Корзины"
+
+
 class CartItem(Model):
-    session = ForeignKey(Session, on_delete=CASCADE, verbose_name="Сессия")
+    cart = ForeignKey(Cart, on_delete=CASCADE, verbose_name="Корзина")
     product = ForeignKey(Product, on_delete=CASCADE, verbose_name="Товар")
     quantity = IntegerField(default=1, verbose_name="Количество")
 
@@ -132,6 +172,6 @@ class CartItem(Model):
         return f"{self.quantity} x {self.product.name}"
 
     class Meta:
-        unique_together = ("session", "product")
+        unique_together = ("cart", "product")
         verbose_name = "Элемент корзины"
         verbose_name_plural = "Элементы корзины"
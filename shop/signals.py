@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .images import delete_derivatives, schedule_derivatives
+from .models import Product, ProductImage
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_changed(sender, **kwargs):
+    # Версия меняется после коммита, чтобы кэш не успел собраться из незакоммиченных данных
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=ProductImage)
+def image_saved(sender, instance: ProductImage, **kwargs):
+    # Копии создаются заново, только если изменился сам файл
+    if instance.image and instance.derivatives.get("source") != instance.image.name:
+        image_id, name = instance.id, instance.image.name
+        transaction.on_commit(lambda: schedule_derivatives(image_id, name))
+
+
+@receiver(post_delete, sender=ProductImage)
+def image_deleted(sender, instance: ProductImage, **kwargs):
+    if instance.derivatives:
+        derivatives = instance.derivatives
+        transaction.on_commit(lambda: delete_derivatives(derivatives))
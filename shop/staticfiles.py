@@ -0,0 +1,113 @@
+import gzip
+import os
+import re
+from functools import lru_cache
+from typing import Callable
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость, без нее создаются только .gz
+    brotli = None
+
+# Расширения файлов, которые имеет смысл сжимать. Изображения и woff/woff2 уже сжаты
+COMPRESSIBLE_EXTENSIONS = {".js", ".mjs", ".css", ".map", ".html", ".svg", ".json", ".txt", ".xml", ".ico", ".ttf",
+                           ".otf", ".eot"}
+# Сжатая копия сохраняется, только если она меньше оригинала хотя бы на 5%
+MIN_RATIO = 0.95
+MIN_SIZE = 256
+# Сжатые копии: расширение файла и значение Content-Encoding в порядке предпочтения
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+# Файлы сборки Vite в assets/ уже содержат хэш в имени: index-oCkBZIN4.js
+VITE_HASHED_RE = re.compile(r"^assets/.+-[\w-]{8}\.\w+$")
+
+
+def _compressors() -> dict[str, Callable[[bytes], bytes]]:
+    compressors = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors[".br"] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+
+def compress_file(path: str) -> list[str]:
+    """
+    Создает рядом с файлом path сжатые копии path.gz и path.br (если установлен brotli).
+    Копия не пересоздается, если она новее файла. Возвращает пути созданных копий.
+    """
+    if os.path.splitext(path)[1].lower() not in COMPRESSIBLE_EXTENSIONS or os.path.getsize(path) < MIN_SIZE:
+        return []
+    created = []
+    modified = os.path.getmtime(path)
+    data = None
+    for extension, compress in _compressors().items():
+        target = path + extension
+        if os.path.exists(target) and os.path.getmtime(target) >= modified:
+            continue
+        if data is None:
+            with open(path, "rb") as file:
+                data = file.read()
+        compressed = compress(data)
+        if len(compressed) >= len(data) * MIN_RATIO:
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        with open(target, "wb") as file:
+            file.write(compressed)
+        created.append(target)
+    return created
+
+
+def compress_directory(root: str) -> list[str]:
+    """
+    Сжимает все подходящие файлы в root. Возвращает пути созданных копий.
+    """
+    created = []
+    for directory, _, files in os.walk(root):
+        for name in files:
+            created.extend(compress_file(os.path.join(directory, name)))
+    return created
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage, который после collectstatic создает сжатые копии .gz/.br всех файлов STATIC_ROOT,
+    в том числе сборки Vite в assets/, которая лежит в STATIC_ROOT и не собирается collectstatic.
+    Файлы, которых нет в манифесте (добавлены после collectstatic), получают хэш по содержимому
+    вместо ошибки ValueError на каждой странице.
+    """
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for path in compress_directory(self.location):
+            name = os.path.relpath(path, self.location)
+            yield name, name, True
+
+
+@lru_cache(maxsize=None)
+def hashed_names() -> frozenset[str]:
+    """
+    Имена файлов с хэшем из манифеста collectstatic (staticfiles.json).
+    """
+    return frozenset(getattr(staticfiles_storage, "hashed_files", {}).values())
+
+
+def is_immutable(name: str) -> bool:
+    """
+    Содержит ли имя файла хэш содержимого: такой файл никогда не меняется и кэшируется браузером навсегда.
+    """
+    return name in hashed_names() or bool(VITE_HASHED_RE.match(name))
+
+
+def negotiate(request, path: str) -> tuple[str | None, str]:
+    """
+    Выбирает сжатую копию файла по Accept-Encoding. Возвращает Content-Encoding (None - без сжатия) и путь.
+    """
+    accepted = {value.split(";")[0].strip() for value in request.META.get("HTTP_ACCEPT_ENCODING", "").split(",")}
+    for encoding, extension in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + extension):
+            return encoding, path + extension
+    return None, path
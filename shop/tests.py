@@ -1,3 +1,318 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import FileResponse
+from django.templatetags.static import static
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from .catalog import get_catalog_version
+from .catalog_io import export_rows, format_rows, import_catalog, read_rows
+from .images import image_srcset
+from .models import Product, ProductImage
+from .staticfiles import compress_directory, hashed_names
+
+CSV = """product_code,name,season,width,load_index,profile,speed_index,diameter,tire_model,manufacturer,description,price,visible,images
+101,Michelin Primacy 4 205/55 R16,summer,205,91,55,V,16,Primacy 4,Michelin,Летняя шина,7500,true,101.jpg
+102,Nokian Nordman 7 195/65 R15,winter studded,195,95,65,T,15,Nordman 7,Nokian,,5200,true,
+"""
+
+
+def import_text(text: str, file_format: str = "csv", **kwargs) -> dict:
+    return import_catalog(read_rows(io.StringIO(text), file_format), **kwargs)
+
+
+class CatalogImportTests(TestCase):
+    def test_create_and_update(self):
+        stats = import_text(CSV, chunk_size=1)
+        self.assertEqual((stats["rows"], stats["created"], stats["updated"], stats["errors"]), (2, 2, 0, []))
+        self.assertEqual(Product.objects.get(product_code=102).description, "")
+
+        changes = []
+        version = get_catalog_version()
+        stats = import_text(CSV.replace("7500", "7900"), on_change=changes.append)
+        self.assertEqual((stats["created"], stats["updated"], stats["unchanged"]), (0, 1, 1))
+        self.assertEqual(changes, ["~ 101 price: 7500 -> 7900"])
+        self.assertEqual(Product.objects.get(product_code=101).price, 7900)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_dry_run(self):
+        changes = []
+        stats = import_text(CSV, dry_run=True, on_change=changes.append)
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(len(changes), 2)
+        self.assertFalse(Product.objects.exists())
+
+    def test_invalid_rows_are_skipped(self):
+        text = CSV + "103,Шина,autumn,205,91,55,V,16,X,Y,,100,true,\n104,Шина,summer,abc,91,55,V,16,X,Y,,100,true,\n"
+        stats = import_text(text)
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(len(stats["errors"]), 2)
+        self.assertIn("Строка 4", stats["errors"][0])
+
+    def test_jsonl(self):
+        row = {"product_code": 201, "name": "Шина", "season": "summer", "width": 205, "load_index": 91,
+               "profile": 55, "speed_index": "V", "diameter": 16, "tire_model": "X", "manufacturer": "Y",
+               "price": 100, "visible": False}
+        stats = import_text(json.dumps(row) + "\n", "jsonl")
+        self.assertEqual(stats["created"], 1)
+        self.assertFalse(Product.objects.get(product_code=201).visible)
+
+    def test_jsonl_invalid_lines_are_skipped(self):
+        row = {"product_code": 201, "name": "Шина", "season": "summer", "width": 205, "load_index": 91,
+               "profile": 55, "speed_index": "V", "diameter": 16, "tire_model": "X", "manufacturer": "Y",
+               "price": 100}
+        text = "\n".join(["{не json", "[1, 2]", '"x"', json.dumps(row)]) + "\n"
+        stats = import_text(text, "jsonl")
+        self.assertEqual((stats["rows"], stats["created"]), (4, 1))
+        self.assertEqual(len(stats["errors"]), 3)
+        self.assertIn("Строка 1: некорректный JSON", stats["errors"][0])
+        self.assertIn("Строка 2: ожидается объект JSON", stats["errors"][1])
+        self.assertIn("Строка 3", stats["errors"][2])
+
+    def test_images(self):
+        with tempfile.TemporaryDirectory() as images_dir, tempfile.TemporaryDirectory() as media:
+            with open(os.path.join(images_dir, "101.jpg"), "wb") as file:
+                file.write(b"image")
+            with override_settings(MEDIA_ROOT=media):
+                stats = import_text(CSV, images_dir=images_dir)
+                # Повторная загрузка не дублирует изображения
+                import_text(CSV, images_dir=images_dir)
+        self.assertEqual(stats["images"], 1)
+        name = ProductImage.objects.get().image.name
+        self.assertTrue(name.startswith("product_images/101/"))
+        self.assertTrue(name.endswith("/101.jpg"))
+
+    def test_images_with_same_name(self):
+        # Файлы с одинаковым именем у разных товаров не подменяют друг друга
+        text = CSV.replace(",101.jpg", ",a/101.jpg").replace("5200,true,", "5200,true,b/101.jpg")
+        with tempfile.TemporaryDirectory() as images_dir, tempfile.TemporaryDirectory() as media:
+            for directory in ("a", "b"):
+                os.mkdir(os.path.join(images_dir, directory))
+                with open(os.path.join(images_dir, directory, "101.jpg"), "wb") as file:
+                    file.write(directory.encode())
+            with override_settings(MEDIA_ROOT=media):
+                stats = import_text(text, images_dir=images_dir)
+                contents = {image.product.product_code: image.image.read()
+                            for image in ProductImage.objects.select_related("product")}
+        self.assertEqual(stats["images"], 2)
+        self.assertEqual(contents, {101: b"a", 102: b"b"})
+
+    @override_settings(IMAGE_WORKERS=0)
+    def test_changed_image_is_replaced(self):
+        with tempfile.TemporaryDirectory() as images_dir, tempfile.TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media):
+            path = os.path.join(images_dir, "101.jpg")
+            with open(path, "wb") as file:
+                file.write(jpeg(40, 30).read())
+            with self.captureOnCommitCallbacks(execute=True):
+                import_text(CSV, images_dir=images_dir)
+            image = ProductImage.objects.get()
+            with open(path, "wb") as file:
+                file.write(jpeg(50, 30).read())
+            with self.captureOnCommitCallbacks(execute=True):
+                stats = import_text(CSV, images_dir=images_dir)
+            replaced = ProductImage.objects.get()
+            self.assertEqual(stats["images"], 1)
+            self.assertEqual(replaced.id, image.id)
+            self.assertNotEqual(replaced.image.name, image.image.name)
+            self.assertEqual(Image.open(replaced.image).width, 50)
+            self.assertEqual(replaced.derivatives["source"], replaced.image.name)
+            self.assertFalse(replaced.image.storage.exists(image.image.name))
+
+    def test_export_round_trip(self):
+        import_text(CSV)
+        exported = "".join(format_rows(export_rows(chunk_size=1), "csv"))
+        stats = import_text(exported)
+        self.assertEqual((stats["created"], stats["updated"], stats["unchanged"]), (0, 0, 2))
+        rows = [json.loads(line) for line in format_rows(export_rows(), "jsonl")]
+        self.assertEqual([row["product_code"] for row in rows], [101, 102])
+
+
+def jpeg(width: int, height: int) -> ContentFile:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "JPEG")
+    return ContentFile(buffer.getvalue(), name="tyre.jpg")
+
+
+@override_settings(IMAGE_WORKERS=0, IMAGE_DERIVATIVE_WIDTHS=[100, 200, 800])
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media = override_settings(MEDIA_ROOT=self.media.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        import_text(CSV)
+        self.product = Product.objects.get(product_code=101)
+
+    def test_upload_creates_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=jpeg(400, 300))
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives["source"], image.image.name)
+        # Оригинал не увеличивается: копии только уже оригинала
+        self.assertEqual(sorted(image.derivatives["webp"], key=int), ["100", "200"])
+        storage = ProductImage._meta.get_field("image").storage
+        with storage.open(image.derivatives["jpeg"]["100"]) as file, Image.open(file) as thumbnail:
+            self.assertEqual(thumbnail.size, (100, 75))
+        srcset = image_srcset(image.derivatives)
+        self.assertTrue(srcset["webp"].endswith(" 200w"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(storage.exists(image.derivatives["webp"]["100"]))
+
+    def test_backfill(self):
+        storage = ProductImage._meta.get_field("image").storage
+        name = storage.save("product_images/small.jpg", jpeg(50, 40))
+        ProductImage.objects.bulk_create([ProductImage(product=self.product, image=name)])
+        call_command("build_image_derivatives", workers=1, stdout=io.StringIO())
+        derivatives = ProductImage.objects.get().derivatives
+        self.assertEqual(list(derivatives["jpeg"]), ["50"])
+
+        # Повторное создание не оставляет прежних файлов
+        call_command("build_image_derivatives", workers=1, all=True, stdout=io.StringIO())
+        rebuilt = ProductImage.objects.get().derivatives
+        self.assertTrue(storage.exists(rebuilt["jpeg"]["50"]))
+        self.assertEqual(len(os.listdir(os.path.join(self.media.name, "product_images", "derived"))), 2)
+
+    def test_import_creates_derivatives(self):
+        with tempfile.TemporaryDirectory() as images_dir:
+            with open(os.path.join(images_dir, "101.jpg"), "wb") as file:
+                file.write(jpeg(300, 200).read())
+            with self.captureOnCommitCallbacks(execute=True):
+                import_text(CSV, images_dir=images_dir)
+        image = ProductImage.objects.get(product=self.product)
+        self.assertEqual(image.derivatives["source"], image.image.name)
+        self.assertEqual(sorted(image.derivatives["jpeg"], key=int), ["100", "200"])
+
+    def test_same_file_name(self):
+        storage = ProductImage._meta.get_field("image").storage
+        first = storage.save("product_images/a/tyre.jpg", jpeg(400, 300))
+        second = storage.save("product_images/b/tyre.jpg", jpeg(200, 100))
+        with self.captureOnCommitCallbacks(execute=True):
+            images = [ProductImage.objects.create(product=self.product, image=name) for name in (first, second)]
+        for image in images:
+            image.refresh_from_db()
+        names = {image.derivatives["jpeg"]["100"] for image in images}
+        self.assertEqual(len(names), 2)
+        with storage.open(images[0].derivatives["jpeg"]["100"]) as file, Image.open(file) as thumbnail:
+            self.assertEqual(thumbnail.size, (100, 75))
+
+        # Удаление одного изображения не затрагивает копии другого
+        with self.captureOnCommitCallbacks(execute=True):
+            images[0].delete()
+        self.assertTrue(storage.exists(images[1].derivatives["jpeg"]["100"]))
+
+
+# Хранилище статических файлов без манифеста: страницы админки не зависят от STATIC_MANIFEST и collectstatic
+PLAIN_STATIC_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+MANIFEST_STATIC_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "shop.staticfiles.CompressedManifestStaticFilesStorage"},
+}
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class CatalogAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+
+    def test_import_view(self):
+        url = reverse("admin:shop_product_import")
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(url, {"file": SimpleUploadedFile("catalog.csv", CSV.encode()), "dry_run": "on"})
+        self.assertContains(response, "+ 101")
+        self.assertFalse(Product.objects.exists())
+        self.client.post(url, {"file": SimpleUploadedFile("catalog.csv", CSV.encode())})
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_export_action(self):
+        import_text(CSV)
+        response = self.client.post(reverse("admin:shop_product_changelist"), {
+            "action": "export_catalog",
+            "_selected_action": list(Product.objects.values_list("id", flat=True)),
+        })
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(content.splitlines()[0].split(",")[0], "product_code")
+        self.assertEqual(len(content.splitlines()), 3)
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        static = override_settings(STATIC_ROOT=self.root.name, SERVE_STATIC=True)
+        static.enable()
+        self.addCleanup(static.disable)
+        os.makedirs(os.path.join(self.root.name, "assets"))
+        self.script = b"console.log('cartire');\n" * 100
+        for name, content in [("assets/index-AbCd12_z.js", self.script), ("app.js", self.script), ("logo.png", b"png")]:
+            with open(os.path.join(self.root.name, name), "wb") as file:
+                file.write(content)
+
+    def test_compress(self):
+        created = compress_directory(self.root.name)
+        self.assertIn(os.path.join(self.root.name, "app.js.gz"), created)
+        self.assertFalse(os.path.exists(os.path.join(self.root.name, "logo.png.gz")))
+        # Сжатые копии новее оригиналов и повторно не создаются
+        self.assertEqual(compress_directory(self.root.name), [])
+
+    def test_serve(self):
+        compress_directory(self.root.name)
+        response = self.client.get("/assets/index-AbCd12_z.js", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("javascript", response["Content-Type"])
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), self.script)
+        response = self.client.get("/assets/index-AbCd12_z.js", HTTP_ACCEPT_ENCODING="gzip",
+                                   HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get("/static/app.js")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertEqual(b"".join(response.streaming_content), self.script)
+        # Выход за пределы STATIC_ROOT и отсутствующие файлы - оболочка SPA из handler404
+        for path in ["/static/../manage.py", "/static/missing.js"]:
+            self.assertNotIsInstance(self.client.get(path), FileResponse)
+
+    def test_manifest_storage(self):
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        with open(os.path.join(source.name, "site.css"), "w") as file:
+            file.write("body { color: red; }\n" * 50)
+        collect = override_settings(STORAGES=MANIFEST_STATIC_STORAGES, STATICFILES_DIRS=[source.name],
+                                    STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"])
+        collect.enable()
+        self.addCleanup(collect.disable)
+        self.addCleanup(hashed_names.cache_clear)
+        call_command("collectstatic", interactive=False, verbosity=0)
+        hashed_names.cache_clear()
+
+        url = static("site.css")
+        self.assertRegex(url, r"^/static/site\.[0-9a-f]{12}\.css$")
+        self.assertTrue(os.path.exists(os.path.join(self.root.name, url.removeprefix("/static/") + ".gz")))
+        response = self.client.get(url)
+        self.assertIn("immutable", response["Cache-Control"])
+        # Файл, добавленный в STATIC_ROOT после collectstatic, не ломает страницы (manifest_strict = False)
+        self.assertRegex(static("app.js"), r"^/static/app\.[0-9a-f]{12}\.js$")
+
+    def test_index(self):
+        response = self.client.get("/")
+        self.assertContains(response, '<div id="root">')
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
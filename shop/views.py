@@ -1,11 +1,79 @@
-from django.shortcuts import render
-from django.http import HttpResponseRedirect
+import hashlib
+import mimetypes
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
 from django.core.handlers.wsgi import WSGIRequest
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect
+from django.template.loader import render_to_string
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .staticfiles import is_immutable, negotiate
+
+# Файлы с хэшем в имени кэшируются браузером на год без перепроверки
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@lru_cache(maxsize=None)
+def index_page() -> tuple[bytes, str]:
+    """
+    HTML оболочки SPA и его ETag. Страница не зависит от запроса, поэтому рендерится один раз на процесс.
+    """
+    content = render_to_string("shop/index.html").encode()
+    return content, f'"{hashlib.md5(content).hexdigest()}"'
 
 
 def index(request: WSGIRequest, exception=None):
-    return render(request, "shop/index.html")
+    if settings.DEBUG:
+        # При разработке шаблон перечитывается на каждый запрос
+        index_page.cache_clear()
+    content, etag = index_page()
+    response = HttpResponse(content)
+    response["ETag"] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
 
 
 def redirect_to_index(request, exception=None):
     return HttpResponseRedirect('/')
+
+
+def static_file(request: WSGIRequest, path: str, prefix: str = ""):
+    """
+    Отдает файл из STATIC_ROOT без отдельного веб-сервера (настройка SERVE_STATIC).
+    Если клиент принимает brotli или gzip и collectstatic создал сжатую копию, отдается она.
+    Файлы с хэшем в имени кэшируются навсегда (immutable), остальные перепроверяются по ETag.
+    FileResponse передает файл WSGI-серверу через wsgi.file_wrapper (sendfile), без чтения в Python.
+    """
+    if not settings.SERVE_STATIC or not settings.STATIC_ROOT:
+        raise Http404
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    name = f"{prefix}/{path}" if prefix else path
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    encoding, served_path = negotiate(request, full_path)
+    stat = os.stat(served_path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type, _ = mimetypes.guess_type(full_path)
+        response = FileResponse(open(served_path, "rb"), content_type=content_type or "application/octet-stream",
+                                filename=os.path.basename(full_path))
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    patch_vary_headers(response, ("Accept-Encoding",))
+    if is_immutable(name):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response